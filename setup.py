@@ -24,15 +24,21 @@ setup(name="stratumgs",
             "Topic :: Games/Entertainment :: Turn Based Strategy"
       ],
       entry_points={
-            "console_scripts": ["stratumgs=stratumgs:main"]
+            "console_scripts": ["stratumgs=stratumgs:main",
+                                "stratumgs-worker=stratumgs.game.worker:main",
+                                "stratumgs-benchmark=stratumgs.benchmark:main",
+                                "stratumgs-selfplay=stratumgs.selfplay:main"]
       },
       keywords=["stratumgs", "stratum", "game", "server", "turn", "based",
-                "board", "ai", "autonomous", "tictactoe"],
+                "board", "ai", "autonomous", "tictactoe", "gomoku"],
       url="https://stratumgs.org",
       author="David Korhumel",
       author_email="dpk2442@gmail.com",
       license="MIT",
       packages=find_packages(),
       install_requires=["tornado"],
+      extras_require={
+            "msgpack": ["msgpack"]
+      },
       include_package_data=True,
       zip_safe=False)
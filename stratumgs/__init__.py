@@ -2,6 +2,15 @@ import tornado.ioloop
 
 import stratumgs.client.server
 import stratumgs.config
+import stratumgs.game
+import stratumgs.game.pool
+import stratumgs.game.records
+import stratumgs.game.remote
+import stratumgs.game.replay
+import stratumgs.game.scheduler
+import stratumgs.metrics
+import stratumgs.shard
+import stratumgs.tracing
 import stratumgs.web
 
 
@@ -14,6 +23,42 @@ def main():
     web_port = stratumgs.config.get("web_server", "port")
     client_host = stratumgs.config.get("client_server", "host")
     client_port = stratumgs.config.get("client_server", "port")
-    stratumgs.client.server.init(client_host, client_port)
+    client_shards = stratumgs.config.get("client_server", "shards")
+    client_reuse_port = stratumgs.config.get("client_server", "reuse_port")
+    worker_host = stratumgs.config.get("engine_workers", "host")
+    worker_port = stratumgs.config.get("engine_workers", "port")
+    worker_secret = stratumgs.config.get("engine_workers", "secret")
+    pool_size = stratumgs.config.get("engine_pool", "size")
+    pool_max_games = stratumgs.config.get("engine_pool", "max_games_per_worker")
+    records_path = stratumgs.config.get("game_records", "path")
+    max_finished_games = stratumgs.config.get("game_records", "max_finished_games")
+    replay_directory = stratumgs.config.get("replays", "directory")
+    tournament_game = stratumgs.config.get("tournament", "game")
+    tournament_pairing = stratumgs.config.get("tournament", "pairing")
+    tournament_max_games = stratumgs.config.get("tournament", "max_games")
+    metrics_enabled = stratumgs.config.get("metrics", "enabled")
+    metrics_lag_interval = stratumgs.config.get("metrics", "ioloop_lag_interval")
+    tracing_enabled = stratumgs.config.get("tracing", "enabled")
+    tracing_max_events = stratumgs.config.get("tracing", "max_events_per_game")
+    stratumgs.metrics.init(metrics_enabled)
+    stratumgs.tracing.init(tracing_enabled, tracing_max_events)
+    if client_shards > 1:
+        # shards are forked, so they must be started before the IOLoop exists
+        stratumgs.shard.init(client_shards, client_host, client_port, client_reuse_port,
+                             pool_size, pool_max_games)
+    else:
+        stratumgs.game.pool.init(pool_size, pool_max_games)
+    stratumgs.game.records.init(records_path)
+    stratumgs.game.replay.init(replay_directory)
+    stratumgs.game.init(max_finished_games)
+    stratumgs.game.remote.init(worker_host, worker_port, worker_secret)
+    if client_shards <= 1:
+        stratumgs.client.server.init(client_host, client_port)
     stratumgs.web.init(web_host, web_port, debug)
+    if metrics_enabled:
+        stratumgs.metrics.add_collector(stratumgs.client.server.collect_client_metrics)
+        stratumgs.metrics.monitor_ioloop_lag(metrics_lag_interval)
+    if tournament_game:
+        stratumgs.game.scheduler.start_tournament(
+            tournament_game, tournament_pairing, tournament_max_games)
     tornado.ioloop.IOLoop.current().start()
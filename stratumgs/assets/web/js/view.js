@@ -2,7 +2,42 @@
     'use strict';
 
     var socket_url,
-        web_socket;
+        web_socket,
+        state = null;
+
+    function unescapeKey(key) {
+        return key.replace(/~1/g, '/').replace(/~0/g, '~');
+    }
+
+    function applyPatch(doc, ops) {
+        ops.forEach(function (op) {
+            var keys, parent, key, i;
+            if (op["path"] === "") {
+                doc = op["value"];
+                return;
+            }
+            keys = op["path"].split('/').slice(1).map(unescapeKey);
+            parent = doc;
+            for (i = 0; i < keys.length - 1; i++) {
+                parent = parent[keys[i]];
+            }
+            key = keys[keys.length - 1];
+            if (Array.isArray(parent)) {
+                if (op["op"] === "add") {
+                    parent.splice(key === '-' ? parent.length : +key, 0, op["value"]);
+                } else if (op["op"] === "remove") {
+                    parent.splice(+key, 1);
+                } else {
+                    parent[+key] = op["value"];
+                }
+            } else if (op["op"] === "remove") {
+                delete parent[key];
+            } else {
+                parent[key] = op["value"];
+            }
+        });
+        return doc;
+    }
 
     if (window.location.protocol === 'https:') {
         socket_url = 'wss:';
@@ -10,16 +45,19 @@
         socket_url = 'ws:';
     }
     socket_url += '//' + window.location.host;
-    socket_url += window.location.pathname + '/socket';
+    socket_url += window.location.pathname + '/socket' + window.location.search;
 
     web_socket = new WebSocket(socket_url);
     web_socket.onmessage = function (msg) {
-        var obj = JSON.parse(msg.data),
-            state;
-        if (obj["type"] !== "message") {
+        var obj = JSON.parse(msg.data);
+        if (obj["type"] === "message") {
+            state = obj["payload"];
+        } else if (obj["type"] === "delta") {
+            state = applyPatch(state, obj["payload"]);
+        } else {
             throw new Error("Invalid message received from server.");
         }
-        StratumGSView.onstate(JSON.parse(obj["payload"]));
+        StratumGSView.onstate(state);
     };
 
 })();
@@ -0,0 +1,392 @@
+"""
+.. module stratumgs.benchmark
+
+A headless benchmark of the server. The client server and the engines run in
+this process, without the web server, game records, or replays, and a number
+of synthetic clients, which play TicTacToe with random moves, run in a child
+process and connect over the loopback interface. The clients are paired into
+games by a round robin tournament until the requested number of games has been
+played, and the throughput, the turn latency seen by the clients, and the CPU
+time and memory used by the server are reported.
+
+The turn latency is the time from a client sending its move until it receives
+the state that results from it, which covers relaying the move to the engine,
+the engine playing it, and relaying the new state back. The CPU time and memory
+are those of this process, so engines that run in the engine pool are not
+counted.
+"""
+
+import argparse
+import json
+import math
+import multiprocessing
+import random
+import resource
+import time
+
+import tornado.gen
+import tornado.ioloop
+import tornado.iostream
+import tornado.netutil
+import tornado.tcpclient
+
+import stratumgs.client.registry
+import stratumgs.client.server
+import stratumgs.config
+import stratumgs.game
+import stratumgs.game.pool
+import stratumgs.game.records
+import stratumgs.game.replay
+import stratumgs.game.scheduler
+import stratumgs.protocol
+
+
+# The game played by the synthetic clients
+GAME = "tictactoe"
+
+# The number of seconds between checks of whether the benchmark is done
+_POLL_INTERVAL = 0.01
+
+
+def get_percentile(values, fraction):
+    """
+        Get a percentile of some values, using the nearest rank.
+
+        :param values: The values.
+        :type values: list(float)
+        :param fraction: The percentile, as a fraction between 0 and 1.
+        :type fraction: float
+        :returns: The value at the percentile, or 0 if there are no values.
+    """
+
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = max(0, math.ceil(fraction * len(values)) - 1)
+    return values[index]
+
+
+class RandomTicTacToeClient(object):
+    """
+        A synthetic client that plays TicTacToe by choosing a random empty space
+        whenever it is asked to move. It speaks the client protocol described
+        in :doc:`/protocols`, and records the latency of each of its turns.
+
+        :param name: The name the client asks for.
+        :type name: string
+        :param max_games: The maximum number of simultaneous games.
+        :type max_games: int
+        :param framing: The framing the client asks for.
+        :type framing: string
+        :param protocol_version: The protocol version the client asks for.
+        :type protocol_version: int
+    """
+
+    def __init__(self, name, max_games, framing=stratumgs.protocol.JSON_LINES_FRAMING,
+                 protocol_version=2):
+        self.name = name
+        self.max_games = max_games
+        self.framing = framing
+        self.protocol_version = protocol_version
+        self.turn_latencies = []
+        self._stream = None
+        self._boards = {}
+        self._move_times = {}
+
+    @tornado.gen.coroutine
+    def run(self, host, port):
+        """
+            Connect to the server, and play games until the server closes the
+            connection.
+
+            :param host: The host of the client server.
+            :type host: string
+            :param port: The port of the client server.
+            :type port: int
+            :returns: A :class:`tornado.concurrent.Future` that resolves when
+                      the connection is closed.
+        """
+
+        self._stream = yield tornado.tcpclient.TCPClient().connect(host, port)
+        self._stream.set_nodelay(True)
+        self._stream.write("{}\n".format(json.dumps({
+            "type": "connect",
+            "name": self.name,
+            "supported_games": [GAME],
+            "max_games": self.max_games,
+            "framing": self.framing,
+            "protocol_version": self.protocol_version
+        })).encode())
+        try:
+            response = json.loads((yield self._stream.read_until(b"\n")).decode())
+            self.protocol_version = response["protocol_version"]
+            while True:
+                frame_type, game_id, payload = yield self._read_message()
+                self._on_message(frame_type, game_id, payload)
+        except tornado.iostream.StreamClosedError:
+            pass
+
+    @tornado.gen.coroutine
+    def _read_message(self):
+        """
+            Read the next message from the server.
+
+            :returns: A :class:`tornado.concurrent.Future` that resolves to the
+                      frame type, the game ID, and the decoded payload, or
+                      ``None`` if the message has no payload.
+        """
+
+        if self.framing == stratumgs.protocol.LENGTH_PREFIXED_FRAMING:
+            header = yield self._stream.read_bytes(stratumgs.protocol.HEADER.size)
+            frame_type, game_id, length = stratumgs.protocol.HEADER.unpack(header)
+            payload = None
+            if length:
+                payload = json.loads((yield self._stream.read_bytes(length)).decode())
+            return frame_type, game_id, payload
+        message = json.loads((yield self._stream.read_until(b"\n")).decode())
+        payload = message.get("payload")
+        if payload is not None and self.protocol_version < 2:
+            payload = json.loads(payload)
+        return stratumgs.protocol.TYPES[message["type"]], message.get("game_id"), payload
+
+    def _send_move(self, game_id, move):
+        """
+            Send a move to the engine of a game.
+
+            :param game_id: The ID of the game.
+            :type game_id: int
+            :param move: The move.
+            :type move: dict
+        """
+
+        if self.framing == stratumgs.protocol.LENGTH_PREFIXED_FRAMING:
+            data = stratumgs.protocol.encode_frame(
+                stratumgs.protocol.MESSAGE, game_id, json.dumps(move).encode())
+        else:
+            payload = move if self.protocol_version >= 2 else json.dumps(move)
+            data = "{}\n".format(json.dumps({
+                "type": "message",
+                "game_id": game_id,
+                "payload": payload
+            })).encode()
+        self._move_times[game_id] = time.monotonic()
+        self._stream.write(data)
+
+    def _on_message(self, frame_type, game_id, payload):
+        """
+            Handle a message from the server.
+
+            :param frame_type: The type of the message.
+            :type frame_type: int
+            :param game_id: The ID of the game the message is for.
+            :type game_id: int
+            :param payload: The decoded payload.
+        """
+
+        if frame_type == stratumgs.protocol.CLOSE:
+            self._boards.pop(game_id, None)
+            self._move_times.pop(game_id, None)
+        elif frame_type == stratumgs.protocol.MESSAGE:
+            if payload["type"] == "state":
+                self._boards[game_id] = payload["board"]
+                move_time = self._move_times.pop(game_id, None)
+                if move_time is not None:
+                    self.turn_latencies.append(time.monotonic() - move_time)
+            elif payload["type"] in ("turn", "repeat-turn"):
+                board = self._boards[game_id]
+                empty = [(row, column) for row in range(3) for column in range(3)
+                         if board[row][column] is None]
+                row, column = random.choice(empty)
+                self._send_move(game_id, {"row": row, "column": column})
+
+
+def _clients_main(port, num_clients, max_games, framing, protocol_version, connection):
+    """
+        The main function of the child process that runs the synthetic clients.
+        The turn latencies of every client are sent to the parent once the
+        server has closed their connections.
+
+        :param port: The port of the client server.
+        :type port: int
+        :param num_clients: The number of clients.
+        :type num_clients: int
+        :param max_games: The maximum number of simultaneous games per client.
+        :type max_games: int
+        :param framing: The framing the clients use.
+        :type framing: string
+        :param protocol_version: The protocol version the clients use.
+        :type protocol_version: int
+        :param connection: The child end of the pipe to the parent.
+        :type connection: :class:`multiprocessing.connection.Connection`
+    """
+
+    clients = [RandomTicTacToeClient("bot-{}".format(i), max_games, framing, protocol_version)
+               for i in range(num_clients)]
+
+    @tornado.gen.coroutine
+    def run_clients():
+        yield [client.run("127.0.0.1", port) for client in clients]
+
+    tornado.ioloop.IOLoop.current().run_sync(run_clients)
+    connection.send([latency for client in clients for latency in client.turn_latencies])
+    connection.close()
+
+
+@tornado.gen.coroutine
+def _wait_until(condition):
+    """
+        Wait until a condition is true, checking it periodically.
+
+        :param condition: A function that returns whether the condition is
+                          true.
+        :type condition: function
+        :returns: A :class:`tornado.concurrent.Future` that resolves once the
+                  condition is true.
+    """
+
+    while not condition():
+        yield tornado.gen.sleep(_POLL_INTERVAL)
+
+
+@tornado.gen.coroutine
+def _play_games(num_clients, num_games):
+    """
+        Wait for every synthetic client to connect, play the games, and then
+        disconnect the clients.
+
+        :param num_clients: The number of clients.
+        :type num_clients: int
+        :param num_games: The number of games to play.
+        :type num_games: int
+        :returns: A :class:`tornado.concurrent.Future` that resolves to the
+                  wall clock time, user CPU time, and system CPU time, in
+                  seconds, taken to play the games.
+    """
+
+    yield _wait_until(lambda: len(stratumgs.client.registry.get_clients()) >= num_clients)
+    start_usage = resource.getrusage(resource.RUSAGE_SELF)
+    start_time = time.monotonic()
+    tournament = stratumgs.game.scheduler.start_tournament(GAME, "round-robin", num_games)
+    yield _wait_until(lambda: tournament.num_finished_games >= num_games)
+    elapsed = time.monotonic() - start_time
+    end_usage = resource.getrusage(resource.RUSAGE_SELF)
+    for client in list(stratumgs.client.registry.get_clients()):
+        client.stream.disconnect()
+    return (elapsed, end_usage.ru_utime - start_usage.ru_utime,
+            end_usage.ru_stime - start_usage.ru_stime)
+
+
+def run_benchmark(num_clients, num_games, concurrency,
+                  framing=stratumgs.protocol.JSON_LINES_FRAMING, protocol_version=2):
+    """
+        Run the benchmark. Must be called before the IOLoop is created, since
+        the synthetic clients and the engine pool are forked from this process.
+
+        :param num_clients: The number of synthetic clients.
+        :type num_clients: int
+        :param num_games: The number of games to play.
+        :type num_games: int
+        :param concurrency: The number of games played at once.
+        :type concurrency: int
+        :param framing: The framing the clients use.
+        :type framing: string
+        :param protocol_version: The protocol version the clients use.
+        :type protocol_version: int
+        :returns: The results, with the number of games, the elapsed seconds,
+                  the games per second, the number of turns, the 50th and 99th
+                  percentile turn latencies in seconds, the user and system CPU
+                  seconds, and the peak resident set size in kilobytes.
+        :rtype: dict
+    """
+
+    # every game takes a slot from two clients
+    max_games = max(1, math.ceil(2 * concurrency / num_clients))
+    sockets = tornado.netutil.bind_sockets(0, "127.0.0.1", backlog=max(128, num_clients))
+    port = sockets[0].getsockname()[1]
+
+    connection, child_connection = multiprocessing.Pipe()
+    clients_process = multiprocessing.Process(
+        target=_clients_main,
+        args=(port, num_clients, max_games, framing, protocol_version, child_connection))
+    clients_process.daemon = True
+    clients_process.start()
+    child_connection.close()
+
+    stratumgs.game.pool.init(stratumgs.config.get("engine_pool", "size"),
+                             stratumgs.config.get("engine_pool", "max_games_per_worker"))
+    stratumgs.game.records.init("")
+    stratumgs.game.replay.init("")
+    stratumgs.game.init(concurrency)
+    server = stratumgs.client.server.ClientProxyServer()
+    server.add_sockets(sockets)
+
+    elapsed, user_time, system_time = tornado.ioloop.IOLoop.current().run_sync(
+        lambda: _play_games(num_clients, num_games))
+    server.stop()
+    latencies = connection.recv()
+    clients_process.join()
+
+    return {
+        "games": num_games,
+        "seconds": elapsed,
+        "games_per_second": num_games / elapsed if elapsed else 0.0,
+        "turns": len(latencies),
+        "turn_latency_p50": get_percentile(latencies, 0.5),
+        "turn_latency_p99": get_percentile(latencies, 0.99),
+        "cpu_user_seconds": user_time,
+        "cpu_system_seconds": system_time,
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    }
+
+
+def format_results(results):
+    """
+        Format the results of a benchmark for display.
+
+        :param results: The results, as returned by :func:`run_benchmark`.
+        :type results: dict
+        :returns: The formatted results.
+        :rtype: string
+    """
+
+    cpu_seconds = results["cpu_user_seconds"] + results["cpu_system_seconds"]
+    cpu_percent = 100 * cpu_seconds / results["seconds"] if results["seconds"] else 0.0
+    return "\n".join((
+        "Games:        {games} in {seconds:.2f} s ({games_per_second:.1f} games/s)",
+        "Turns:        {turns}",
+        "Turn latency: p50 {p50:.2f} ms, p99 {p99:.2f} ms",
+        "Server CPU:   {cpu_user_seconds:.2f} s user, {cpu_system_seconds:.2f} s system "
+        "({cpu_percent:.0f}% of one core)",
+        "Server RSS:   {max_rss_mb:.1f} MiB peak"
+    )).format(p50=results["turn_latency_p50"] * 1000, p99=results["turn_latency_p99"] * 1000,
+              cpu_percent=cpu_percent, max_rss_mb=results["max_rss_kb"] / 1024, **results)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the StratumGS server with synthetic TicTacToe clients.")
+    parser.add_argument("--clients", type=int, default=20,
+                        help="the number of synthetic clients")
+    parser.add_argument("--games", type=int, default=1000,
+                        help="the number of games to play")
+    parser.add_argument("--concurrency", type=int, default=50,
+                        help="the number of games to play at once")
+    parser.add_argument("--framing", default=stratumgs.protocol.JSON_LINES_FRAMING,
+                        choices=(stratumgs.protocol.JSON_LINES_FRAMING,
+                                 stratumgs.protocol.LENGTH_PREFIXED_FRAMING),
+                        help="the framing the clients use")
+    parser.add_argument("--protocol-version", type=int, default=2,
+                        choices=stratumgs.protocol.PROTOCOL_VERSIONS,
+                        help="the protocol version the clients use")
+    parser.add_argument("--json", action="store_true",
+                        help="print the results as JSON")
+    args = parser.parse_args()
+    if args.clients < 2:
+        parser.error("at least two clients are needed")
+
+    results = run_benchmark(args.clients, args.games, args.concurrency, args.framing,
+                            args.protocol_version)
+    if args.json:
+        print(json.dumps(results, indent=4, sort_keys=True))
+    else:
+        print(format_results(results))
@@ -4,33 +4,41 @@
 Proxies clients for the game engines.
 """
 
+import functools
 import json
-import os
-
-import tornado.concurrent
-import tornado.ioloop
-import tornado.iostream
-import tornado.netutil
-import tornado.tcpserver
 
+import stratumgs.client.registry
+import stratumgs.codec
 import stratumgs.game
+import stratumgs.game.engine.local
+import stratumgs.game.scheduler
+import stratumgs.metrics
+import stratumgs.protocol
+import stratumgs.shard
+import stratumgs.tracing
 
 
-def _make_pipe_pair():
+class ClientProxy(object):
     """
-        Make two pipes, and return tuples of the read and write pairs.
+        Proxies the raw client stream for the game engine.
 
-        :returns: Read/write pairs for the two pipes.
-    """
+        Messages from engines arrive as frames, as described in
+        :mod:`stratumgs.protocol`, and are routed using only the frame header.
+        If the client uses length-prefixed framing, frames are passed between
+        the client and the engines without decoding their payloads.
 
-    r1, w1 = os.pipe()
-    r2, w2 = os.pipe()
-    return (r1, w2), (r2, w1)
+        Reading from the engines of the client's games is paused while the
+        stream has too much data waiting to be sent to the client, so that a
+        slow client holds back its games instead of making the server buffer
+        their states. The engines keep running while they are not read from, so
+        the data they write in the meantime counts toward the stream's maximum
+        buffer size, and a client that stops reading is still handled by the
+        stream's slow client policy. A client that sends more to an engine than
+        the engine has read, beyond the stream's maximum buffer size, is
+        disconnected.
 
-
-class ClientProxy(object):
-    """
-        Proxies the raw client stream for the game engine.
+        The messages and bytes passing through the proxy are counted in
+        ``traffic``, and for each game in progress in ``game_traffic``.
 
         :param name: The client name.
         :type name: string
@@ -38,15 +46,35 @@ class ClientProxy(object):
         :type max_games: int
         :param stream: The raw client stream.
         :type stream: :class:`tornado.iostream.IOStream`
+        :param framing: The framing used by the client.
+        :type framing: string
+        :param protocol_version: The version of the JSON lines protocol used by
+                                 the client.
+        :type protocol_version: int
+        :param codec: The name of the codec used for the client's payloads.
+        :type codec: string
+        :param accepts_deltas: Whether the client accepts state deltas.
+        :type accepts_deltas: boolean
     """
 
-    def __init__(self, name, supported_games, max_games, stream):
+    def __init__(self, name, supported_games, max_games, stream,
+                 framing=stratumgs.protocol.JSON_LINES_FRAMING, protocol_version=1,
+                 codec=stratumgs.codec.DEFAULT_CODEC, accepts_deltas=False):
         self.name = name
         self.supported_games = supported_games
         self.max_games = max_games
         self.games_available = max_games
         self.stream = stream
+        self.framing = framing
+        self.protocol_version = protocol_version
+        self.codec = codec
+        self.accepts_deltas = accepts_deltas
         self.helpers = {}
+        self.num_games_finished = 0
+        self._engine_reads_paused = False
+        self._paused_engine_reads = []
+        self.traffic = stratumgs.metrics.TrafficStats()
+        self.game_traffic = {}
 
         self.supported_games_display = []
         for game in supported_games:
@@ -58,137 +86,258 @@ class ClientProxy(object):
         self.supported_games_display.sort()
 
         def stream_closed():
-            for helper in self.helpers.values():
-                helper.write_to_engine("{}\n".format(json.dumps({
-                    "type": "close"
-                })).encode())
+            for game_id, helper in self.helpers.items():
+                helper.write_to_engine(
+                    stratumgs.protocol.encode_frame(stratumgs.protocol.CLOSE, game_id))
                 helper.close_engine_connection_endpoints()
 
         def message_from_client(msg):
+            self.traffic.record_in(len(msg))
             obj = json.loads(msg.decode().strip())
             if obj["type"] == "close":
                 self.stream.close()
                 return
             if obj["game_id"] in self.helpers:
-                self.helpers[obj["game_id"]].write_to_engine(msg)
+                self.game_traffic[obj["game_id"]].record_in(len(msg))
+                stratumgs.tracing.record(obj["game_id"], "client reply", self.name)
+                if self.protocol_version >= 2:
+                    payload = json.dumps(obj["payload"])
+                else:
+                    payload = obj["payload"]
+                if not self._write_to_engine(obj["game_id"], stratumgs.protocol.encode_frame(
+                        stratumgs.protocol.MESSAGE, obj["game_id"], payload.encode())):
+                    return
             self.stream.read_until(b"\n", message_from_client)
 
+        def frame_from_client(frame_type, game_id, payload):
+            num_bytes = stratumgs.protocol.HEADER.size + len(payload)
+            self.traffic.record_in(num_bytes)
+            if frame_type == stratumgs.protocol.CLOSE:
+                self.stream.close()
+                return
+            if frame_type != stratumgs.protocol.MESSAGE:
+                # clients only send moves, so any other frame is a protocol
+                # error, which would otherwise reach the engine
+                print("Client {} sent an unexpected {} frame, disconnecting.".format(
+                    self.name, stratumgs.protocol.TYPE_NAMES.get(frame_type, frame_type)))
+                self.stream.close()
+                return
+            if game_id in self.helpers:
+                self.game_traffic[game_id].record_in(num_bytes)
+                stratumgs.tracing.record(game_id, "client reply", self.name)
+                if not self._write_to_engine(
+                        game_id, stratumgs.protocol.encode_frame(frame_type, game_id, payload)):
+                    return
+            stratumgs.protocol.read_frame(self.stream.read_bytes, frame_from_client)
+
         self.stream.set_close_callback(stream_closed)
-        self.stream.read_until(b"\n", message_from_client)
+        self.stream.set_flow_control_callbacks(self._pause_engine_reads,
+                                               self._resume_engine_reads)
+        self.stream.set_pending_size_function(self._get_engine_buffered_size)
+        if self.framing == stratumgs.protocol.LENGTH_PREFIXED_FRAMING:
+            stratumgs.protocol.read_frame(self.stream.read_bytes, frame_from_client)
+        else:
+            self.stream.read_until(b"\n", message_from_client)
 
-    def is_available(self):
+    def _write_to_engine(self, game_id, frame):
         """
-            Determine whether the client has game slots available.
+            Write a frame from the client to the engine of a game. If the
+            engine has fallen too far behind reading the client's frames, the
+            client is disconnected instead.
 
-            :returns: Whether the client has game slots available.
+            :param game_id: The ID of the game.
+            :type game_id: int
+            :param frame: The encoded frame.
+            :type frame: :class:`bytes`
+            :returns: Whether the client is still connected.
         """
 
-        return self.games_available > 0
+        helper = self.helpers[game_id]
+        max_buffer_size = self.stream.max_buffer_size
+        if max_buffer_size and helper.get_unread_size() + len(frame) > max_buffer_size:
+            print("Client {} sent too much to game {}, disconnecting.".format(self.name, game_id))
+            self.stream.disconnect()
+            return False
+        helper.write_to_engine(frame)
+        return True
 
-    def create_endpoints_for_game(self, game_id):
+    def _pause_engine_reads(self):
         """
-            Create a set of endpoints to be used by a game engine.
-
-            :param game_id: The id of the game being created.
-            :type game_id: int
-            :returns: The endpoints for the game engine to use to connect.
+            Stop reading from the engines of the client's games, because the
+            client is not keeping up with their messages.
         """
 
-        self.games_available -= 1
+        self._engine_reads_paused = True
 
-        if os.name == "posix":
-            helper = PipeClientProxyHelper()
-        else:
-            helper = SocketClientProxyHelper()
+    def _resume_engine_reads(self):
+        """
+            Resume reading from the engines of the client's games, once the
+            client has caught up.
+        """
 
-        self.helpers[game_id] = helper
+        self._engine_reads_paused = False
+        reads = self._paused_engine_reads
+        self._paused_engine_reads = []
+        for read in reads:
+            read()
 
-        def message_from_engine(msg):
-            # decode object and inject game id
-            obj = json.loads(msg.decode().strip())
-            obj["game_id"] = game_id
+    def _get_engine_buffered_size(self):
+        """
+            Get the number of bytes the engines of the client's games have
+            written that have not been read from them yet.
 
-            # encode and write object to client
-            self.stream.write("{}\n".format(json.dumps(obj)).encode())
+            :returns: The number of bytes.
+        """
 
-            # if engine closing connection, clean up endpoints,
-            # make game available, and return
-            if obj["type"] == "close":
-                helper.close_engine_connection_endpoints()
-                del self.helpers[game_id]
-                self.games_available += 1
-                return
+        return sum(helper.get_buffered_size() for helper in self.helpers.values())
 
-            # read from the engine stream again
-            helper.read_from_engine(b"\n", message_from_engine)
+    def _on_engine_data(self):
+        """
+            Check the client's buffered data against its limit when an engine
+            writes while reading from the engines is paused, since that data
+            does not reach the stream until reading resumes.
+        """
 
-        endpoints = helper.init_engine_connection_endpoints()
+        if self._engine_reads_paused:
+            self.stream.check_buffered_size()
 
-        helper.read_from_engine(b"\n", message_from_engine)
+    def _write_to_client(self, frame_type, game_id, payload=b""):
+        """
+            Write a message to the client, using the client's framing. For
+            clients that use JSON lines, the payload is never decoded. It is
+            spliced into the message as an object for protocol version 2, or
+            embedded as a string for version 1.
+
+            :param frame_type: The type of the message.
+            :type frame_type: int
+            :param game_id: The ID of the game the message is from.
+            :type game_id: int
+            :param payload: The JSON-encoded payload of the message.
+            :type payload: :class:`bytes`
+        """
 
-        self.stream.write("{}\n".format(json.dumps({
-            "type": "start",
-            "game_id": game_id
-        })).encode())
+        has_payload = frame_type in (stratumgs.protocol.MESSAGE, stratumgs.protocol.DELTA)
+        if self.framing == stratumgs.protocol.LENGTH_PREFIXED_FRAMING:
+            data = stratumgs.protocol.encode_frame(frame_type, game_id, payload)
+        elif has_payload and self.protocol_version >= 2:
+            data = b"".join((
+                '{{"type": "{}", "game_id": {}, "payload": '.format(
+                    stratumgs.protocol.TYPE_NAMES[frame_type], game_id).encode(),
+                payload,
+                b"}\n"))
+        else:
+            obj = {
+                "type": stratumgs.protocol.TYPE_NAMES[frame_type],
+                "game_id": game_id
+            }
+            if has_payload:
+                obj["payload"] = payload.decode()
+            data = "{}\n".format(json.dumps(obj)).encode()
+        self.traffic.record_out(len(data))
+        if game_id in self.game_traffic:
+            self.game_traffic[game_id].record_out(len(data))
+        if stratumgs.tracing.is_traced(game_id):
+            self.stream.write(data, lambda: stratumgs.tracing.record(
+                game_id, "client write", self.name,
+                {"type": stratumgs.protocol.TYPE_NAMES[frame_type]}))
+        else:
+            self.stream.write(data)
 
-        return endpoints
+    def is_available(self):
+        """
+            Determine whether the client has game slots available.
 
+            :returns: Whether the client has game slots available.
+        """
 
-class PipeClientProxyHelper():
-    """
-        A helper object to manage connection endpoints. This helpers uses pipes
-        to handle communication between the client and engine.
-    """
+        return self.games_available > 0
 
-    def init_engine_connection_endpoints(self):
+    def create_endpoints_for_game(self, game_id):
         """
-            Initialize the endpoints for the engine.
+            Create a set of endpoints to be used by a game engine. The
+            endpoints are an in memory stream, which is attached to a channel
+            if the engine runs in another process.
 
-            :returns: The endpoints.
+            :param game_id: The id of the game being created.
+            :type game_id: int
+            :returns: The endpoints for the game engine to use to connect,
+                      with the name of the client's codec, and whether the
+                      client accepts state deltas.
         """
 
-        client_end, engine_end = _make_pipe_pair()
-        self.to_engine = tornado.iostream.PipeIOStream(client_end[1])
-        self.from_engine = tornado.iostream.PipeIOStream(client_end[0])
-        return engine_end
+        helper = LocalClientProxyHelper()
 
-    def close_engine_connection_endpoints(self):
-        """
-            Close the endpoints to the engine.
-        """
+        def message_from_engine(frame_type, _, payload):
+            stratumgs.tracing.record(game_id, "proxy relay", self.name,
+                                     {"type": stratumgs.protocol.TYPE_NAMES[frame_type]})
+            self.write_from_engine(frame_type, game_id, payload)
 
-        self.to_engine.close()
-        self.from_engine.close()
+            # read from the engine stream again, unless the game is over, or
+            # the client has too much data waiting to be sent to it
+            if frame_type != stratumgs.protocol.CLOSE:
+                read = functools.partial(stratumgs.protocol.read_frame, helper.read_from_engine,
+                                         message_from_engine)
+                if self._engine_reads_paused:
+                    self._paused_engine_reads.append(read)
+                else:
+                    read()
 
-    def write_to_engine(self, msg):
+        endpoints = helper.init_engine_connection_endpoints()
+        helper.set_engine_data_callback(self._on_engine_data)
+
+        stratumgs.protocol.read_frame(helper.read_from_engine, message_from_engine)
+
+        self.add_game(game_id, helper)
+
+        return endpoints, self.codec, self.accepts_deltas
+
+    def add_game(self, game_id, helper):
         """
-            Write a message to the engine.
+            Start a game for the client, taking one of its game slots. Messages
+            from the client for the game are written to the helper.
 
-            :param msg: The message to write.
-            :type msg: :class:`bytes`
+            :param game_id: The id of the game.
+            :type game_id: int
+            :param helper: The helper connected to the game's engine.
         """
 
-        if not self.to_engine.closed():
-            self.to_engine.write(msg)
+        self.games_available -= 1
+        self.helpers[game_id] = helper
+        self.game_traffic[game_id] = stratumgs.metrics.TrafficStats()
+        stratumgs.client.registry.update_availability(self)
+        self._write_to_client(stratumgs.protocol.START, game_id)
 
-    def read_from_engine(self, delimeter, callback):
+    def write_from_engine(self, frame_type, game_id, payload=b""):
         """
-            Read from the engine until the given delimiter is reached. The read
-            message will be passed to the callback function.
-
-            :param delimiter: The delimiter to read until.
-            :type delimiter: :class:`bytes`
-            :param callback: The callback to call.
-            :type callback: function
+            Relay a frame from the engine of a game to the client. When the
+            engine closes the connection, the game's endpoints are cleaned up,
+            and its game slot is made available again.
+
+            :param frame_type: The type of the frame.
+            :type frame_type: int
+            :param game_id: The id of the game, which is sent to the client in
+                            place of the engine's.
+            :type game_id: int
+            :param payload: The payload of the frame.
+            :type payload: :class:`bytes`
         """
 
-        self.from_engine.read_until(delimeter, callback)
+        self._write_to_client(frame_type, game_id, payload)
+        if frame_type == stratumgs.protocol.CLOSE:
+            self.helpers.pop(game_id).close_engine_connection_endpoints()
+            self.game_traffic.pop(game_id, None)
+            self.games_available += 1
+            self.num_games_finished += 1
+            stratumgs.client.registry.update_availability(self)
+            stratumgs.game.scheduler.request_scheduling()
+            stratumgs.shard.on_client_game_finished(self)
 
 
-class SocketClientProxyHelper():
+class LocalClientProxyHelper():
     """
-        A helper object to manage connection endpoints. This helpers uses
-        sockets to handle communication between the client and engine.
+        A helper object to manage connection endpoints. This helper uses
+        in memory streams to handle communication between the client and an
+        engine running inside the server process.
     """
 
     def init_engine_connection_endpoints(self):
@@ -198,82 +347,66 @@ class SocketClientProxyHelper():
             :returns: The endpoints.
         """
 
-        self.connector_server = SingleClientServer()
-        return self.connector_server.get_port()
+        self.engine_stream, engine_end = stratumgs.game.engine.local.make_local_stream_pair()
+        return engine_end
 
     def close_engine_connection_endpoints(self):
         """
             Close the endpoints to the engine.
         """
 
-        tornado.ioloop.IOLoop.current().add_future(
-            self.connector_server.get_stream(),
-            lambda s: s.result().close())
+        self.engine_stream.close()
 
-    def write_to_engine(self, msg):
+    def get_unread_size(self):
         """
-            Write a message to the engine.
+            Get the number of bytes written to the engine that it has not read
+            yet.
 
-            :param msg: The message to write.
-            :type msg: :class:`bytes`
+            :returns: The number of bytes.
         """
 
-        def cb(s):
-            if not s.result().closed():
-                s.result().write(msg)
-        tornado.ioloop.IOLoop.current().add_future(
-            self.connector_server.get_stream(), cb)
+        return self.engine_stream.get_unread_size()
 
-    def read_from_engine(self, delimeter, callback):
+    def get_buffered_size(self):
         """
-            Read from the engine until the given delimiter is reached. The read
-            message will be passed to the callback function.
+            Get the number of bytes written by the engine that have not been
+            read from it yet, such as while reading from the engine is paused.
 
-            :param delimiter: The delimiter to read until.
-            :type delimiter: :class:`bytes`
-            :param callback: The callback to call.
-            :type callback: function
+            :returns: The number of bytes.
         """
 
-        tornado.ioloop.IOLoop.current().add_future(
-            self.connector_server.get_stream(),
-            lambda s: s.result().read_until(delimeter, callback))
+        return self.engine_stream.get_buffered_size()
 
+    def set_engine_data_callback(self, callback):
+        """
+            Set a callback to be called whenever the engine writes data.
 
-class SingleClientServer(tornado.tcpserver.TCPServer):
-    """
-        A TCP server that runs on an available port, allows a single connection,
-        and stores the single connection.
-    """
+            :param callback: The callback.
+            :type callback: function
+        """
 
-    def __init__(self):
-        super(SingleClientServer, self).__init__()
-        self._stream_future = tornado.concurrent.Future()
-        sockets = tornado.netutil.bind_sockets(0, '127.0.0.1')
-        self._port = sockets[0].getsockname()[1]
-        self.add_sockets(sockets)
-        print(sockets)
+        self.engine_stream.set_receive_callback(callback)
 
-    def get_port(self):
+    def write_to_engine(self, msg):
         """
-            Get the port of the server.
+            Write a message to the engine.
 
-            :returns: The server port.
+            :param msg: The message to write.
+            :type msg: :class:`bytes`
         """
 
-        return self._port
+        if not self.engine_stream.closed():
+            self.engine_stream.write(msg)
 
-    def handle_stream(self, stream, address):
-        if not self._stream_future.done():
-            self._stream_future.set_result(stream)
-        self.io_loop.add_callback(lambda: self.stop())
-
-    def get_stream(self):
+    def read_from_engine(self, num_bytes, callback):
         """
-            Get a future for the stream that connects.
+            Read the given number of bytes from the engine. The read data will
+            be passed to the callback function.
 
-            :returns: A :class:`tornado.concurrent.Future` that will hold the
-                      connected stream.
+            :param num_bytes: The number of bytes to read.
+            :type num_bytes: int
+            :param callback: The callback to call.
+            :type callback: function
         """
 
-        return self._stream_future
+        self.engine_stream.read_bytes(num_bytes, callback)
@@ -0,0 +1,122 @@
+"""
+.. module stratumgs.client.registry
+
+The registry of connected clients. Besides looking clients up by name, the
+registry keeps an index of the clients with free game slots for each game, which
+is updated whenever a client's availability changes, so that finding available
+opponents does not require checking every connected client.
+"""
+
+_CLIENTS = {}
+
+# The names of the clients with free game slots, by game
+_AVAILABLE_CLIENTS = {}
+
+
+def add_client(client):
+    """
+        Add a newly connected client.
+
+        :param client: The client.
+        :type client: :class:`stratumgs.client.proxy.ClientProxy`
+    """
+
+    _CLIENTS[client.name] = client
+    update_availability(client)
+
+
+def remove_client(name):
+    """
+        Remove a disconnected client.
+
+        :param name: The name of the client.
+        :type name: string
+    """
+
+    client = _CLIENTS.pop(name)
+    for game in client.supported_games:
+        _set_available(game, name, False)
+
+
+def update_availability(client):
+    """
+        Update the index after a client's number of available games changes. A
+        client that is no longer connected is ignored.
+
+        :param client: The client.
+        :type client: :class:`stratumgs.client.proxy.ClientProxy`
+    """
+
+    if _CLIENTS.get(client.name) is not client:
+        return
+    is_available = client.is_available()
+    for game in client.supported_games:
+        _set_available(game, client.name, is_available)
+
+
+def _set_available(game, name, is_available):
+    """
+        Add a client to, or remove it from, the index of a game.
+
+        :param game: The game.
+        :type game: string
+        :param name: The name of the client.
+        :type name: string
+        :param is_available: Whether the client has free game slots.
+        :type is_available: boolean
+    """
+
+    if is_available:
+        _AVAILABLE_CLIENTS.setdefault(game, set()).add(name)
+    elif game in _AVAILABLE_CLIENTS:
+        names = _AVAILABLE_CLIENTS[game]
+        names.discard(name)
+        if not names:
+            del _AVAILABLE_CLIENTS[game]
+
+
+def has_client(name):
+    """
+        Check whether a client is connected.
+
+        :param name: The name of the client.
+        :type name: string
+        :returns: Whether a client with the name is connected.
+    """
+
+    return name in _CLIENTS
+
+
+def get_client(name):
+    """
+        Get a connected client by name.
+
+        :param name: The name of the client.
+        :type name: string
+        :returns: The client.
+        :rtype: :class:`stratumgs.client.proxy.ClientProxy`
+    """
+
+    return _CLIENTS[name]
+
+
+def get_clients():
+    """
+        Get all connected clients.
+
+        :returns: A list of clients, in unspecified order.
+    """
+
+    return list(_CLIENTS.values())
+
+
+def get_available_client_names(game):
+    """
+        Get the names of the clients with free game slots that support a game.
+
+        :param game: The game.
+        :type game: string
+        :returns: A set of client names, which must not be modified.
+    """
+
+    return _AVAILABLE_CLIENTS.get(game, frozenset())
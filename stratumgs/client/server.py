@@ -5,6 +5,7 @@ The client server for stratumgs.
 """
 
 import json
+import time
 
 import tornado.ioloop
 import tornado.iostream
@@ -12,8 +13,14 @@ import tornado.concurrent
 import tornado.tcpserver
 
 import stratumgs.client.proxy
-
-_CONNECTED_CLIENTS = {}
+import stratumgs.client.registry
+import stratumgs.codec
+import stratumgs.compat
+import stratumgs.config
+import stratumgs.game.scheduler
+import stratumgs.metrics
+import stratumgs.protocol
+import stratumgs.shard
 
 
 def init(host, port):
@@ -39,8 +46,7 @@ def get_available_client_names_for_game(game):
         :type game: string
     """
 
-    return sorted(c.name for c in _CONNECTED_CLIENTS.values() if
-                  c.is_available() and game in c.supported_games)
+    return sorted(stratumgs.client.registry.get_available_client_names(game))
 
 
 def get_connected_clients():
@@ -48,7 +54,7 @@ def get_connected_clients():
         Get a list of all currently connected clients.
     """
 
-    return sorted(_CONNECTED_CLIENTS.values(), key=lambda c: c.name)
+    return sorted(stratumgs.client.registry.get_clients(), key=lambda c: c.name)
 
 
 def get_connected_client(client_name):
@@ -59,33 +65,396 @@ def get_connected_client(client_name):
         :type client_name: string
     """
 
-    return _CONNECTED_CLIENTS[client_name]
+    return stratumgs.client.registry.get_client(client_name)
+
+
+def collect_client_metrics():
+    """
+        Collect the traffic of the connected clients, for
+        :func:`stratumgs.metrics.add_collector`. Traffic is reported for each
+        client, and for each game in progress, summed over its players, along
+        with the write batches of each client.
+
+        :returns: The metrics.
+    """
+
+    client_samples = {"messages": [], "bytes": []}
+    game_traffic = {}
+    batch_samples = {"flushes": [], "messages": [], "bytes": [], "mean_size": [],
+                     "max_size": [], "latency": [], "max_latency": []}
+    for client in get_connected_clients():
+        # in the coordinator of the shards, clients are only mirrors of the
+        # proxies in the shards, and have no traffic
+        if not isinstance(client, stratumgs.client.proxy.ClientProxy):
+            continue
+        for direction, messages, num_bytes in (
+                ("in", client.traffic.messages_in, client.traffic.bytes_in),
+                ("out", client.traffic.messages_out, client.traffic.bytes_out)):
+            labels = [("client", client.name), ("direction", direction)]
+            client_samples["messages"].append(("", labels, messages))
+            client_samples["bytes"].append(("", labels, num_bytes))
+        for game_id, traffic in client.game_traffic.items():
+            game_traffic.setdefault(game_id, stratumgs.metrics.TrafficStats()).add(traffic)
+        stats = client.stream.write_stats
+        labels = [("client", client.name)]
+        for series, value in (("flushes", stats.num_flushes),
+                              ("messages", stats.num_messages),
+                              ("bytes", stats.num_bytes),
+                              ("mean_size", stats.get_mean_batch_size()),
+                              ("max_size", stats.max_batch_size),
+                              ("latency", stats.get_mean_flush_latency()),
+                              ("max_latency", stats.max_flush_latency)):
+            batch_samples[series].append(("", labels, value))
+
+    game_samples = {"messages": [], "bytes": []}
+    for game_id, traffic in sorted(game_traffic.items()):
+        for direction, messages, num_bytes in (
+                ("in", traffic.messages_in, traffic.bytes_in),
+                ("out", traffic.messages_out, traffic.bytes_out)):
+            labels = [("game", game_id), ("direction", direction)]
+            game_samples["messages"].append(("", labels, messages))
+            game_samples["bytes"].append(("", labels, num_bytes))
+
+    return [
+        ("stratumgs_client_messages_total", "counter",
+         "Messages received from and sent to each client.", client_samples["messages"]),
+        ("stratumgs_client_bytes_total", "counter",
+         "Bytes received from and sent to each client.", client_samples["bytes"]),
+        ("stratumgs_game_messages_total", "counter",
+         "Messages received from and sent to the players of each game in progress.",
+         game_samples["messages"]),
+        ("stratumgs_game_bytes_total", "counter",
+         "Bytes received from and sent to the players of each game in progress.",
+         game_samples["bytes"]),
+        ("stratumgs_client_write_flushes_total", "counter",
+         "Coalesced writes to each client.", batch_samples["flushes"]),
+        ("stratumgs_client_write_messages_total", "counter",
+         "Messages flushed to each client.", batch_samples["messages"]),
+        ("stratumgs_client_write_bytes_total", "counter",
+         "Bytes flushed to each client.", batch_samples["bytes"]),
+        ("stratumgs_client_write_batch_size_mean", "gauge",
+         "Mean number of messages per coalesced write to each client.",
+         batch_samples["mean_size"]),
+        ("stratumgs_client_write_batch_size_max", "gauge",
+         "Largest number of messages in a coalesced write to each client.",
+         batch_samples["max_size"]),
+        ("stratumgs_client_write_flush_latency_seconds", "gauge",
+         "Mean time messages wait to be flushed to each client.", batch_samples["latency"]),
+        ("stratumgs_client_write_flush_latency_max_seconds", "gauge",
+         "Longest time a message has waited to be flushed to each client.",
+         batch_samples["max_latency"])
+    ]
+
+
+def make_stream_proxy(stream):
+    """
+        Make a :class:`StreamProxy` for a client stream, with the buffer limits
+        and slow client policy from the configuration.
+
+        :param stream: The client stream.
+        :type stream: :class:`tornado.iostream.IOStream`
+        :returns: The stream proxy.
+        :rtype: :class:`StreamProxy`
+    """
+
+    return StreamProxy(
+        stream,
+        stratumgs.config.get("client_server", "max_client_buffer_size"),
+        stratumgs.config.get("client_server", "pause_engines_buffer_size"),
+        stratumgs.config.get("client_server", "slow_client_policy"),
+        stratumgs.config.get("client_server", "slow_client_timeout"))
+
+
+class WriteBatchStats(object):
+    """
+        Statistics about the batches of messages written by a
+        :class:`StreamProxy`.
+    """
+
+    def __init__(self):
+        self.num_flushes = 0
+        self.num_messages = 0
+        self.num_bytes = 0
+        self.max_batch_size = 0
+        self.total_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+
+    def record_flush(self, num_messages, num_bytes, latency):
+        """
+            Record a flush of a batch of messages.
+
+            :param num_messages: The number of messages in the batch.
+            :type num_messages: int
+            :param num_bytes: The number of bytes in the batch.
+            :type num_bytes: int
+            :param latency: The time in seconds between the first message of
+                            the batch being written and the batch being flushed.
+            :type latency: float
+        """
+
+        self.num_flushes += 1
+        self.num_messages += num_messages
+        self.num_bytes += num_bytes
+        self.max_batch_size = max(self.max_batch_size, num_messages)
+        self.total_flush_latency += latency
+        self.max_flush_latency = max(self.max_flush_latency, latency)
+
+    def get_mean_batch_size(self):
+        """
+            Get the mean number of messages per batch.
+
+            :returns: The mean batch size.
+        """
+
+        return self.num_messages / self.num_flushes if self.num_flushes else 0.0
+
+    def get_mean_flush_latency(self):
+        """
+            Get the mean time in seconds messages wait before being flushed.
+
+            :returns: The mean flush latency.
+        """
+
+        return self.total_flush_latency / self.num_flushes if self.num_flushes else 0.0
+
+
+# The policies for clients whose write buffers exceed the maximum size: they are
+# disconnected immediately, disconnected if the buffer has not drained below the
+# maximum after a timeout, or never disconnected
+DISCONNECT_POLICY = "disconnect"
+TIMEOUT_POLICY = "timeout"
+IGNORE_POLICY = "ignore"
+SLOW_CLIENT_POLICIES = (DISCONNECT_POLICY, TIMEOUT_POLICY, IGNORE_POLICY)
 
 
 class StreamProxy(object):
     """
         A proxy for :class:`tornado.iostream.IOStream`. It only provides some
         methods of ``IOStream``, as follows: ``write``, ``read_until``,
-        ``set_close_callback``, ``close``.
+        ``read_bytes``, ``set_close_callback``, ``close``. As with ``IOStream``,
+        the callback given to ``write`` is called once the message has been
+        sent.
+
+        Messages written in the same iteration of the IOLoop are coalesced, and
+        written to the stream together at the start of the next iteration, so
+        that a client playing many games gets one write per iteration instead of
+        one per message. Statistics about the batches are kept in
+        ``write_stats``.
+
+        The number of bytes waiting to be written to the client is bounded.
+        When it grows past ``pause_buffer_size``, the pause callback set with
+        :meth:`set_flow_control_callbacks` is called, so that the client proxy
+        stops reading from its engines, and the resume callback is called once
+        the buffer has drained. When it, together with the data its writers
+        are holding back while paused, grows past ``max_buffer_size``, the
+        client is handled according to ``slow_client_policy``.
 
         :param stream: The stream to proxy.
         :type stream: :class:`tornado.iostream.IOStream`
+        :param max_buffer_size: The maximum number of bytes that can be waiting
+                                to be written, or 0 for no maximum.
+        :type max_buffer_size: int
+        :param pause_buffer_size: The number of waiting bytes at which reading
+                                  from the engines is paused, or 0 to never
+                                  pause.
+        :type pause_buffer_size: int
+        :param slow_client_policy: What to do with a client whose buffer
+                                   exceeds the maximum, one of
+                                   :data:`SLOW_CLIENT_POLICIES`.
+        :type slow_client_policy: string
+        :param slow_client_timeout: The number of seconds a client's buffer can
+                                    stay above the maximum with the timeout
+                                    policy.
+        :type slow_client_timeout: float
     """
 
-    def __init__(self, stream):
+    def __init__(self, stream, max_buffer_size=0, pause_buffer_size=0,
+                 slow_client_policy=IGNORE_POLICY, slow_client_timeout=0):
+        if slow_client_policy not in SLOW_CLIENT_POLICIES:
+            raise ValueError("Unknown slow client policy {}".format(slow_client_policy))
         self._stream = stream
         self._close_callback = None
+        self._write_buffer = []
+        self._write_buffer_bytes = 0
+        self._write_buffer_time = None
+        self.write_stats = WriteBatchStats()
+        self.max_buffer_size = max_buffer_size
+        self.pause_buffer_size = pause_buffer_size
+        self.slow_client_policy = slow_client_policy
+        self.slow_client_timeout = slow_client_timeout
+        self._paused = False
+        self._on_pause = None
+        self._on_resume = None
+        self._get_pending_size = None
+        self._overflow_timeout = None
+        self._write_callbacks = []
+        self._flushed_callbacks = []
+
+    def write(self, message, callback=None):
+        if not self._write_buffer:
+            self._write_buffer_time = time.monotonic()
+            tornado.ioloop.IOLoop.current().add_callback(self._flush)
+        self._write_buffer.append(message)
+        if callback is not None:
+            self._write_callbacks.append(callback)
+        self._write_buffer_bytes += len(message)
+        self._check_write_buffer()
+
+    def _flush(self):
+        """
+            Write all of the buffered messages to the stream at once.
+        """
+
+        messages = self._write_buffer
+        self._write_buffer = []
+        self._write_buffer_bytes = 0
+        callbacks = self._write_callbacks
+        self._write_callbacks = []
+        if self._stream.closed():
+            return
+        self._flushed_callbacks.extend(callbacks)
+        data = b"".join(messages)
+        self._stream.write(data, self._on_drained)
+        self.write_stats.record_flush(
+            len(messages), len(data), time.monotonic() - self._write_buffer_time)
+
+    def get_write_buffer_size(self):
+        """
+            Get the number of bytes waiting to be written to the client, both
+            coalesced by this proxy and buffered by the stream.
+
+            :returns: The number of bytes.
+        """
+
+        return self._write_buffer_bytes + stratumgs.compat.get_write_buffer_size(self._stream)
+
+    def get_buffered_size(self):
+        """
+            Get the number of bytes waiting for the client, including the data
+            the writers are holding back while they are paused.
+
+            :returns: The number of bytes.
+        """
 
-    def write(self, message):
-        self._stream.write(message)
+        size = self.get_write_buffer_size()
+        if self._get_pending_size is not None:
+            size += self._get_pending_size()
+        return size
+
+    def set_flow_control_callbacks(self, on_pause, on_resume):
+        """
+            Set the callbacks to call when the write buffer grows past the
+            pause size, and when it has drained again.
+
+            :param on_pause: The callback called to pause writers.
+            :type on_pause: function
+            :param on_resume: The callback called to resume writers.
+            :type on_resume: function
+        """
+
+        self._on_pause = on_pause
+        self._on_resume = on_resume
+
+    def set_pending_size_function(self, get_pending_size):
+        """
+            Set the function that returns the number of bytes the writers are
+            holding back for the client, which counts toward the maximum buffer
+            size. Writers should call :meth:`check_buffered_size` when more
+            data is held back.
+
+            :param get_pending_size: The function.
+            :type get_pending_size: function
+        """
+
+        self._get_pending_size = get_pending_size
+
+    def disconnect(self):
+        """
+            Close the underlying stream, disconnecting the client.
+        """
+
+        if self._overflow_timeout is not None:
+            tornado.ioloop.IOLoop.current().remove_timeout(self._overflow_timeout)
+            self._overflow_timeout = None
+        self._stream.close()
+
+    def check_buffered_size(self):
+        """
+            Apply the slow client policy if the data waiting for the client has
+            grown past the maximum buffer size.
+
+            :returns: Whether the client is still connected.
+        """
+
+        if self.max_buffer_size and self.get_buffered_size() > self.max_buffer_size:
+            if self.slow_client_policy == DISCONNECT_POLICY:
+                self.disconnect()
+                return False
+            if self.slow_client_policy == TIMEOUT_POLICY and self._overflow_timeout is None:
+                self._overflow_timeout = tornado.ioloop.IOLoop.current().call_later(
+                    self.slow_client_timeout, self._on_overflow_timeout)
+        return True
+
+    def _check_write_buffer(self):
+        """
+            Pause the writers, or apply the slow client policy, if the write
+            buffer has grown too large.
+        """
+
+        if not self.check_buffered_size():
+            return
+        size = self.get_write_buffer_size()
+        if not self._paused and self.pause_buffer_size and size > self.pause_buffer_size:
+            self._paused = True
+            if self._on_pause is not None:
+                self._on_pause()
+
+    def _on_overflow_timeout(self):
+        """
+            Called when a client's buffer has been above the maximum size for
+            the slow client timeout. The client is disconnected if its buffer
+            is still too large.
+        """
+
+        self._overflow_timeout = None
+        if self.get_buffered_size() > self.max_buffer_size:
+            self.disconnect()
+
+    def _on_drained(self):
+        """
+            Called when everything written to the stream has been sent. The
+            callbacks of the flushed messages are run, and the writers are
+            resumed, unless enough new messages have been coalesced to pause
+            them again.
+        """
+
+        callbacks = self._flushed_callbacks
+        self._flushed_callbacks = []
+        for callback in callbacks:
+            callback()
+
+        if self._overflow_timeout is not None and \
+                self.get_buffered_size() <= self.max_buffer_size:
+            tornado.ioloop.IOLoop.current().remove_timeout(self._overflow_timeout)
+            self._overflow_timeout = None
+        if self._paused and self.get_write_buffer_size() <= self.pause_buffer_size:
+            self._paused = False
+            if self._on_resume is not None:
+                self._on_resume()
 
     def read_until(self, delimeter, callback):
         self._stream.read_until(delimeter, callback)
 
+    def read_bytes(self, num_bytes, callback):
+        self._stream.read_bytes(num_bytes, callback)
+
     def set_close_callback(self, callback):
         self._close_callback = callback
 
     def close(self):
+        if self._overflow_timeout is not None:
+            tornado.ioloop.IOLoop.current().remove_timeout(self._overflow_timeout)
+            self._overflow_timeout = None
         self._close_callback()
 
 
@@ -116,16 +485,20 @@ class ClientProxyServer(tornado.tcpserver.TCPServer):
         if name is None:
             name = "client-{}".format(cls._NAMELESS_CLIENT_NUMBER)
             cls._NAMELESS_CLIENT_NUMBER += 1
-        elif name in _CONNECTED_CLIENTS:
+        elif stratumgs.client.registry.has_client(name):
             n = 1
             while True:
                 possible_name = "{}-{}".format(name, n)
-                if possible_name not in _CONNECTED_CLIENTS:
+                if not stratumgs.client.registry.has_client(possible_name):
                     name = possible_name
                     break
+                n += 1
         return name
 
     def handle_stream(self, stream, address):
+        # writes are already coalesced by StreamProxy, so Nagle's algorithm
+        # only delays each turn until the client acknowledges the last one
+        stream.set_nodelay(True)
 
         def new_client(connect_message):
             connect_message = json.loads(connect_message.decode().strip())
@@ -134,31 +507,70 @@ class ClientProxyServer(tornado.tcpserver.TCPServer):
                 print("Invalid message type from client {}".format(address))
                 return
 
-            name = self._negotiate_name(connect_message["name"])
             try:
                 max_games = int(connect_message["max_games"])
             except ValueError:
                 print("Invalid max_games parameter from client {}".format(address))
                 return
             supported_games = connect_message["supported_games"]
+            framing = connect_message.get("framing", stratumgs.protocol.JSON_LINES_FRAMING)
+            if framing not in (stratumgs.protocol.JSON_LINES_FRAMING,
+                               stratumgs.protocol.LENGTH_PREFIXED_FRAMING):
+                print("Invalid framing parameter from client {}".format(address))
+                return
+            codec = connect_message.get("codec", stratumgs.codec.DEFAULT_CODEC)
+            if codec not in stratumgs.codec.get_available_codecs():
+                print("Unavailable codec {} requested by client {}".format(codec, address))
+                return
+            if (codec != stratumgs.codec.JSONCodec.name and
+                    framing != stratumgs.protocol.LENGTH_PREFIXED_FRAMING):
+                print("Codec {} requires length-prefixed framing, requested by client {}".format(
+                    codec, address))
+                return
+            accepts_deltas = bool(connect_message.get("state_deltas", False))
+            try:
+                protocol_version = min(int(connect_message.get("protocol_version", 1)),
+                                       max(stratumgs.protocol.PROTOCOL_VERSIONS))
+            except ValueError:
+                print("Invalid protocol_version parameter from client {}".format(address))
+                return
 
-            stream.write("{}\n".format(json.dumps({
-                "type": "name",
-                "name": name
-            })).encode())
-
-            stream_proxy = StreamProxy(stream)
-
-            def stream_closed():
-                print("Client {} disconnected.".format(name))
-                del _CONNECTED_CLIENTS[name]
-                stream_proxy.close()
-
-            stream.set_close_callback(stream_closed)
-
-            _CONNECTED_CLIENTS[name] = stratumgs.client.proxy.ClientProxy(
-                name, supported_games, max_games, stream_proxy)
-
-            print("Client {} connected.".format(name))
+            def accept(name):
+                if stream.closed():
+                    return None
+
+                stream.write("{}\n".format(json.dumps({
+                    "type": "name",
+                    "name": name,
+                    "protocol_version": protocol_version
+                })).encode())
+
+                stream_proxy = make_stream_proxy(stream)
+
+                def stream_closed():
+                    print("Client {} disconnected.".format(name))
+                    stratumgs.client.registry.remove_client(name)
+                    stratumgs.shard.on_client_disconnected(name)
+                    stream_proxy.close()
+
+                stream.set_close_callback(stream_closed)
+
+                client = stratumgs.client.proxy.ClientProxy(
+                    name, supported_games, max_games, stream_proxy, framing, protocol_version,
+                    codec, accepts_deltas)
+                stratumgs.client.registry.add_client(client)
+
+                print("Client {} connected.".format(name))
+                stratumgs.game.scheduler.request_scheduling()
+                return client
+
+            # in a shard, the name must be unique across every shard, so the
+            # coordinator chooses it
+            if stratumgs.shard.is_shard():
+                stratumgs.shard.get_shard().register_client(
+                    connect_message["name"], supported_games, max_games, codec, accepts_deltas,
+                    accept)
+            else:
+                accept(self._negotiate_name(connect_message["name"]))
 
         stream.read_until(b"\n", new_client)
@@ -0,0 +1,109 @@
+"""
+.. module stratumgs.codec
+
+Codecs used to encode the payloads of messages sent between clients and game
+engines. Each client chooses a codec when it connects, and the engines encode
+and decode that client's payloads with it, so payloads are never converted
+along the way. JSON is always available, and is the default. A compact binary
+codec is available if the optional ``msgpack`` package is installed.
+"""
+
+import json
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class JSONCodec(object):
+    """
+        Encodes payloads as JSON.
+    """
+
+    name = "json"
+
+    def encode(self, obj):
+        """
+            Encode an object.
+
+            :param obj: The object to encode.
+            :returns: The encoded object.
+            :rtype: :class:`bytes`
+        """
+
+        return json.dumps(obj).encode()
+
+    def decode(self, data):
+        """
+            Decode an object.
+
+            :param data: The encoded object.
+            :type data: :class:`bytes`
+            :returns: The decoded object.
+        """
+
+        return json.loads(data.decode())
+
+
+class MsgPackCodec(object):
+    """
+        Encodes payloads using MessagePack, a compact binary format. Requires
+        the ``msgpack`` package.
+    """
+
+    name = "msgpack"
+
+    def encode(self, obj):
+        """
+            Encode an object.
+
+            :param obj: The object to encode.
+            :returns: The encoded object.
+            :rtype: :class:`bytes`
+        """
+
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def decode(self, data):
+        """
+            Decode an object.
+
+            :param data: The encoded object.
+            :type data: :class:`bytes`
+            :returns: The decoded object.
+        """
+
+        return msgpack.unpackb(data, raw=False)
+
+
+DEFAULT_CODEC = JSONCodec.name
+
+# The available codecs, by name
+_CODECS = {
+    JSONCodec.name: JSONCodec()
+}
+if msgpack is not None:
+    _CODECS[MsgPackCodec.name] = MsgPackCodec()
+
+
+def get_codec(name):
+    """
+        Get a codec by name.
+
+        :param name: The name of the codec.
+        :type name: string
+        :returns: The codec.
+    """
+
+    return _CODECS[name]
+
+
+def get_available_codecs():
+    """
+        Get the names of the available codecs.
+
+        :returns: A sorted list of codec names.
+    """
+
+    return sorted(_CODECS.keys())
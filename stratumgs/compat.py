@@ -0,0 +1,49 @@
+"""
+.. module stratumgs.compat
+
+The only place that reaches into Tornado's private attributes. The server is
+written against Tornado 4.3, which is pinned in ``requirements.txt``, and which
+has no public way to check how much data a stream has buffered, or to write a
+prebuilt frame to a websocket. Each helper checks that the attribute it needs
+exists, and falls back to the public API when it does not, so a newer Tornado
+loses the optimization instead of breaking.
+"""
+
+
+def get_write_buffer_size(stream):
+    """
+        Get the number of bytes written to a stream that have not been sent
+        yet.
+
+        :param stream: The stream.
+        :type stream: :class:`tornado.iostream.IOStream`
+        :returns: The number of bytes, or 0 if the stream does not expose it.
+        :rtype: int
+    """
+
+    return getattr(stream, "_write_buffer_size", 0)
+
+
+def write_websocket_frame(handler, message, frame):
+    """
+        Write a message to a websocket. The prebuilt frame is written directly
+        to the websocket's stream, which skips framing the message again for
+        every websocket it is sent to. When the connection compresses its
+        messages, or does not expose whether it does, the message is written
+        with :meth:`tornado.websocket.WebSocketHandler.write_message` instead.
+
+        :param handler: The websocket handler.
+        :type handler: :class:`tornado.websocket.WebSocketHandler`
+        :param message: The message.
+        :type message: :class:`bytes`
+        :param frame: The message, framed as an uncompressed websocket text
+                      frame.
+        :type frame: :class:`bytes`
+    """
+
+    connection = handler.ws_connection
+    if (hasattr(connection, "_compressor") and connection._compressor is None and
+            hasattr(connection, "stream")):
+        connection.stream.write(frame)
+    else:
+        handler.write_message(message)
@@ -15,11 +15,65 @@ _CONFIG_VALUES = {
     },
     "web_server": {
         "host": (str, ""),
-        "port": (int, 8888)
+        "port": (int, 8888),
+        "max_view_buffer_size": (int, 1048576),
+        "max_view_updates_per_second": (float, 30.0)
     },
     "client_server": {
         "host": (str, ""),
-        "port": (int, 8889)
+        "port": (int, 8889),
+        "shards": (int, 1),
+        "reuse_port": (bool, False),
+        "max_client_buffer_size": (int, 4194304),
+        "pause_engines_buffer_size": (int, 262144),
+        "slow_client_policy": (str, "disconnect"),
+        "slow_client_timeout": (float, 10.0)
+    },
+    "metrics": {
+        "enabled": (bool, True),
+        "ioloop_lag_interval": (float, 1.0)
+    },
+    "tracing": {
+        "enabled": (bool, False),
+        "max_events_per_game": (int, 100000)
+    },
+    "engine_workers": {
+        "host": (str, "127.0.0.1"),
+        "port": (int, 0),
+        "secret": (str, "")
+    },
+    "engine_worker": {
+        "server_host": (str, "localhost"),
+        "server_port": (int, 8890),
+        "secret": (str, ""),
+        "name": (str, ""),
+        "capacity": (int, 16),
+        "reconnect_interval": (float, 5.0)
+    },
+    "engine_pool": {
+        "size": (int, 8),
+        "max_games_per_worker": (int, 100)
+    },
+    "game_records": {
+        "path": (str, "stratumgs.db"),
+        "max_finished_games": (int, 100)
+    },
+    "replays": {
+        "directory": (str, ""),
+        "turn_interval": (float, 0.5)
+    },
+    "tournament": {
+        "game": (str, ""),
+        "pairing": (str, "round-robin"),
+        "max_games": (int, 0)
+    },
+    "tictactoe": {
+        "move_time_limit": (float, 0.0),
+        "game_time_limit": (float, 0.0)
+    },
+    "gomoku": {
+        "move_time_limit": (float, 10.0),
+        "game_time_limit": (float, 300.0)
     }
 }
 
@@ -53,5 +107,8 @@ def get(section, option):
     if section in _CONFIG_VALUES:
         if option in _CONFIG_VALUES[section]:
             type_fn, default = _CONFIG_VALUES[section][option]
+            if type_fn is bool:
+                # bool() of any non-empty string, including "false", is true
+                return _CONFIG.getboolean(section, option, fallback=default)
             return type_fn(_CONFIG.get(section, option, fallback=default))
     return None
@@ -5,19 +5,48 @@ Contains the functionality to create new games and query information about
 existing games.
 """
 
+import collections
+
+import stratumgs.game.records
+import stratumgs.game.replay
 import stratumgs.game.runner
+import stratumgs.game.scheduler
 import stratumgs.client.server
 
-from .games import tictactoe
+from .games import gomoku, tictactoe
 
 
 _GAME_ENGINES = {
+    "gomoku": gomoku,
     "tictactoe": tictactoe
 }
 
 _CREATED_GAME_ID = 0
 _CREATED_GAMES = {}
 
+# Records of the finished games that are still kept in memory, oldest first
+_FINISHED_GAMES = collections.deque()
+_MAX_FINISHED_GAMES = 100
+
+
+def init(max_finished_games):
+    """
+        Initialize the game registry. Game IDs continue from the last game in
+        the game record store and in the replay directory, if there are any,
+        so :func:`stratumgs.game.records.init` and
+        :func:`stratumgs.game.replay.init` should be called first.
+
+        :param max_finished_games: The number of finished games to keep in
+                                   memory before the oldest are evicted.
+        :type max_finished_games: int
+    """
+
+    global _CREATED_GAME_ID, _MAX_FINISHED_GAMES
+    _MAX_FINISHED_GAMES = max_finished_games
+    if stratumgs.game.records.is_enabled():
+        _CREATED_GAME_ID = stratumgs.game.records.get_store().get_next_game_id()
+    _CREATED_GAME_ID = max(_CREATED_GAME_ID, stratumgs.game.replay.get_next_game_id())
+
 
 def get_available_game_engines():
     """
@@ -46,11 +75,23 @@ def init_game_engine(engine_name, player_ids=[]):
     _CREATED_GAME_ID += 1
     players = [stratumgs.client.server.get_connected_client(pid) for pid in player_ids]
     engine_runner = stratumgs.game.runner.init_engine_runner(
-        game_id, _GAME_ENGINES[engine_name].Engine, engine_name, players)
+        game_id, get_engine_class(engine_name), engine_name, players)
     _CREATED_GAMES[game_id] = engine_runner
     return game_id
 
 
+def get_engine_class(engine_name):
+    """
+        Get the engine class of a game engine.
+
+        :param engine_name: The name of the game engine.
+        :type engine_name: string
+        :returns: The engine class.
+    """
+
+    return _GAME_ENGINES[engine_name].Engine
+
+
 def get_game_configuration(game_name):
     """
         Get the configuration for the specified game.
@@ -63,9 +104,29 @@ def get_game_configuration(game_name):
     return _GAME_ENGINES[game_name].CONFIG
 
 
+def on_game_finished(engine_runner):
+    """
+        Called by an engine runner when its game is over. The game is recorded,
+        its tournament is updated, and if too many finished games are in memory,
+        the oldest are evicted.
+
+        :param engine_runner: The runner of the finished game.
+        :type engine_runner: :class:`stratumgs.game.runner.BaseEngineRunner`
+    """
+
+    record = engine_runner.get_record()
+    if stratumgs.game.records.is_enabled():
+        stratumgs.game.records.get_store().append(record)
+    stratumgs.game.scheduler.on_game_finished(record)
+    _FINISHED_GAMES.append(record)
+    while len(_FINISHED_GAMES) > _MAX_FINISHED_GAMES:
+        _CREATED_GAMES.pop(_FINISHED_GAMES.popleft().game_id, None)
+
+
 def get_current_games():
     """
-        Get a list of all currently being played games.
+        Get a list of the games in memory, which are those being played and
+        those that finished most recently.
 
         :returns: A list of all current games, in unspecified order.
     """
@@ -73,13 +134,57 @@ def get_current_games():
     return _CREATED_GAMES.items()
 
 
+def get_finished_games(engine_name=None, player_name=None, limit=50):
+    """
+        Get the records of the most recently finished games, optionally only
+        those played with an engine or by a player. If games are not being
+        recorded, only the finished games still in memory are available.
+
+        :param engine_name: The engine to get games for.
+        :type engine_name: string
+        :param player_name: The player to get games for.
+        :type player_name: string
+        :param limit: The maximum number of records to return.
+        :type limit: int
+        :returns: A list of :class:`stratumgs.game.records.GameRecord`, newest
+                  first.
+    """
+
+    if stratumgs.game.records.is_enabled():
+        return stratumgs.game.records.get_store().find(engine_name, player_name, limit)
+    records = [record for record in reversed(_FINISHED_GAMES)
+               if (engine_name is None or record.engine_name == engine_name) and
+               (player_name is None or player_name in record.player_names)]
+    return records[:limit]
+
+
 def get_game_runner(game_id):
     """
         Get a specific game runner by ID.
 
         :param game_id: The game ID to retrieve the runner for.
         :type game_id: int
-        :returns: The runner.
+        :returns: The runner, or ``None`` if the game has been evicted from
+                  memory.
+    """
+
+    return _CREATED_GAMES.get(game_id)
+
+
+def get_game_record(game_id):
+    """
+        Get the record of a finished game, whether or not it is still in
+        memory.
+
+        :param game_id: The game ID to retrieve the record for.
+        :type game_id: int
+        :returns: The :class:`stratumgs.game.records.GameRecord`, or ``None``
+                  if there is no record of the game.
     """
 
-    return _CREATED_GAMES[game_id]
+    if stratumgs.game.records.is_enabled():
+        return stratumgs.game.records.get_store().get(game_id)
+    for record in _FINISHED_GAMES:
+        if record.game_id == game_id:
+            return record
+    return None
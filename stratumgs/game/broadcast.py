@@ -0,0 +1,176 @@
+"""
+.. module stratumgs.game.broadcast
+
+Broadcasts game states to the websockets of the views watching a game. Each
+message is framed once, and the same bytes are written to every subscribed
+websocket, instead of each websocket framing the message itself.
+"""
+
+import struct
+
+import tornado.iostream
+import tornado.websocket
+
+import stratumgs.compat
+import stratumgs.metrics
+import stratumgs.protocol
+
+
+# The time taken to write a message to every subscriber of a hub
+BROADCAST_LATENCY = stratumgs.metrics.Histogram(
+    "stratumgs_view_broadcast_seconds",
+    "Time taken to write a state to every view of a game.")
+
+
+def build_view_message(frame_type, payload):
+    """
+        Build the message sent to views for a frame received from an engine.
+        The encoded payload is embedded in the message without being decoded.
+
+        :param frame_type: The type of the frame, either a message or a delta.
+        :type frame_type: int
+        :param payload: The JSON encoded state or delta.
+        :type payload: :class:`bytes`
+        :returns: The message.
+        :rtype: :class:`bytes`
+    """
+
+    if frame_type == stratumgs.protocol.DELTA:
+        return b"".join((b'{"type": "delta", "payload": ', payload, b"}"))
+    return b"".join((b'{"type": "message", "payload": ', payload, b"}"))
+
+
+def build_websocket_frame(message):
+    """
+        Build an unmasked websocket text frame, as sent by a server.
+
+        :param message: The message to frame.
+        :type message: :class:`bytes`
+        :returns: The frame.
+        :rtype: :class:`bytes`
+    """
+
+    length = len(message)
+    if length < 126:
+        header = struct.pack("!BB", 0x81, length)
+    elif length <= 0xFFFF:
+        header = struct.pack("!BBH", 0x81, 126, length)
+    else:
+        header = struct.pack("!BBQ", 0x81, 127, length)
+    return header + message
+
+
+class BroadcastHub(object):
+    """
+        Writes messages to a set of subscribed websockets. Subscribers that fall
+        too far behind, because their connection cannot keep up, are closed and
+        dropped, so that they cannot make the server buffer an unbounded amount
+        of data for them.
+
+        :param max_buffer_size: The maximum number of bytes that can be waiting
+                                to be written to a subscriber.
+        :type max_buffer_size: int
+    """
+
+    def __init__(self, max_buffer_size):
+        self.max_buffer_size = max_buffer_size
+        self._subscribers = set()
+
+    def subscribe(self, view):
+        """
+            Add a subscriber.
+
+            :param view: The view to add.
+            :type view: :class:`tornado.websocket.WebSocketHandler`
+        """
+
+        self._subscribers.add(view)
+
+    def unsubscribe(self, view):
+        """
+            Remove a subscriber. Removing a view that is not subscribed does
+            nothing.
+
+            :param view: The view to remove.
+            :type view: :class:`tornado.websocket.WebSocketHandler`
+        """
+
+        self._subscribers.discard(view)
+
+    def get_num_subscribers(self):
+        """
+            Get the number of subscribers.
+
+            :returns: The number of subscribers.
+        """
+
+        return len(self._subscribers)
+
+    def send(self, view, message):
+        """
+            Send a message to a single view, such as when it first subscribes.
+
+            :param view: The view to send the message to.
+            :type view: :class:`tornado.websocket.WebSocketHandler`
+            :param message: The message.
+            :type message: :class:`bytes`
+        """
+
+        if not self._write(view, message, build_websocket_frame(message)):
+            self._drop(view)
+
+    def broadcast(self, message):
+        """
+            Send a message to every subscriber.
+
+            :param message: The message.
+            :type message: :class:`bytes`
+        """
+
+        if not self._subscribers:
+            return
+        with BROADCAST_LATENCY.time():
+            frame = build_websocket_frame(message)
+            dropped = [view for view in self._subscribers
+                       if not self._write(view, message, frame)]
+            for view in dropped:
+                self._drop(view)
+
+    def _write(self, view, message, frame):
+        """
+            Write a message to a view, with
+            :func:`stratumgs.compat.write_websocket_frame`.
+
+            :param view: The view to write to.
+            :type view: :class:`tornado.websocket.WebSocketHandler`
+            :param message: The message.
+            :type message: :class:`bytes`
+            :param frame: The message, framed for an uncompressed connection.
+            :type frame: :class:`bytes`
+            :returns: False if the view is closed or too far behind, and should
+                      be dropped.
+        """
+
+        connection = view.ws_connection
+        if connection is None or connection.stream.closed():
+            return False
+        buffer_size = stratumgs.compat.get_write_buffer_size(connection.stream)
+        if buffer_size + len(frame) > self.max_buffer_size:
+            return False
+        try:
+            stratumgs.compat.write_websocket_frame(view, message, frame)
+        except (tornado.iostream.StreamClosedError, tornado.websocket.WebSocketClosedError):
+            return False
+        return True
+
+    def _drop(self, view):
+        """
+            Unsubscribe a view, and close it if it is still open.
+
+            :param view: The view to drop.
+            :type view: :class:`tornado.websocket.WebSocketHandler`
+        """
+
+        self.unsubscribe(view)
+        if view.ws_connection is not None:
+            view.close()
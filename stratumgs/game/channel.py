@@ -0,0 +1,417 @@
+"""
+.. module stratumgs.game.channel
+
+Multiplexed channels, which carry the streams of many games over a single
+connection. Each frame on a channel is tagged with the ID of the game and the
+stream within the game it belongs to: the players' streams are numbered from
+zero, in player order, and the view's stream is :data:`VIEW_STREAM`. Control
+messages, such as game assignments, are JSON objects sent in frames of type
+:data:`CONTROL`.
+
+A stream of a game is connected to the channel by attaching one end of it,
+such as the engine end of a client proxy's stream. Frames read from the
+attached end are sent over the channel, and frames received for the stream are
+written to it.
+
+Reading from the attached streams is paused while the connection has too much
+data waiting to be sent, so that a worker that falls behind holds back the
+streams of its games, instead of making the server buffer their frames.
+
+Engine pool workers run one synchronous engine at a time, and use the blocking
+end of a channel, :class:`BlockingChannel`.
+"""
+
+import collections
+import functools
+import json
+import select
+import struct
+import time
+
+import tornado.iostream
+
+import stratumgs.compat
+import stratumgs.game.engine.local
+import stratumgs.protocol
+
+
+# The header of a frame on a channel: the type of the frame, the ID of the
+# game, the ID of the stream, and the length of the payload
+HEADER = struct.Struct("!BIBI")
+
+# The frame type of control messages
+CONTROL = 0
+
+# The ID of the view's stream of a game
+VIEW_STREAM = 255
+
+# The default number of bytes waiting to be sent on a channel at which reading
+# from the attached streams is paused
+DEFAULT_PAUSE_BUFFER_SIZE = 1048576
+
+
+class Channel(object):
+    """
+        A connection that carries the streams of many games.
+
+        :param stream: The connection.
+        :type stream: :class:`tornado.iostream.IOStream`
+        :param on_control: The callback to call with the game ID and the
+                           message of each control message received, if any
+                           are expected.
+        :type on_control: function
+        :param on_close: The callback to call when the connection is closed,
+                         after the attached streams are sent close frames.
+        :type on_close: function
+        :param pause_buffer_size: The number of bytes waiting to be sent at
+                                  which reading from the attached streams is
+                                  paused.
+        :type pause_buffer_size: int
+    """
+
+    def __init__(self, stream, on_control=None, on_close=None,
+                 pause_buffer_size=DEFAULT_PAUSE_BUFFER_SIZE):
+        self._stream = stream
+        self._on_control = on_control
+        self._on_close = on_close
+        self._streams = {}
+        self._pause_buffer_size = pause_buffer_size
+        self._paused = False
+        self._paused_reads = []
+        self._stream.set_close_callback(self._on_channel_closed)
+        self._read_frame()
+
+    def attach(self, game_id, stream_id, stream, on_close=None):
+        """
+            Attach a stream of a game to the channel.
+
+            :param game_id: The ID of the game.
+            :type game_id: int
+            :param stream_id: The ID of the stream.
+            :type stream_id: int
+            :param stream: The end of the stream to attach.
+            :param on_close: A callback to call when the attached end closes.
+            :type on_close: function
+        """
+
+        key = (game_id, stream_id)
+        self._streams[key] = stream
+        close_sent = False
+
+        def frame_from_stream(frame_type, _, payload):
+            nonlocal close_sent
+            self._write_frame(frame_type, game_id, stream_id, payload)
+            # nothing follows a close frame
+            if frame_type == stratumgs.protocol.CLOSE:
+                close_sent = True
+            elif self._paused:
+                self._paused_reads.append(functools.partial(
+                    stratumgs.protocol.read_frame, stream.read_bytes, frame_from_stream))
+            else:
+                stratumgs.protocol.read_frame(stream.read_bytes, frame_from_stream)
+
+        def stream_closed():
+            if self._streams.get(key) is stream:
+                del self._streams[key]
+                # the other side must see the stream end, even if it closed
+                # without a close frame
+                if not close_sent:
+                    self._write_frame(stratumgs.protocol.CLOSE, game_id, stream_id, b"")
+            if on_close is not None:
+                on_close()
+
+        stream.set_close_callback(stream_closed)
+        stratumgs.protocol.read_frame(stream.read_bytes, frame_from_stream)
+
+    def open_stream(self, game_id, stream_id, on_close=None):
+        """
+            Open a new in memory stream for a game, and attach one end of it to
+            the channel.
+
+            :param game_id: The ID of the game.
+            :type game_id: int
+            :param stream_id: The ID of the stream.
+            :type stream_id: int
+            :param on_close: A callback to call when the stream closes.
+            :type on_close: function
+            :returns: The other end of the stream.
+            :rtype: :class:`stratumgs.game.engine.local.LocalStream`
+        """
+
+        attached_end, other_end = stratumgs.game.engine.local.make_local_stream_pair()
+        self.attach(game_id, stream_id, attached_end, on_close)
+        return other_end
+
+    def send_control(self, game_id, message):
+        """
+            Send a control message.
+
+            :param game_id: The ID of the game the message is about.
+            :type game_id: int
+            :param message: The message.
+            :type message: dict
+        """
+
+        self._write_frame(CONTROL, game_id, 0, json.dumps(message).encode())
+
+    def close(self):
+        """
+            Close the channel.
+        """
+
+        self._stream.close()
+
+    def closed(self):
+        """
+            Check whether the channel is closed.
+
+            :returns: Whether the channel is closed.
+        """
+
+        return self._stream.closed()
+
+    def _write_frame(self, frame_type, game_id, stream_id, payload):
+        """
+            Write a frame to the channel.
+
+            :param frame_type: The type of the frame.
+            :type frame_type: int
+            :param game_id: The ID of the game.
+            :type game_id: int
+            :param stream_id: The ID of the stream.
+            :type stream_id: int
+            :param payload: The payload of the frame.
+            :type payload: :class:`bytes`
+        """
+
+        if self._stream.closed():
+            return
+        self._stream.write(HEADER.pack(frame_type, game_id, stream_id, len(payload)) + payload,
+                           self._on_drained)
+        if (not self._paused and
+                stratumgs.compat.get_write_buffer_size(self._stream) > self._pause_buffer_size):
+            self._paused = True
+
+    def _on_drained(self):
+        """
+            Called when everything written to the connection has been sent, to
+            resume reading from the attached streams.
+        """
+
+        if not self._paused:
+            return
+        self._paused = False
+        reads = self._paused_reads
+        self._paused_reads = []
+        for read in reads:
+            read()
+
+    def _read_frame(self):
+        """
+            Read the next frame from the channel. Frames that arrived before the
+            connection closed are still read, so the last frames a worker sends
+            before it exits are not lost.
+        """
+
+        def on_header(header):
+            frame_type, game_id, stream_id, length = HEADER.unpack(header)
+            if length == 0:
+                self._on_frame(frame_type, game_id, stream_id, b"")
+            else:
+                self._stream.read_bytes(length, lambda payload: self._on_frame(
+                    frame_type, game_id, stream_id, payload))
+
+        try:
+            self._stream.read_bytes(HEADER.size, on_header)
+        except tornado.iostream.StreamClosedError:
+            pass
+
+    def _on_frame(self, frame_type, game_id, stream_id, payload):
+        """
+            Handle a frame from the channel, and read the next one. Frames for
+            streams that are not attached are dropped.
+
+            :param frame_type: The type of the frame.
+            :type frame_type: int
+            :param game_id: The ID of the game.
+            :type game_id: int
+            :param stream_id: The ID of the stream.
+            :type stream_id: int
+            :param payload: The payload of the frame.
+            :type payload: :class:`bytes`
+        """
+
+        if frame_type == CONTROL:
+            if self._on_control is not None:
+                self._on_control(game_id, json.loads(payload.decode()))
+        else:
+            stream = self._streams.get((game_id, stream_id))
+            if stream is not None and not stream.closed():
+                stream.write(stratumgs.protocol.encode_frame(frame_type, game_id, payload))
+        self._read_frame()
+
+    def _on_channel_closed(self):
+        """
+            Called when the connection closes. Every attached stream is sent a
+            close frame, as if the other side had closed it.
+        """
+
+        streams = list(self._streams.items())
+        self._streams = {}
+        for (game_id, _), stream in streams:
+            if not stream.closed():
+                stream.write(stratumgs.protocol.encode_frame(stratumgs.protocol.CLOSE, game_id))
+        if self._on_close is not None:
+            self._on_close()
+
+
+class BlockingChannel(object):
+    """
+        The blocking end of a channel, used by an engine pool worker, which runs
+        one synchronous engine at a time. Frames for the streams of the current
+        game are buffered until they are read, and frames for other games, such
+        as those that arrive after a game is over, are dropped.
+
+        :param sock: The worker end of the connection.
+        :type sock: :class:`socket.socket`
+    """
+
+    def __init__(self, sock):
+        self._socket = sock
+        self._buffer = bytearray()
+        self._game_id = None
+        self._frames = collections.defaultdict(collections.deque)
+        self._closed = False
+
+    def start_game(self, game_id):
+        """
+            Start reading the streams of a new game.
+
+            :param game_id: The ID of the game.
+            :type game_id: int
+        """
+
+        self._game_id = game_id
+        self._frames.clear()
+
+    def get_stream(self, stream_id):
+        """
+            Get a stream of the current game.
+
+            :param stream_id: The ID of the stream.
+            :type stream_id: int
+            :returns: The stream.
+            :rtype: :class:`BlockingChannelStream`
+        """
+
+        return BlockingChannelStream(self, stream_id)
+
+    def write_frame(self, frame_type, stream_id, payload):
+        """
+            Write a frame for a stream of the current game.
+
+            :param frame_type: The type of the frame.
+            :type frame_type: int
+            :param stream_id: The ID of the stream.
+            :type stream_id: int
+            :param payload: The payload of the frame.
+            :type payload: :class:`bytes`
+        """
+
+        self._socket.sendall(
+            HEADER.pack(frame_type, self._game_id, stream_id, len(payload)) + payload)
+
+    def read_frame(self, stream_id, timeout=None):
+        """
+            Read the next frame of a stream of the current game, blocking until
+            it arrives. If the connection has been closed, a close frame is
+            returned.
+
+            :param stream_id: The ID of the stream.
+            :type stream_id: int
+            :param timeout: The number of seconds to wait, or ``None`` to wait
+                            forever.
+            :type timeout: float
+            :returns: The type and payload of the frame, or ``None`` if the
+                      timeout expired first.
+        """
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        frames = self._frames[stream_id]
+        while not frames:
+            if self._closed:
+                return stratumgs.protocol.CLOSE, b""
+            if not self._receive(deadline):
+                return None
+        return frames.popleft()
+
+    def _receive(self, deadline):
+        """
+            Receive data from the connection, and buffer the frames it
+            completes.
+
+            :param deadline: The :func:`time.monotonic` time to wait until, or
+                             ``None`` to wait forever.
+            :type deadline: float
+            :returns: Whether any data was received before the deadline.
+        """
+
+        timeout = None if deadline is None else max(0, deadline - time.monotonic())
+        if not select.select([self._socket], [], [], timeout)[0]:
+            return False
+        data = self._socket.recv(65536)
+        if not data:
+            self._closed = True
+            return True
+        self._buffer += data
+        while len(self._buffer) >= HEADER.size:
+            frame_type, game_id, stream_id, length = HEADER.unpack_from(self._buffer)
+            end = HEADER.size + length
+            if len(self._buffer) < end:
+                break
+            if game_id == self._game_id:
+                self._frames[stream_id].append((frame_type, bytes(self._buffer[HEADER.size:end])))
+            del self._buffer[:end]
+        return True
+
+
+class BlockingChannelStream(object):
+    """
+        A stream of the current game on a :class:`BlockingChannel`, which is
+        used as the endpoints of an engine client.
+
+        :param channel: The channel.
+        :type channel: :class:`BlockingChannel`
+        :param stream_id: The ID of the stream.
+        :type stream_id: int
+    """
+
+    def __init__(self, channel, stream_id):
+        self._channel = channel
+        self._stream_id = stream_id
+
+    def write(self, frame):
+        """
+            Write an encoded frame to the stream.
+
+            :param frame: The frame, as encoded by
+                          :func:`stratumgs.protocol.encode_frame`.
+            :type frame: :class:`bytes`
+        """
+
+        frame_type, _, _ = stratumgs.protocol.HEADER.unpack_from(frame)
+        self._channel.write_frame(frame_type, self._stream_id,
+                                  frame[stratumgs.protocol.HEADER.size:])
+
+    def read(self, timeout=None):
+        """
+            Read the next frame from the stream.
+
+            :param timeout: The number of seconds to wait, or ``None`` to wait
+                            forever.
+            :type timeout: float
+            :returns: The type and payload of the frame, or ``None`` if the
+                      timeout expired first.
+        """
+
+        return self._channel.read_frame(self._stream_id, timeout)
@@ -7,4 +7,4 @@ code for interacting with clients.
 
 # flake8:noqa
 
-from .engine import BaseEngine
+from .engine import AsyncBaseEngine, BaseEngine
@@ -2,67 +2,154 @@
 .. module stratumgs.game.engine.client
 
 This module contains the code that represents a client in the game engine.
+Messages are exchanged with the server as frames, as described in
+:mod:`stratumgs.protocol`.
 """
 
-import json
-import os
-import socket
+import datetime
 
+import tornado.concurrent
+import tornado.gen
+import tornado.iostream
 
-def init_engine_client(connection_info):
+import stratumgs.codec
+import stratumgs.protocol
+
+from .local import LocalStream, QueueEndpoint
+
+
+def init_engine_client(connection_info, codec_name=stratumgs.codec.DEFAULT_CODEC,
+                       accepts_deltas=False):
     """
         Initialize an engine client from the given endpoints. Chooses whether to
-        create a pipe or socket based implementation, and returns the
-        instantiated client.
+        create an in memory or a channel based implementation, depending on
+        whether the engine runs in the server process or in an engine pool
+        worker, and returns the instantiated client. Engines run by the self
+        play harness are given queue endpoints instead.
 
         :param connection_info: The endpoints for the client connection.
+        :param codec_name: The name of the codec the client uses for payloads.
+        :type codec_name: string
+        :param accepts_deltas: Whether the client accepts state deltas.
+        :type accepts_deltas: boolean
         :returns: The engine client.
     """
 
-    if os.name == "posix":
-        return PipeEngineClient(connection_info)
+    codec = stratumgs.codec.get_codec(codec_name)
+    if isinstance(connection_info, LocalStream):
+        client = LocalEngineClient(connection_info, codec)
+    elif isinstance(connection_info, QueueEndpoint):
+        client = QueueEngineClient(connection_info, codec)
     else:
-        return SocketEngineClient(connection_info)
+        client = ChannelEngineClient(connection_info, codec)
+    client.accepts_deltas = accepts_deltas
+    return client
+
+
+def _encode_message(message, codec):
+    """
+        Encode a message as a frame.
+
+        :param message: The message, with a ``type``, and an optional
+                        ``payload``.
+        :type message: dict
+        :param codec: The codec to encode the payload with.
+        :returns: The encoded frame.
+    """
+
+    payload = codec.encode(message["payload"]) if "payload" in message else b""
+    return stratumgs.protocol.encode_frame(
+        stratumgs.protocol.TYPES[message["type"]], 0, payload)
 
 
-class PipeEngineClient(object):
+def _decode_message(frame_type, payload, codec):
     """
-        An engine client implementation using pipes.
+        Decode a frame into a message.
+
+        :param frame_type: The type of the frame.
+        :type frame_type: int
+        :param payload: The payload of the frame.
+        :type payload: :class:`bytes`
+        :param codec: The codec to decode the payload with.
+        :returns: The message, with a ``type`` and the decoded ``payload``,
+                  which is ``None`` if the frame had no payload.
+    """
+
+    return {
+        "type": stratumgs.protocol.TYPE_NAMES[frame_type],
+        "payload": codec.decode(payload) if payload else None
+    }
+
+
+class ChannelEngineClient(object):
+    """
+        An engine client implementation for engines run by an engine pool
+        worker, using a stream of the worker's
+        :class:`stratumgs.game.channel.BlockingChannel`.
 
-        :param file_descriptors: The read and write file descriptors for the
-                                 pipes.
-        :type file_descriptors: tuple(int, int)
+        :param stream: The stream.
+        :type stream: :class:`stratumgs.game.channel.BlockingChannelStream`
+        :param codec: The codec used for payloads.
     """
 
-    def __init__(self, file_descriptors):
-        self._read_pipe = None
-        self._write_pipe = None
-        if file_descriptors[0] is not None:
-            self._read_pipe = open(file_descriptors[0], "rb")
-        if file_descriptors[1] is not None:
-            self._write_pipe = open(file_descriptors[1], "wb", buffering=0)
+    def __init__(self, stream, codec):
+        self.codec = codec
+        self._stream = stream
 
     def write(self, message):
         """
             Write a message to the client.
 
-            :param message: The JSON-encodable message to write.
+            :param message: The message to write, with a ``type``, and an
+                            optional ``payload``, which is encoded with the
+                            client's codec.
+            :type message: dict
         """
 
-        self._write_pipe.write("{}\n".format(json.dumps(message)).encode())
+        self.write_frame(_encode_message(message, self.codec))
 
-    def read(self):
+    def write_frame(self, frame):
         """
-            Read a message from the client.
+            Write an already encoded frame to the client.
 
-            :returns: A JSON-decoded object.
+            :param frame: The frame to write.
+            :type frame: :class:`bytes`
+        """
+
+        self._stream.write(frame)
+
+    def read(self, timeout=None):
+        """
+            Read a message from the client. If the connection has been closed,
+            a close message is returned.
+
+            :param timeout: The number of seconds to wait for a message, or
+                            ``None`` to wait forever.
+            :type timeout: float
+            :returns: The message, with a ``type`` and a decoded ``payload``,
+                      or ``None`` if the timeout expired first.
         """
 
-        return json.loads(self._read_pipe.readline().decode().strip())
+        frame = self._stream.read(timeout)
+        if frame is None:
+            return None
+        return _decode_message(frame[0], frame[1], self.codec)
+
+    def poll(self):
+        """
+            Read a message from the client if one has already arrived, without
+            waiting.
+
+            :returns: The message, with a ``type`` and a decoded ``payload``,
+                      or ``None`` if there is no message.
+        """
+
+        return self.read(0)
 
     def close(self, write_close=True):
         """
-            Close the relevant connections.
+            Close the relevant connections. The channel itself stays open for
+            the worker's next game.
 
             :param write_close: Whether or not to write the close message.
             :type write_close: boolean
@@ -70,43 +157,109 @@ class PipeEngineClient(object):
 
         if write_close:
             self.write({"type": "close"})
-        if self._write_pipe:
-            self._write_pipe.close()
-        if self._read_pipe:
-            self._read_pipe.close()
 
 
-class SocketEngineClient(object):
+class LocalEngineClient(object):
     """
-        An engine client implementation using sockets.
+        An engine client implementation for engines that run inside the server
+        process, using a :class:`stratumgs.game.engine.local.LocalStream`.
+        Reading returns a future instead of blocking.
 
-        :param port: The port to connect to.
-        :type port: int
+        :param stream: The engine end of the local stream.
+        :type stream: :class:`stratumgs.game.engine.local.LocalStream`
+        :param codec: The codec used for payloads.
     """
 
-    def __init__(self, port):
-        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM, 0)
-        self._socket.connect(('127.0.0.1', port))
-        self._socket_read_file = self._socket.makefile("rb", 0)
-        self._socket_write_file = self._socket.makefile("wb", 0)
+    def __init__(self, stream, codec):
+        self.codec = codec
+        self._stream = stream
+        self._pending_read = None
 
     def write(self, message):
         """
             Write a message to the client.
 
-            :param message: The JSON-encodable message to write.
+            :param message: The message to write, with a ``type``, and an
+                            optional ``payload``, which is encoded with the
+                            client's codec.
+            :type message: dict
         """
 
-        self._socket_write_file.write("{}\n".format(json.dumps(message)).encode())
+        self.write_frame(_encode_message(message, self.codec))
 
-    def read(self):
+    def write_frame(self, frame):
         """
-            Read a message from the client.
+            Write an already encoded frame to the client.
 
-            :returns: A JSON-decoded object.
+            :param frame: The frame to write.
+            :type frame: :class:`bytes`
         """
 
-        return json.loads(self._socket_read_file.readline().decode().strip())
+        if not self._stream.closed():
+            self._stream.write(frame)
+
+    @tornado.gen.coroutine
+    def read(self, timeout=None):
+        """
+            Read a message from the client. If the connection has been closed,
+            a close message is returned. If the timeout expires, the read is
+            kept, and the next call waits for the same message.
+
+            :param timeout: The number of seconds to wait for a message, or
+                            ``None`` to wait forever.
+            :type timeout: float
+            :returns: A :class:`tornado.concurrent.Future` that resolves to the
+                      message, with a ``type`` and a decoded ``payload``, or to
+                      ``None`` if the timeout expired first.
+        """
+
+        if self._pending_read is None:
+            self._pending_read = self._read_message()
+        if timeout is not None:
+            try:
+                yield tornado.gen.with_timeout(
+                    datetime.timedelta(seconds=timeout), self._pending_read)
+            except tornado.gen.TimeoutError:
+                return None
+        message = yield self._pending_read
+        self._pending_read = None
+        return message
+
+    def poll(self):
+        """
+            Read a message from the client if one has already arrived, without
+            waiting. A read is started if none is pending, and since the stream
+            completes reads on the next iteration of the IOLoop, a message is
+            only returned by a later call.
+
+            :returns: The message, with a ``type`` and a decoded ``payload``,
+                      or ``None`` if there is no message.
+        """
+
+        if self._pending_read is None:
+            self._pending_read = self._read_message()
+        if not self._pending_read.done():
+            return None
+        message = self._pending_read.result()
+        self._pending_read = None
+        return message
+
+    @tornado.gen.coroutine
+    def _read_message(self):
+        """
+            Read a message from the stream.
+
+            :returns: A :class:`tornado.concurrent.Future` that resolves to the
+                      message.
+        """
+
+        try:
+            header = yield self._stream.read_bytes(stratumgs.protocol.HEADER.size)
+            frame_type, _, length = stratumgs.protocol.HEADER.unpack(header)
+            payload = (yield self._stream.read_bytes(length)) if length else b""
+        except tornado.iostream.StreamClosedError:
+            frame_type, payload = stratumgs.protocol.CLOSE, b""
+        return _decode_message(frame_type, payload, self.codec)
 
     def close(self, write_close=True):
         """
@@ -118,6 +271,94 @@ class SocketEngineClient(object):
 
         if write_close:
             self.write({"type": "close"})
-        self._socket_read_file.close()
-        self._socket_write_file.close()
-        self._socket.close()
+        self._stream.close()
+
+
+class QueueEngineClient(object):
+    """
+        An engine client implementation for engines run by the self play
+        harness, using a :class:`stratumgs.game.engine.local.QueueEndpoint`.
+        Reads never wait: the endpoint's player answers as soon as it is asked.
+        If the endpoint is asynchronous, reads return resolved futures, which
+        coroutines continue past without yielding to the IOLoop.
+
+        :param endpoint: The queue endpoint.
+        :type endpoint: :class:`stratumgs.game.engine.local.QueueEndpoint`
+        :param codec: The codec used for states.
+    """
+
+    def __init__(self, endpoint, codec):
+        self.codec = codec
+        self._endpoint = endpoint
+
+    def write(self, message):
+        """
+            Hand a message to the endpoint's message callback, without encoding
+            it.
+
+            :param message: The message to write, with a ``type``, and an
+                            optional ``payload``.
+            :type message: dict
+        """
+
+        if message["type"] == "message" and self._endpoint.on_message is not None:
+            self._endpoint.on_message(message.get("payload"))
+
+    def write_frame(self, frame):
+        """
+            Decode an already encoded state frame, and hand the state to the
+            endpoint's state callback. Other frames are discarded.
+
+            :param frame: The frame to write.
+            :type frame: :class:`bytes`
+        """
+
+        if self._endpoint.on_state is None:
+            return
+        frame_type, _, _ = stratumgs.protocol.HEADER.unpack_from(frame)
+        if frame_type == stratumgs.protocol.MESSAGE:
+            self._endpoint.on_state(self.codec.decode(frame[stratumgs.protocol.HEADER.size:]))
+
+    def read(self, timeout=None):
+        """
+            Read the next message from the endpoint's player. Since the player
+            answers immediately, the timeout is never reached.
+
+            :param timeout: The number of seconds to wait for a message, which
+                            is ignored.
+            :type timeout: float
+            :returns: The message, with a ``type`` and a ``payload``, or a
+                      resolved :class:`tornado.concurrent.Future` of it if the
+                      endpoint is asynchronous.
+        """
+
+        message = self._endpoint.get()
+        if self._endpoint.asynchronous:
+            future = tornado.concurrent.Future()
+            future.set_result(message)
+            return future
+        return message
+
+    def poll(self):
+        """
+            Read a message that has been queued for the engine, without asking
+            the endpoint's player.
+
+            :returns: The message, with a ``type`` and a ``payload``, or
+                      ``None`` if there is no message.
+        """
+
+        if self._endpoint.messages:
+            return self._endpoint.messages.popleft()
+        return None
+
+    def close(self, write_close=True):
+        """
+            Close the endpoint.
+
+            :param write_close: Whether or not to write the close message, which
+                                is ignored.
+            :type write_close: boolean
+        """
+
+        self._endpoint.closed = True
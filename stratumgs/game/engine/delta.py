@@ -0,0 +1,129 @@
+"""
+.. module stratumgs.game.engine.delta
+
+Computes and applies the differences between game states. Differences are lists
+of operations in the style of JSON Patch (RFC 6902), using the ``add``,
+``remove``, and ``replace`` operations. States must only contain values that
+can be encoded as JSON.
+"""
+
+
+def copy_state(state):
+    """
+        Make a deep copy of a state, so that later changes to the engine's own
+        objects do not change it.
+
+        :param state: The state to copy.
+        :returns: The copy.
+    """
+
+    if isinstance(state, dict):
+        return {key: copy_state(value) for key, value in state.items()}
+    if isinstance(state, (list, tuple)):
+        return [copy_state(value) for value in state]
+    return state
+
+
+def diff(old, new):
+    """
+        Compute the operations that change one state into another. Lists that
+        change length are replaced as a whole.
+
+        :param old: The previous state.
+        :param new: The new state.
+        :returns: A list of patch operations.
+    """
+
+    ops = []
+    _diff(old, new, "", ops)
+    return ops
+
+
+def _diff(old, new, path, ops):
+    """
+        Recursively compute the operations that change one value into another.
+
+        :param old: The previous value.
+        :param new: The new value.
+        :param path: The JSON pointer to the value.
+        :type path: string
+        :param ops: The list to append operations to.
+        :type ops: list
+    """
+
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key, value in new.items():
+            key_path = "{}/{}".format(path, _escape(key))
+            if key not in old:
+                ops.append({"op": "add", "path": key_path, "value": value})
+            else:
+                _diff(old[key], value, key_path, ops)
+        for key in old:
+            if key not in new:
+                ops.append({"op": "remove", "path": "{}/{}".format(path, _escape(key))})
+    elif (isinstance(old, list) and isinstance(new, (list, tuple)) and
+            len(old) == len(new)):
+        for i, value in enumerate(new):
+            _diff(old[i], value, "{}/{}".format(path, i), ops)
+    elif type(old) is not type(new) or old != new:
+        ops.append({"op": "replace", "path": path, "value": new})
+
+
+def apply_patch(state, ops):
+    """
+        Apply patch operations to a state. The state is changed in place, but
+        the result should still be used, since replacing the whole state
+        returns a new object.
+
+        :param state: The state to patch.
+        :param ops: The patch operations.
+        :type ops: list
+        :returns: The patched state.
+    """
+
+    for op in ops:
+        if op["path"] == "":
+            state = op.get("value")
+            continue
+        keys = [_unescape(key) for key in op["path"].split("/")[1:]]
+        parent = state
+        for key in keys[:-1]:
+            parent = parent[int(key)] if isinstance(parent, list) else parent[key]
+        key = keys[-1]
+        if isinstance(parent, list):
+            if op["op"] == "add":
+                parent.insert(len(parent) if key == "-" else int(key), op["value"])
+            elif op["op"] == "remove":
+                del parent[int(key)]
+            else:
+                parent[int(key)] = op["value"]
+        elif op["op"] == "remove":
+            del parent[key]
+        else:
+            parent[key] = op["value"]
+    return state
+
+
+def _escape(key):
+    """
+        Escape an object key for use in a JSON pointer.
+
+        :param key: The key.
+        :returns: The escaped key.
+        :rtype: string
+    """
+
+    return str(key).replace("~", "~0").replace("/", "~1")
+
+
+def _unescape(key):
+    """
+        Unescape an object key from a JSON pointer.
+
+        :param key: The escaped key.
+        :type key: string
+        :returns: The key.
+        :rtype: string
+    """
+
+    return key.replace("~1", "/").replace("~0", "~")
@@ -1,52 +1,256 @@
-import json
 import sys
+import time
+import traceback
 
+import tornado.gen
+import tornado.ioloop
+
+import stratumgs.protocol
+import stratumgs.tracing
+
+from . import delta
 from .client import init_engine_client
 
 
+class PlayerDisconnectedError(Exception):
+    """
+        Raised inside an in process engine when a player disconnects in the
+        middle of a game. It stops the game loop in place of the ``sys.exit``
+        used by engines that run in their own process.
+    """
+
+
+class PlayerTimeoutError(Exception):
+    """
+        Raised when a player runs out of time, and forfeits the game. It stops
+        the game loop, after which the final state is sent and the game ends
+        normally.
+
+        :param player_id: The ID of the player who ran out of time.
+        :type player_id: int
+    """
+
+    def __init__(self, player_id):
+        super().__init__("Player id {} ran out of time.".format(player_id))
+        self.player_id = player_id
+
+
 class BaseEngine(object):
     """
         Contains the base code for all game engines. Engines must extend this
         class, and need to implement ``is_game_over``, ``get_state``, and
         ``play_turn``.
 
-        :param players: The list of player endpoints.
-        :type players: list(player endpoints)
+        :param players: The list of player endpoints, each with the name of the
+                        codec the player uses, and whether the player accepts
+                        state deltas.
+        :type players: list(tuple(player endpoints, string, boolean))
         :param view_connection: The view connection endpoints.
+
+        Engines with large states can set ``state_keyframe_interval`` to send
+        most states as deltas from the previous state, as computed by
+        :func:`stratumgs.game.engine.delta.diff`. A full state, or keyframe, is
+        sent after that many deltas. Deltas are sent to the view, and to the
+        players that accept them; other players always receive full states.
+
+        Engines can limit the time players take with ``move_time_limit``, the
+        number of seconds a player has for each message, and
+        ``game_time_limit``, the total number of seconds each player has for
+        the whole game, like a chess clock. A player who runs out of game time
+        forfeits. A player who runs out of time for a move is given the move
+        returned by :meth:`get_default_move`, or forfeits if there is none. When
+        a player forfeits, :meth:`on_forfeit` is called, and the game ends.
+
+        The game loop checks whether the game is over with
+        :meth:`is_game_over` once, before the first turn. After each turn, it
+        passes whatever ``play_turn`` returned, such as the move that was
+        applied, to :meth:`is_game_over_after`, which engines can implement to
+        check only what the move changed, using indexes they keep up to date,
+        instead of the whole state. By default it calls :meth:`is_game_over`.
+
+        The view is only sent states while the runner wants them, which it
+        signals over the view connection: the first and final states are
+        always sent, but the states in between are skipped while no views are
+        watching the game and it is not being recorded for replays. Engines can
+        also give each player its own observation with
+        :meth:`get_player_state`, so the full state is only computed when
+        someone needs it.
+
+        When tracing is enabled, the engine records when it writes states and
+        messages and reads the players' replies, and sends the events to the
+        server over the view connection when the game is over.
     """
 
+    # The number of deltas to send between full states, or 0 to never send
+    # deltas
+    state_keyframe_interval = 0
+
+    # The number of seconds a player has to send each message, or 0 for no
+    # limit
+    move_time_limit = 0
+
+    # The number of seconds each player has for the whole game, or 0 for no
+    # limit
+    game_time_limit = 0
+
     def __init__(self, players=[], view_connection=None):
         self.num_players = len(players)
-        self._player_clients = [init_engine_client(p) for p in players]
-        self._view_client = init_engine_client(view_connection)
+        self._player_clients = [init_engine_client(*player) for player in players]
+        self._view_client = init_engine_client(view_connection, accepts_deltas=True)
+        self._last_sent_state = None
+        # the clients that were sent the last state, and can be sent a delta
+        # from it
+        self._clients_with_last_state = set()
+        self._deltas_since_keyframe = 0
+        self._view_states_wanted = True
+        self._time_remaining = [self.game_time_limit] * self.num_players
+        self._trace = None
+        if stratumgs.tracing.is_enabled():
+            self._trace = stratumgs.tracing.EngineTrace()
 
-    def _send_state(self):
+    def _send_state(self, force_view=False):
         """
-            Send the current state of the game to the view client.
+            Send the current state of the game to the players and the view
+            client. The state, or its delta from the previous state, is encoded
+            once for each codec in use, and the same frame is written to every
+            client using that codec. Players for whom :meth:`get_player_state`
+            returns an observation are sent that instead.
+
+            The view is only sent the state while the runner wants it, and the
+            full state is only computed when the view or a player needs it. A
+            delta is only sent to a client that was sent the state it is based
+            on; the others, such as the view when it is forced or wanted again
+            after skipped states, are sent the full state.
+
+            :param force_view: Whether to send the state to the view even if
+                               the runner does not want it, such as the first
+                               and the final states.
+            :type force_view: boolean
         """
 
-        msg = {
-            "type": "message",
-            "payload": json.dumps(self.get_state())
-        }
-        for p in self._player_clients:
-            p.write(msg)
-        self._view_client.write(msg)
+        trace_start = stratumgs.tracing.now() if self._trace is not None else None
+        self._poll_view_client()
+        send_view = force_view or self._view_states_wanted
+        player_states = [self.get_player_state(player_id)
+                         for player_id in range(self.num_players)]
 
-    def run(self):
+        state = None
+        state_delta = None
+        if send_view or None in player_states:
+            state = self.get_state()
+            if self.state_keyframe_interval > 0:
+                if (self._last_sent_state is not None and
+                        self._deltas_since_keyframe < self.state_keyframe_interval):
+                    state_delta = delta.diff(self._last_sent_state, state)
+                    self._deltas_since_keyframe += 1
+                else:
+                    self._deltas_since_keyframe = 0
+                self._last_sent_state = delta.copy_state(state)
+        else:
+            # no one is sent the full state, so the next one is a keyframe
+            self._last_sent_state = None
+
+        frames = {}
+        clients_with_state = set()
+        for client, player_state in zip(self._player_clients, player_states):
+            if player_state is None:
+                client.write_frame(self._get_state_frame(frames, client, state, state_delta))
+                clients_with_state.add(client)
+            else:
+                client.write_frame(stratumgs.protocol.encode_frame(
+                    stratumgs.protocol.MESSAGE, 0, client.codec.encode(player_state)))
+        if send_view:
+            self._view_client.write_frame(
+                self._get_state_frame(frames, self._view_client, state, state_delta))
+            clients_with_state.add(self._view_client)
+        self._clients_with_last_state = clients_with_state
+        if self._trace is not None:
+            self._trace.record("engine write", "engine", trace_start,
+                               {"type": "state", "delta": state_delta is not None,
+                                "view": send_view})
+
+    def _get_state_frame(self, frames, client, state, state_delta):
         """
-            Start the main game loop.
+            Get the frame of the full state, or of its delta, for a client,
+            encoding it only if no other client with the same codec has been
+            sent the same frame.
+
+            :param frames: The frames encoded so far, by codec name and whether
+                           they are deltas.
+            :type frames: dict
+            :param client: The client.
+            :param state: The full state.
+            :param state_delta: The delta from the previous state, or ``None``
+                                if the state is a keyframe. The delta is only
+                                used if the client was sent the previous state.
+            :returns: The frame.
+            :rtype: :class:`bytes`
         """
 
-        self._send_state()
-        while not self.is_game_over():
-            self.play_turn()
-            self._send_state()
-        self._send_state()
+        is_delta = (state_delta is not None and client.accepts_deltas and
+                    client in self._clients_with_last_state)
+        key = (client.codec.name, is_delta)
+        frame = frames.get(key)
+        if frame is None:
+            if is_delta:
+                frame = stratumgs.protocol.encode_frame(
+                    stratumgs.protocol.DELTA, 0, client.codec.encode(state_delta))
+            else:
+                frame = stratumgs.protocol.encode_frame(
+                    stratumgs.protocol.MESSAGE, 0, client.codec.encode(state))
+            frames[key] = frame
+        return frame
+
+    def _poll_view_client(self):
+        """
+            Handle the messages the runner has sent over the view connection,
+            without waiting for any. The runner sends whether it wants the
+            view to be sent states, which it does not when no views are
+            watching the game, and the game is not being recorded for replays.
+            When the view is wanted again, the next state is sent in full,
+            since the view missed the states in between.
+        """
+
+        message = self._view_client.poll()
+        while message is not None and message["type"] != "close":
+            if message["type"] == "views":
+                wanted = bool(message["payload"])
+                if wanted and not self._view_states_wanted:
+                    self._last_sent_state = None
+                self._view_states_wanted = wanted
+            message = self._view_client.poll()
+
+    def _close_clients(self):
+        """
+            Close the connections to the players and the view, sending the
+            engine's trace events to the view first if tracing is enabled.
+        """
+
+        if self._trace is not None:
+            self._view_client.write_frame(stratumgs.protocol.encode_frame(
+                stratumgs.protocol.TRACE, 0, self._trace.encode()))
         for p in self._player_clients:
             p.close()
         self._view_client.close()
 
+    def run(self):
+        """
+            Start the main game loop.
+        """
+
+        self._send_state(force_view=True)
+        try:
+            game_over = self.is_game_over()
+            while not game_over:
+                move = self.play_turn()
+                self._send_state()
+                game_over = self.is_game_over_after(move)
+        except PlayerTimeoutError as e:
+            print(e)
+            self.on_forfeit(e.player_id)
+        self._send_state(force_view=True)
+        self._close_clients()
+
     def send_message_to_player(self, player_id, message):
         """
             Send the given message to the given player ID. The message gets
@@ -60,8 +264,10 @@ class BaseEngine(object):
 
         self._player_clients[player_id].write({
             "type": "message",
-            "payload": json.dumps(message)
+            "payload": message
         })
+        if self._trace is not None:
+            self._trace.record("engine write", "engine", args={"player": player_id})
 
     def receive_message_from_player(self, player_id):
         """
@@ -73,14 +279,100 @@ class BaseEngine(object):
             :returns: The message received from the player.
         """
 
-        obj = self._player_clients[player_id].read()
+        start = time.monotonic()
+        trace_start = stratumgs.tracing.now() if self._trace is not None else None
+        obj = self._player_clients[player_id].read(self._get_time_limit(player_id))
+        if self._trace is not None:
+            self._trace.record("engine read", "engine", trace_start, {"player": player_id})
+        if obj is None:
+            return self._on_timeout(player_id, start)
+        self._charge_time(player_id, start)
         if obj["type"] == "close":
             print("Player id {} disconnected.".format(player_id))
-            for p in self._player_clients:
-                p.close()
-            self._view_client.close()
+            self._close_clients()
             sys.exit(1)
-        return json.loads(obj["payload"])
+        return obj["payload"]
+
+    def _get_time_limit(self, player_id):
+        """
+            Get the number of seconds a player has to send their next message.
+
+            :param player_id: The ID of the player.
+            :type player_id: int
+            :returns: The number of seconds, or ``None`` if there is no limit.
+        """
+
+        limits = []
+        if self.move_time_limit > 0:
+            limits.append(self.move_time_limit)
+        if self.game_time_limit > 0:
+            limits.append(max(self._time_remaining[player_id], 0))
+        return min(limits) if limits else None
+
+    def _charge_time(self, player_id, start):
+        """
+            Subtract the time a player took to send a message from their game
+            time.
+
+            :param player_id: The ID of the player.
+            :type player_id: int
+            :param start: The time the engine started waiting for the message,
+                          from :func:`time.monotonic`.
+            :type start: float
+        """
+
+        if self.game_time_limit > 0:
+            self._time_remaining[player_id] -= time.monotonic() - start
+
+    def _on_timeout(self, player_id, start):
+        """
+            Apply the timeout policy when a player does not send a message in
+            time.
+
+            :param player_id: The ID of the player.
+            :type player_id: int
+            :param start: The time the engine started waiting for the message,
+                          from :func:`time.monotonic`.
+            :type start: float
+            :returns: The default move to use in place of the player's message.
+            :raises PlayerTimeoutError: If the player is out of game time, or
+                                        there is no default move.
+        """
+
+        self._charge_time(player_id, start)
+        if self.game_time_limit > 0 and self._time_remaining[player_id] <= 0:
+            raise PlayerTimeoutError(player_id)
+        move = self.get_default_move(player_id)
+        if move is None:
+            raise PlayerTimeoutError(player_id)
+        print("Player id {} ran out of time for a move.".format(player_id))
+        return move
+
+    def get_default_move(self, player_id):
+        """
+            Can be implemented by the game engine. Get the move to play for a
+            player who runs out of time for a move. The move should look like a
+            message the player could have sent. If the player's own message
+            arrives after the timeout, it is received as their next message.
+
+            :param player_id: The ID of the player.
+            :type player_id: int
+            :returns: The move, or ``None`` if the player forfeits.
+        """
+
+        return None
+
+    def on_forfeit(self, player_id):
+        """
+            Can be implemented by the game engine. Called when a player
+            forfeits by running out of time, before the final state is sent, so
+            that the engine can record the result.
+
+            :param player_id: The ID of the player who forfeited.
+            :type player_id: int
+        """
+
+        pass
 
     def is_game_over(self):
         """
@@ -91,19 +383,151 @@ class BaseEngine(object):
 
         raise NotImplementedError
 
+    def is_game_over_after(self, move):
+        """
+            Can be implemented by the game engine. Checks if the game is over
+            after a turn, given the result of ``play_turn``, which is usually
+            the move that was applied. Engines that keep indexes of what each
+            move changes can check only the lines, regions, or counters the
+            move touched, instead of scanning the whole state.
+
+            :param move: The value returned by ``play_turn``.
+            :returns: True if the game is over, false otherwise.
+        """
+
+        return self.is_game_over()
+
     def get_state(self):
         """
             Must be implemented by the game engine. Get the current state of the
-            game.
+            game, as seen by the view, and by the players unless
+            :meth:`get_player_state` gives them their own observations.
 
             :returns: The state of the game.
         """
 
         raise NotImplementedError
 
+    def get_player_state(self, player_id):
+        """
+            Can be implemented by the game engine. Get the observation of the
+            game sent to a player in place of the full state, such as the part
+            of the state the player can see, or a smaller state that is cheaper
+            to compute and encode. Observations are always sent in full, never
+            as deltas. If every player has an observation, and no views are
+            watching, the full state is not computed.
+
+            :param player_id: The ID of the player.
+            :type player_id: int
+            :returns: The observation, or ``None`` to send the player the full
+                      state.
+        """
+
+        return None
+
     def play_turn(self):
         """
             Must be implemented by the game engine. Plays a turn of the game.
+
+            :returns: The move that was applied, or anything else the engine's
+                      :meth:`is_game_over_after` needs, or ``None``.
         """
 
         raise NotImplementedError
+
+
+class AsyncBaseEngine(BaseEngine):
+    """
+        A base engine for games that run as coroutines inside the server's
+        IOLoop, instead of in a background process. Waiting on a player does not
+        block, so many of these games can run at once at the cost of a coroutine
+        each. Engines must extend this class and set ``in_process`` to ``True``
+        in their ``CONFIG``. They implement the same methods as
+        :class:`BaseEngine`, except that ``play_turn`` must be a coroutine which
+        yields the result of :meth:`receive_message_from_player`, and whose
+        result is passed to :meth:`is_game_over_after`.
+
+        Since these engines share the server's IOLoop, they should only be used
+        for games whose rules are cheap to compute.
+
+        :param players: The list of player endpoints, each with the name of the
+                        codec the player uses, and whether the player accepts
+                        state deltas.
+        :type players: list(tuple(player endpoints, string, boolean))
+        :param view_connection: The view connection endpoints.
+    """
+
+    def start(self):
+        """
+            Run the main game loop in the current IOLoop. If the engine raises
+            an exception, it is printed, and the connections to the players and
+            the view are closed, so that the game ends, and the players are
+            freed, instead of the game hanging.
+        """
+
+        tornado.ioloop.IOLoop.current().add_future(self.run(), self._on_run_finished)
+
+    def _on_run_finished(self, future):
+        """
+            Called when the main game loop finishes. If it failed, the
+            exception is printed, and the connections are closed. Connections
+            the engine already closed are left as they are.
+
+            :param future: The future returned by :meth:`run`.
+            :type future: :class:`tornado.concurrent.Future`
+        """
+
+        try:
+            future.result()
+        except Exception:
+            traceback.print_exc()
+            self._close_clients()
+
+    @tornado.gen.coroutine
+    def run(self):
+        """
+            Start the main game loop.
+
+            :returns: A :class:`tornado.concurrent.Future` that resolves when
+                      the game is over.
+        """
+
+        self._send_state(force_view=True)
+        try:
+            game_over = self.is_game_over()
+            while not game_over:
+                move = yield self.play_turn()
+                self._send_state()
+                game_over = self.is_game_over_after(move)
+        except PlayerDisconnectedError:
+            return
+        except PlayerTimeoutError as e:
+            print(e)
+            self.on_forfeit(e.player_id)
+        self._send_state(force_view=True)
+        self._close_clients()
+
+    @tornado.gen.coroutine
+    def receive_message_from_player(self, player_id):
+        """
+            Wait until a message is received from the given player.
+
+            :param player_id: The ID of the player to receive a message from.
+            :type player_id: int
+            :returns: A :class:`tornado.concurrent.Future` that resolves to the
+                      message received from the player.
+        """
+
+        start = time.monotonic()
+        trace_start = stratumgs.tracing.now() if self._trace is not None else None
+        obj = yield self._player_clients[player_id].read(self._get_time_limit(player_id))
+        if self._trace is not None:
+            self._trace.record("engine read", "engine", trace_start, {"player": player_id})
+        if obj is None:
+            return self._on_timeout(player_id, start)
+        self._charge_time(player_id, start)
+        if obj["type"] == "close":
+            print("Player id {} disconnected.".format(player_id))
+            self._close_clients()
+            raise PlayerDisconnectedError()
+        return obj["payload"]
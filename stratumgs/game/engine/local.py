@@ -0,0 +1,316 @@
+"""
+.. module stratumgs.game.engine.local
+
+In memory streams used to connect engines that run inside the server process to
+the rest of the server. They provide the subset of the
+:class:`tornado.iostream.IOStream` interface that the client proxy and engine
+runner rely on, so in process engines can be handled the same way as engines
+running in a background process.
+
+Queue endpoints connect an engine directly to synthetic players, without a
+server at all, so that the engine's rules can be measured on their own.
+"""
+
+import collections
+
+import tornado.concurrent
+import tornado.ioloop
+import tornado.iostream
+
+
+def make_local_stream_pair():
+    """
+        Make two connected local streams. Data written to one stream can be read
+        from the other.
+
+        :returns: A tuple of the two streams.
+    """
+
+    a, b = LocalStream(), LocalStream()
+    a._peer, b._peer = b, a
+    return a, b
+
+
+class LocalStream(object):
+    """
+        One end of an in memory, bidirectional byte stream. Read callbacks are
+        always run on the next iteration of the IOLoop, never directly from
+        ``write``, which matches the behavior of real streams. Like a pipe, data
+        that was written before the other end closed can still be read.
+    """
+
+    def __init__(self):
+        self._peer = None
+        self._buffer = bytearray()
+        self._pending_read = None
+        self._closed = False
+        self._peer_closed = False
+        self._close_callback = None
+        self._receive_callback = None
+
+    def write(self, data, callback=None):
+        """
+            Write data to the stream. The data is handed to the other end
+            immediately, so the callback is run on the next iteration of the
+            IOLoop.
+
+            :param data: The data to write.
+            :type data: :class:`bytes`
+            :param callback: A callback to call once the data has been written.
+            :type callback: function
+        """
+
+        if self._closed:
+            raise tornado.iostream.StreamClosedError()
+        if not self._peer_closed:
+            self._peer._receive(data)
+        if callback is not None:
+            tornado.ioloop.IOLoop.current().add_callback(callback)
+
+    def get_unread_size(self):
+        """
+            Get the number of bytes written to this stream that the other end
+            has not read yet.
+
+            :returns: The number of unread bytes.
+        """
+
+        if self._closed or self._peer_closed:
+            return 0
+        return len(self._peer._buffer)
+
+    def get_buffered_size(self):
+        """
+            Get the number of bytes the other end has written to this stream
+            that have not been read yet.
+
+            :returns: The number of buffered bytes.
+        """
+
+        return len(self._buffer)
+
+    def read_until(self, delimiter, callback=None):
+        """
+            Read until the delimiter is found. The data read, including the
+            delimiter, is passed to the callback.
+
+            :param delimiter: The delimiter to read until.
+            :type delimiter: :class:`bytes`
+            :param callback: The callback to call. If not given, a future is
+                             returned instead.
+            :type callback: function
+            :returns: A :class:`tornado.concurrent.Future` if no callback is
+                      given.
+        """
+
+        def find():
+            index = self._buffer.find(delimiter)
+            return -1 if index == -1 else index + len(delimiter)
+        return self._start_read(find, callback)
+
+    def read_bytes(self, num_bytes, callback=None):
+        """
+            Read a number of bytes. The data read is passed to the callback.
+
+            :param num_bytes: The number of bytes to read.
+            :type num_bytes: int
+            :param callback: The callback to call. If not given, a future is
+                             returned instead.
+            :type callback: function
+            :returns: A :class:`tornado.concurrent.Future` if no callback is
+                      given.
+        """
+
+        def find():
+            return num_bytes if len(self._buffer) >= num_bytes else -1
+        return self._start_read(find, callback)
+
+    def set_close_callback(self, callback):
+        """
+            Set a callback to be called when the stream is closed.
+
+            :param callback: The callback.
+            :type callback: function
+        """
+
+        self._close_callback = callback
+
+    def set_receive_callback(self, callback):
+        """
+            Set a callback to be called, with no arguments, whenever the other
+            end writes data to this stream, once the data has been buffered.
+            Unlike read callbacks, it is called directly from ``write``.
+
+            :param callback: The callback.
+            :type callback: function
+        """
+
+        self._receive_callback = callback
+
+    def close(self):
+        """
+            Close this end of the stream. Once the other end has read any data
+            that is still buffered, it is closed as well.
+        """
+
+        if self._closed:
+            return
+        self._closed = True
+        self._buffer = bytearray()
+        self._fail_pending_read()
+        if self._close_callback is not None:
+            tornado.ioloop.IOLoop.current().add_callback(self._close_callback)
+            self._close_callback = None
+        self._peer._on_peer_closed()
+
+    def closed(self):
+        """
+            Check whether the stream is closed.
+
+            :returns: Whether the stream is closed.
+        """
+
+        return self._closed
+
+    def _start_read(self, find, callback):
+        """
+            Register a pending read, and try to satisfy it with buffered data.
+
+            :param find: A function returning the number of buffered bytes the
+                         read consumes, or -1 if it cannot be satisfied yet.
+            :type find: function
+            :param callback: The callback to call, or ``None`` for a future.
+            :type callback: function
+            :returns: A future if no callback is given.
+        """
+
+        future = None
+        if callback is None:
+            future = tornado.concurrent.Future()
+            callback = future.set_result
+        if self._closed:
+            if future is not None:
+                future.set_exception(tornado.iostream.StreamClosedError())
+            return future
+        self._pending_read = (find, callback, future)
+        self._try_read()
+        if self._peer_closed and self._pending_read is not None:
+            self.close()
+        return future
+
+    def _on_peer_closed(self):
+        """
+            Called when the other end of the stream is closed. If a pending read
+            cannot be satisfied by the buffered data, the stream is closed.
+        """
+
+        self._peer_closed = True
+        if self._pending_read is not None:
+            self.close()
+
+    def _receive(self, data):
+        """
+            Called by the other end of the stream when data is written to it.
+
+            :param data: The data written.
+            :type data: :class:`bytes`
+        """
+
+        if self._closed:
+            return
+        self._buffer += data
+        self._try_read()
+        if self._receive_callback is not None:
+            self._receive_callback()
+
+    def _try_read(self):
+        """
+            Complete the pending read if there is enough data buffered.
+        """
+
+        if self._pending_read is None:
+            return
+        find, callback, _ = self._pending_read
+        end = find()
+        if end == -1:
+            return
+        self._pending_read = None
+        data = bytes(self._buffer[:end])
+        del self._buffer[:end]
+        tornado.ioloop.IOLoop.current().add_callback(callback, data)
+
+    def _fail_pending_read(self):
+        """
+            Fail a pending read that was waiting on a future, because the stream
+            has closed.
+        """
+
+        if self._pending_read is not None:
+            future = self._pending_read[2]
+            self._pending_read = None
+            if future is not None:
+                future.set_exception(tornado.iostream.StreamClosedError())
+
+
+class QueueEndpoint(object):
+    """
+        An in memory endpoint that connects an engine to a synthetic player
+        instead of a client, used by :mod:`stratumgs.selfplay`. Messages for the
+        engine are queued already decoded, and when the engine reads with
+        nothing queued, the reply callback is asked for the next message, so
+        the player answers without any IOLoop iterations. States written by the
+        engine are decoded and handed to the state callback, and other messages
+        to the message callback, without being encoded.
+
+        :param on_state: Called with each state the engine sends, or ``None``
+                         to discard states without decoding them.
+        :type on_state: function
+        :param on_message: Called with the payload of each message the engine
+                           sends, or ``None`` to discard them.
+        :type on_message: function
+        :param reply: Called with no arguments when the engine reads and no
+                      message is queued. Returns the next message, with a
+                      ``type`` and a ``payload``, or ``None`` to disconnect.
+        :type reply: function
+        :param asynchronous: Whether reads return resolved futures, for engines
+                             extending
+                             :class:`stratumgs.game.engine.AsyncBaseEngine`.
+        :type asynchronous: boolean
+    """
+
+    def __init__(self, on_state=None, on_message=None, reply=None, asynchronous=False):
+        self.on_state = on_state
+        self.on_message = on_message
+        self.reply = reply
+        self.asynchronous = asynchronous
+        self.messages = collections.deque()
+        self.closed = False
+
+    def put(self, message):
+        """
+            Queue a message for the engine.
+
+            :param message: The message, with a ``type`` and a ``payload``.
+            :type message: dict
+        """
+
+        self.messages.append(message)
+
+    def get(self):
+        """
+            Get the next message for the engine, asking the reply callback if
+            none is queued. Once the endpoint is closed, or if there is no
+            message, a close message is returned.
+
+            :returns: The message.
+            :rtype: dict
+        """
+
+        message = None
+        if self.messages:
+            message = self.messages.popleft()
+        elif self.reply is not None and not self.closed:
+            message = self.reply()
+        if message is None:
+            return {"type": "close", "payload": None}
+        return message
@@ -0,0 +1,44 @@
+"""
+.. module stratumgs.game.games.gomoku
+
+A Gomoku game engine: five in a row on a 15 by 15 board.
+"""
+
+import stratumgs.config
+
+from .mnk import MNKEngine
+
+CONFIG = {
+    "display_name": "Gomoku",
+    "description": "A game of Gomoku, or five in a row, on a 15 by 15 board.",
+    "num_players": 2,
+    "player_names": ["X", "O"],
+    "in_process": True
+}
+
+
+class Engine(MNKEngine):
+    """
+        The engine class for Gomoku. By default, players have ten seconds for
+        each move, after which the first empty space is played for them, and
+        five minutes for the whole game, after which they forfeit. The limits
+        are read from the ``gomoku`` configuration section. Since each move
+        changes a single space of the large board, states are sent as deltas,
+        with a full state every 20 moves.
+
+        :param players: The players for the game.
+        :type players: list(player endpoints)
+        :param view_connection: The view connection endpoints.
+    """
+
+    rows = 15
+    columns = 15
+    k = 5
+
+    state_keyframe_interval = 20
+
+    def __init__(self, players=[], view_connection=None):
+        # the limits are needed before the base class starts the players' clocks
+        self.move_time_limit = stratumgs.config.get("gomoku", "move_time_limit")
+        self.game_time_limit = stratumgs.config.get("gomoku", "game_time_limit")
+        super(Engine, self).__init__(players=players, view_connection=view_connection)
@@ -0,0 +1,201 @@
+"""
+.. module stratumgs.game.games.mnk
+
+A base engine for m,n,k-games, in which two players take turns placing their
+letter on an empty space of a board with m rows and n columns, and the first to
+get k in a row, horizontally, vertically, or diagonally, wins. TicTacToe is the
+3,3,3-game, and Gomoku the 15,15,5-game.
+
+Each player's spaces are kept in a bitboard, an integer with one bit for each
+space. After each turn, :meth:`MNKEngine.is_game_over_after` detects a win by
+following only the lines through the space just played, which takes time
+proportional to k rather than to the size of the board. Each row of the
+bitboard is padded with an extra, always empty bit, so a line that runs off the
+side of the board stops at the padding instead of wrapping around onto the next
+row.
+"""
+
+import tornado.gen
+
+from ..engine import AsyncBaseEngine
+
+
+# The letters of the players, by player ID
+LETTERS = ("X", "O")
+
+
+class MNKEngine(AsyncBaseEngine):
+    """
+        The base engine class for m,n,k-games. Games extend this class, and set
+        ``rows``, ``columns``, and ``k``. The players are prompted for their
+        moves, starting with X, using the same protocol as TicTacToe, and the
+        state includes the board as a list of rows, which is updated in place
+        as moves are played.
+
+        :param players: The players for the game.
+        :type players: list(player endpoints)
+        :param view_connection: The view connection endpoints.
+    """
+
+    # The number of rows of the board
+    rows = 3
+
+    # The number of columns of the board
+    columns = 3
+
+    # The number of letters in a row needed to win
+    k = 3
+
+    def __init__(self, players=[], view_connection=None):
+        super(MNKEngine, self).__init__(players=players, view_connection=view_connection)
+        # the bit of the space at a row and column is row * width + column
+        self._width = self.columns + 1
+        self._size = self.rows * self._width
+        # the steps between the bits of neighboring spaces along each line:
+        # horizontal, vertical, and the two diagonals
+        self._steps = (1, self._width, self._width + 1, self._width - 1)
+        self._masks = [0, 0]
+        self._board = [[None] * self.columns for _ in range(self.rows)]
+        self._num_moves = 0
+        self._winner = None
+        self._x_turn = True
+
+    def is_game_over(self):
+        """
+            Check if the game is over. The game is over when a player gets k in
+            a row, or when all spaces on the board are full. Runs are found for
+            the whole board at once, by repeatedly combining each bitboard with
+            itself shifted one step along a line.
+
+            :returns: True if the game is over, false otherwise.
+        """
+
+        for player_id, mask in enumerate(self._masks):
+            for step in self._steps:
+                runs = mask
+                for _ in range(self.k - 1):
+                    runs &= runs >> step
+                if runs:
+                    self._winner = LETTERS[player_id]
+        return self._winner is not None or self._num_moves == self.rows * self.columns
+
+    def is_game_over_after(self, move):
+        """
+            Check if the game is over after a move, by following only the lines
+            through the space that was played.
+
+            :param move: The player ID and the bit of the space played, as
+                         returned by :meth:`play_turn`.
+            :type move: tuple(int, int)
+            :returns: True if the game is over, false otherwise.
+        """
+
+        player_id, space = move
+        if self._is_winning_move(self._masks[player_id], space):
+            self._winner = LETTERS[player_id]
+            return True
+        return self._num_moves == self.rows * self.columns
+
+    def get_default_move(self, player_id):
+        """
+            Get the move to play for a player who runs out of time for a move,
+            which is the first empty space on the board.
+
+            :param player_id: The ID of the player.
+            :type player_id: int
+            :returns: The move.
+        """
+
+        for row, cells in enumerate(self._board):
+            for col, cell in enumerate(cells):
+                if cell is None:
+                    return {"row": row, "column": col}
+        return None
+
+    def on_forfeit(self, player_id):
+        """
+            Award the game to the other player when a player forfeits.
+
+            :param player_id: The ID of the player who forfeited.
+            :type player_id: int
+        """
+
+        self._winner = LETTERS[1 - player_id]
+
+    def get_state(self):
+        """
+            Get the current state object for the game. The state of the game
+            includes the contents of the board, and the winner of the game.
+            Before the game is over or when the outcome is a draw, the winner is
+            ``None``.
+
+            :returns: The state.
+        """
+
+        return {
+            "type": "state",
+            "board": self._board,
+            "winner": self._winner
+        }
+
+    @tornado.gen.coroutine
+    def play_turn(self):
+        """
+            Play a turn of the game. The current player is prompted to make a
+            move. If the move is invalid, including when it is not a row and a
+            column, the client is asked to repeat the turn. Once the client has
+            input a valid move, the move is recorded, and the turn ends.
+
+            :returns: A :class:`tornado.concurrent.Future` that resolves to the
+                      player ID and the bit of the space played.
+        """
+
+        cur_player_id = 0 if self._x_turn else 1
+        self.send_message_to_player(cur_player_id, {"type": "turn"})
+        while True:
+            move = yield self.receive_message_from_player(cur_player_id)
+            row = col = None
+            if isinstance(move, dict):
+                row, col = move.get("row"), move.get("column")
+            error = None
+            if not (isinstance(row, int) and 0 <= row < self.rows and
+                    isinstance(col, int) and 0 <= col < self.columns):
+                error = "out-of-bounds"
+            elif self._board[row][col] is not None:
+                error = "space-not-empty"
+            if error is None:
+                break
+            self.send_message_to_player(cur_player_id, {
+                "type": "repeat-turn",
+                "error": error,
+                "last-move": move
+            })
+        space = row * self._width + col
+        self._masks[cur_player_id] |= 1 << space
+        self._board[row][col] = LETTERS[cur_player_id]
+        self._num_moves += 1
+        self._x_turn = not self._x_turn
+        return cur_player_id, space
+
+    def _is_winning_move(self, mask, space):
+        """
+            Check whether the move just played completes k in a row, by counting
+            the player's spaces along each line through it.
+
+            :param mask: The player's bitboard, including the move.
+            :type mask: int
+            :param space: The bit of the space played.
+            :type space: int
+            :returns: Whether the move wins the game.
+        """
+
+        for step in self._steps:
+            count = 1
+            for direction in (step, -step):
+                bit = space + direction
+                while count < self.k and 0 <= bit < self._size and mask >> bit & 1:
+                    count += 1
+                    bit += direction
+            if count >= self.k:
+                return True
+        return False
@@ -0,0 +1,324 @@
+"""
+.. module stratumgs.game.pool
+
+A pool of long lived engine worker processes. Instead of starting a new process
+for every game, engine runners hand each game to an idle worker in the pool. The
+worker runs the engine, and then returns to the pool to wait for the next game.
+
+Each worker has a single connection to the server, a
+:class:`stratumgs.game.channel.Channel`, which carries the streams of the
+players and the view of every game it runs, so a game needs no pipes or sockets
+of its own.
+"""
+
+import collections
+import multiprocessing
+import socket
+import traceback
+
+import tornado.ioloop
+import tornado.iostream
+
+import stratumgs.game.channel
+import stratumgs.metrics
+import stratumgs.protocol
+
+
+_POOL = None
+
+# The time taken to start each worker process
+WORKER_SPAWN_LATENCY = stratumgs.metrics.Histogram(
+    "stratumgs_engine_worker_spawn_seconds",
+    "Time taken to start an engine worker process.")
+
+
+def init(size, max_games_per_worker):
+    """
+        Initialize the engine worker pool, and pre-fork its workers. If the size
+        is zero, no pool is created and every game gets its own process.
+
+        :param size: The maximum number of worker processes in the pool.
+        :type size: int
+        :param max_games_per_worker: The number of games a worker runs before
+                                     it is replaced by a fresh process. Zero
+                                     means workers are never replaced.
+        :type max_games_per_worker: int
+    """
+
+    global _POOL
+    if size > 0:
+        _POOL = EngineWorkerPool(size, max_games_per_worker)
+
+
+def run_engine(game_id, engine_constructor, player_endpoints, view_connection):
+    """
+        Run an engine in the background. If the pool has been initialized, the
+        game is handed to one of its workers, otherwise a new single use worker
+        is started for the game.
+
+        :param game_id: The ID of the game.
+        :type game_id: int
+        :param engine_constructor: The engine class to initialize.
+        :type engine_constructor: ``stratumgs.game.engine.BaseEngine``
+        :param player_endpoints: The in memory streams of the players in the
+                                 game, with their client options.
+        :type player_endpoints: list(tuple(LocalStream, string, boolean))
+        :param view_connection: The engine end of the view stream.
+        :type view_connection: :class:`stratumgs.game.engine.local.LocalStream`
+    """
+
+    if _POOL is not None:
+        _POOL.run_engine(game_id, engine_constructor, player_endpoints, view_connection)
+        return
+
+    EngineWorker(None, 1).assign(game_id, engine_constructor, player_endpoints, view_connection)
+
+
+def _worker_main(connection, channel_socket, max_games):
+    """
+        The target function for a pool worker process. Waits for game
+        assignments on the control connection, runs each game, and reports back
+        when it is ready for another one. The streams of every game are carried
+        by the worker's channel. If an engine raises an exception, its game's
+        streams are closed, so that the game ends instead of hanging.
+
+        :param connection: The worker end of the control connection.
+        :type connection: :class:`multiprocessing.connection.Connection`
+        :param channel_socket: The worker end of the channel.
+        :type channel_socket: :class:`socket.socket`
+        :param max_games: The number of games to run before exiting, or zero to
+                          run forever.
+        :type max_games: int
+    """
+
+    channel = stratumgs.game.channel.BlockingChannel(channel_socket)
+    games_played = 0
+    while max_games == 0 or games_played < max_games:
+        try:
+            engine_constructor, game_id, players = connection.recv()
+        except EOFError:
+            break
+
+        channel.start_game(game_id)
+        player_endpoints = [(channel.get_stream(player_id), codec, accepts_deltas)
+                            for player_id, (codec, accepts_deltas) in enumerate(players)]
+        view_connection = channel.get_stream(stratumgs.game.channel.VIEW_STREAM)
+        try:
+            engine = engine_constructor(players=player_endpoints, view_connection=view_connection)
+            engine.run()
+        except SystemExit:
+            pass
+        except Exception:
+            traceback.print_exc()
+            _close_game_streams(channel, len(players))
+
+        games_played += 1
+        connection.send(games_played)
+    connection.close()
+    channel_socket.close()
+
+
+def _close_game_streams(channel, num_players):
+    """
+        Write a close frame to every player stream and to the view stream of
+        the current game of a worker, such as after its engine has crashed.
+        Streams the engine already closed ignore the extra frame.
+
+        :param channel: The worker's channel.
+        :type channel: :class:`stratumgs.game.channel.BlockingChannel`
+        :param num_players: The number of players in the game.
+        :type num_players: int
+    """
+
+    try:
+        for stream_id in list(range(num_players)) + [stratumgs.game.channel.VIEW_STREAM]:
+            channel.write_frame(stratumgs.protocol.CLOSE, stream_id, b"")
+    except OSError:
+        traceback.print_exc()
+
+
+class EngineWorker(object):
+    """
+        The server side handle to a single worker process in the pool.
+
+        :param pool: The pool the worker belongs to, or ``None`` for a single
+                     use worker.
+        :type pool: :class:`EngineWorkerPool`
+        :param max_games: The number of games the worker runs before it exits.
+        :type max_games: int
+    """
+
+    def __init__(self, pool, max_games):
+        self._pool = pool
+        self.max_games = max_games
+        self.games_played = 0
+        self.is_busy = False
+
+        self._connection, worker_connection = multiprocessing.Pipe()
+        channel_socket, worker_channel_socket = socket.socketpair()
+        self._process = multiprocessing.Process(
+            target=_worker_main, args=(worker_connection, worker_channel_socket, max_games))
+        self._process.daemon = True
+        with WORKER_SPAWN_LATENCY.time():
+            self._process.start()
+        worker_connection.close()
+        worker_channel_socket.close()
+        self._channel = stratumgs.game.channel.Channel(tornado.iostream.IOStream(channel_socket))
+
+        tornado.ioloop.IOLoop.current().add_handler(
+            self._connection.fileno(), self._on_control_message,
+            tornado.ioloop.IOLoop.READ | tornado.ioloop.IOLoop.ERROR)
+
+    def is_retiring(self):
+        """
+            Determine whether the worker has played all of its games, and will
+            exit instead of accepting another one.
+
+            :returns: Whether the worker is retiring.
+        """
+
+        return self.max_games != 0 and self.games_played >= self.max_games
+
+    def assign(self, game_id, engine_constructor, player_endpoints, view_connection):
+        """
+            Assign a game to the worker. The game's streams are attached to the
+            worker's channel, and the game is sent over the control connection.
+
+            :param game_id: The ID of the game.
+            :type game_id: int
+            :param engine_constructor: The engine class to initialize.
+            :type engine_constructor: ``stratumgs.game.engine.BaseEngine``
+            :param player_endpoints: The in memory streams of the players in the
+                                     game, with their client options.
+            :type player_endpoints: list(tuple(LocalStream, string, boolean))
+            :param view_connection: The engine end of the view stream.
+            :type view_connection: :class:`stratumgs.game.engine.local.LocalStream`
+        """
+
+        self.is_busy = True
+        for player_id, (stream, _, _) in enumerate(player_endpoints):
+            self._channel.attach(game_id, player_id, stream)
+        self._channel.attach(game_id, stratumgs.game.channel.VIEW_STREAM, view_connection)
+        self._connection.send((engine_constructor, game_id, [
+            (codec, accepts_deltas) for _, codec, accepts_deltas in player_endpoints]))
+
+    def _on_control_message(self, fd, events):
+        """
+            Handles messages and hang ups on the control connection.
+
+            :param fd: The file descriptor of the control connection.
+            :type fd: int
+            :param events: The events that occurred.
+            :type events: int
+        """
+
+        try:
+            self.games_played = self._connection.recv()
+        except (EOFError, OSError):
+            tornado.ioloop.IOLoop.current().remove_handler(fd)
+            self._connection.close()
+            # the streams of a game the worker was running are closed
+            self._channel.close()
+            self._process.join()
+            if self._pool is not None:
+                self._pool.on_worker_exit(self)
+            return
+        self.is_busy = False
+        if self._pool is not None and not self.is_retiring():
+            self._pool.on_worker_ready(self)
+
+
+class EngineWorkerPool(object):
+    """
+        Manages a bounded set of engine worker processes. Games are assigned to
+        idle workers; when every worker is busy and the pool is at its maximum
+        size, games wait in a queue until a worker becomes available.
+
+        :param size: The maximum number of worker processes.
+        :type size: int
+        :param max_games_per_worker: The number of games a worker runs before it
+                                     is replaced.
+        :type max_games_per_worker: int
+    """
+
+    def __init__(self, size, max_games_per_worker):
+        self.size = size
+        self.max_games_per_worker = max_games_per_worker
+        self._workers = set()
+        self._idle_workers = collections.deque()
+        self._pending_games = collections.deque()
+        for _ in range(size):
+            self._idle_workers.append(self._spawn_worker())
+
+    def _spawn_worker(self):
+        """
+            Start a new worker process.
+
+            :returns: The new worker.
+        """
+
+        worker = EngineWorker(self, self.max_games_per_worker)
+        self._workers.add(worker)
+        return worker
+
+    def run_engine(self, game_id, engine_constructor, player_endpoints, view_connection):
+        """
+            Run a game on the next available worker.
+
+            :param game_id: The ID of the game.
+            :type game_id: int
+            :param engine_constructor: The engine class to initialize.
+            :type engine_constructor: ``stratumgs.game.engine.BaseEngine``
+            :param player_endpoints: The in memory streams of the players in the
+                                     game, with their client options.
+            :type player_endpoints: list(tuple(LocalStream, string, boolean))
+            :param view_connection: The engine end of the view stream.
+            :type view_connection: :class:`stratumgs.game.engine.local.LocalStream`
+        """
+
+        self._pending_games.append((game_id, engine_constructor, player_endpoints,
+                                    view_connection))
+        self._assign_pending_games()
+
+    def _assign_pending_games(self):
+        """
+            Hand queued games to idle workers, starting new workers if the pool
+            is below its maximum size.
+        """
+
+        while self._pending_games:
+            if self._idle_workers:
+                worker = self._idle_workers.popleft()
+            elif len(self._workers) < self.size:
+                worker = self._spawn_worker()
+            else:
+                return
+            worker.assign(*self._pending_games.popleft())
+
+    def on_worker_ready(self, worker):
+        """
+            Called when a worker has finished a game and can accept another.
+
+            :param worker: The worker.
+            :type worker: :class:`EngineWorker`
+        """
+
+        self._idle_workers.append(worker)
+        self._assign_pending_games()
+
+    def on_worker_exit(self, worker):
+        """
+            Called when a worker process exits, either because it has played
+            its maximum number of games or because it died. A replacement is
+            started so that the pool stays warm.
+
+            :param worker: The worker.
+            :type worker: :class:`EngineWorker`
+        """
+
+        self._workers.discard(worker)
+        if worker in self._idle_workers:
+            self._idle_workers.remove(worker)
+        if len(self._workers) < self.size:
+            self._idle_workers.append(self._spawn_worker())
+        self._assign_pending_games()
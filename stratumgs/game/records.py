@@ -0,0 +1,187 @@
+"""
+.. module stratumgs.game.records
+
+An on disk store of finished games. Once a game is over, a record of it is
+appended to the store, so that it can be removed from memory while remaining
+available to query. Records are indexed by game ID, engine, and player.
+"""
+
+import collections
+import json
+import sqlite3
+
+
+# A record of a finished game
+GameRecord = collections.namedtuple("GameRecord", [
+    "game_id", "engine_name", "engine_display_name", "player_names",
+    "started", "finished", "final_state"])
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS games (
+        game_id INTEGER PRIMARY KEY,
+        engine_name TEXT NOT NULL,
+        engine_display_name TEXT NOT NULL,
+        started REAL NOT NULL,
+        finished REAL NOT NULL,
+        final_state TEXT
+    );
+    CREATE INDEX IF NOT EXISTS games_engine_name ON games (engine_name, game_id);
+    CREATE TABLE IF NOT EXISTS game_players (
+        game_id INTEGER NOT NULL,
+        player_index INTEGER NOT NULL,
+        player_name TEXT NOT NULL,
+        PRIMARY KEY (game_id, player_index)
+    );
+    CREATE INDEX IF NOT EXISTS game_players_player_name
+        ON game_players (player_name, game_id);
+"""
+
+_STORE = None
+
+
+def init(path):
+    """
+        Initialize the game record store. If the path is empty, games are not
+        recorded.
+
+        :param path: The path of the database file to store records in.
+        :type path: str
+    """
+
+    global _STORE
+    if path:
+        _STORE = GameRecordStore(path)
+
+
+def is_enabled():
+    """
+        Check whether games are being recorded.
+
+        :returns: Whether the store has been initialized.
+    """
+
+    return _STORE is not None
+
+
+def get_store():
+    """
+        Get the game record store.
+
+        :returns: The :class:`GameRecordStore`, or ``None`` if games are not
+                  being recorded.
+    """
+
+    return _STORE
+
+
+class GameRecordStore(object):
+    """
+        Stores records of finished games in an SQLite database. Records are only
+        ever appended, and each game is committed as soon as it is recorded.
+
+        :param path: The path of the database file.
+        :type path: str
+    """
+
+    def __init__(self, path):
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._db.commit()
+
+    def get_next_game_id(self):
+        """
+            Get the first game ID that has not been recorded, so that new games
+            do not reuse the IDs of recorded ones.
+
+            :returns: The next game ID.
+        """
+
+        row = self._db.execute("SELECT MAX(game_id) FROM games").fetchone()
+        return 0 if row[0] is None else row[0] + 1
+
+    def append(self, record):
+        """
+            Append the record of a finished game.
+
+            :param record: The record.
+            :type record: :class:`GameRecord`
+        """
+
+        with self._db:
+            self._db.execute(
+                "INSERT INTO games VALUES (?, ?, ?, ?, ?, ?)",
+                (record.game_id, record.engine_name, record.engine_display_name,
+                 record.started, record.finished, json.dumps(record.final_state)))
+            self._db.executemany(
+                "INSERT INTO game_players VALUES (?, ?, ?)",
+                [(record.game_id, i, name) for i, name in enumerate(record.player_names)])
+
+    def get(self, game_id):
+        """
+            Get the record of a game.
+
+            :param game_id: The ID of the game.
+            :type game_id: int
+            :returns: The :class:`GameRecord`, or ``None`` if the game has not
+                      been recorded.
+        """
+
+        records = self._select("WHERE game_id = ?", (game_id,))
+        return records[0] if records else None
+
+    def find(self, engine_name=None, player_name=None, limit=50):
+        """
+            Find the most recently finished games, optionally only those played
+            with an engine or by a player.
+
+            :param engine_name: The engine to find games for.
+            :type engine_name: string
+            :param player_name: The player to find games for.
+            :type player_name: string
+            :param limit: The maximum number of records to return.
+            :type limit: int
+            :returns: A list of :class:`GameRecord`, newest first.
+        """
+
+        conditions = []
+        params = []
+        if engine_name is not None:
+            conditions.append("engine_name = ?")
+            params.append(engine_name)
+        if player_name is not None:
+            conditions.append(
+                "game_id IN (SELECT game_id FROM game_players WHERE player_name = ?)")
+            params.append(player_name)
+        where = "WHERE {}".format(" AND ".join(conditions)) if conditions else ""
+        return self._select(
+            "{} ORDER BY game_id DESC LIMIT ?".format(where), params + [limit])
+
+    def _select(self, clause, params):
+        """
+            Select records from the database. The players of all of the
+            selected games are read with a single query, which selects the same
+            games as a subquery.
+
+            :param clause: The SQL following the ``FROM`` clause.
+            :type clause: string
+            :param params: The parameters for the query.
+            :type params: list
+            :returns: A list of :class:`GameRecord`.
+        """
+
+        rows = self._db.execute(
+            "SELECT game_id, engine_name, engine_display_name, started, finished, "
+            "final_state FROM games {}".format(clause), params).fetchall()
+        if not rows:
+            return []
+        player_names = collections.defaultdict(list)
+        for game_id, name in self._db.execute(
+                "SELECT game_id, player_name FROM game_players WHERE game_id IN "
+                "(SELECT game_id FROM games {}) ORDER BY game_id, player_index".format(clause),
+                params):
+            player_names[game_id].append(name)
+        return [GameRecord(game_id, engine_name, display_name, player_names[game_id],
+                           started, finished, json.loads(final_state))
+                for game_id, engine_name, display_name, started, finished, final_state in rows]
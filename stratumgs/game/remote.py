@@ -0,0 +1,185 @@
+"""
+.. module stratumgs.game.remote
+
+Remote engine workers, which add engine capacity on other machines. Each worker
+is a daemon, started with ``stratumgs-worker``, that connects to the server's
+engine worker port, and registers the engines it can run and the number of
+games it can run at once. New games are assigned to the least loaded worker
+with a free slot, and only run in the server's own engine pool when every
+worker is full.
+
+Every game a worker runs is carried over its single connection, which is a
+:class:`stratumgs.game.channel.Channel`. The streams of the players' client
+proxies and of the game's view are attached to the channel, so the rest of the
+server is unaware that the engine runs elsewhere.
+
+Workers are trusted with the games they run, so the worker port only listens on
+the loopback interface by default. When a secret is configured, a worker must
+send it when it registers, and is disconnected otherwise. The connection is not
+encrypted, so the secret only protects the port on a trusted network.
+"""
+
+import hmac
+
+import tornado.tcpserver
+
+import stratumgs.game.channel
+
+
+_WORKERS = set()
+_SECRET = ""
+
+# The hosts that only accept workers on the same machine
+_LOOPBACK_HOSTS = ("127.0.0.1", "::1", "localhost")
+
+
+def init(host, port, secret=""):
+    """
+        Start listening for remote engine workers. If the port is zero, remote
+        workers are not accepted.
+
+        :param host: The host to bind to.
+        :type host: str
+        :param port: The engine worker port.
+        :type port: int
+        :param secret: The secret workers must send to register, or an empty
+                       string to accept any worker.
+        :type secret: str
+    """
+
+    global _SECRET
+    _SECRET = secret
+    if port > 0:
+        if not secret and host not in _LOOPBACK_HOSTS:
+            print("Warning: engine workers are accepted on {}:{} without a secret.".format(
+                host or "all interfaces", port))
+        EngineWorkerServer().listen(port, address=host)
+
+
+def get_workers():
+    """
+        Get the registered remote workers.
+
+        :returns: A list of :class:`RemoteEngineWorker`, in unspecified order.
+    """
+
+    return list(_WORKERS)
+
+
+def get_available_worker(engine_name):
+    """
+        Get the least loaded remote worker that can run a game of an engine.
+
+        :param engine_name: The name of the engine.
+        :type engine_name: string
+        :returns: The :class:`RemoteEngineWorker`, or ``None`` if no worker
+                  has a free slot.
+    """
+
+    workers = [w for w in _WORKERS if engine_name in w.engines and w.is_available()]
+    if not workers:
+        return None
+    return min(workers, key=lambda w: len(w.games) / w.capacity)
+
+
+class RemoteEngineWorker(object):
+    """
+        The server side handle to a remote engine worker.
+
+        :param stream: The worker's connection.
+        :type stream: :class:`tornado.iostream.IOStream`
+        :param address: The worker's address.
+        :type address: tuple
+    """
+
+    def __init__(self, stream, address):
+        self.address = address
+        self.name = None
+        self.engines = []
+        self.capacity = 0
+        self.games = set()
+        self._channel = stratumgs.game.channel.Channel(stream, self._on_control, self._on_close)
+
+    def is_available(self):
+        """
+            Determine whether the worker has free slots.
+
+            :returns: Whether the worker can run another game.
+        """
+
+        return len(self.games) < self.capacity
+
+    def run_engine(self, game_id, engine_name, player_endpoints, view_connection):
+        """
+            Run a game on the worker.
+
+            :param game_id: The ID of the game.
+            :type game_id: int
+            :param engine_name: The name of the game's engine.
+            :type engine_name: string
+            :param player_endpoints: The in memory streams of the players in the
+                                     game, with their client options.
+            :type player_endpoints: list(tuple(LocalStream, string, boolean))
+            :param view_connection: The engine end of the view stream.
+            :type view_connection: :class:`stratumgs.game.engine.local.LocalStream`
+        """
+
+        self.games.add(game_id)
+        for player_id, (stream, _, _) in enumerate(player_endpoints):
+            self._channel.attach(game_id, player_id, stream)
+        self._channel.attach(game_id, stratumgs.game.channel.VIEW_STREAM, view_connection,
+                             lambda: self.games.discard(game_id))
+        self._channel.send_control(game_id, {
+            "type": "start",
+            "engine": engine_name,
+            "players": [{"codec": codec, "accepts_deltas": accepts_deltas}
+                        for _, codec, accepts_deltas in player_endpoints]
+        })
+
+    def _on_control(self, game_id, message):
+        """
+            Handle a control message from the worker.
+
+            :param game_id: The ID of the game the message is about.
+            :type game_id: int
+            :param message: The message.
+            :type message: dict
+        """
+
+        if message["type"] == "register":
+            if _SECRET and not hmac.compare_digest(
+                    str(message.get("secret", "")).encode(), _SECRET.encode()):
+                print("Engine worker {} sent the wrong secret, disconnecting.".format(
+                    self.address))
+                self._channel.close()
+                return
+            try:
+                self.name = str(message["name"])
+                self.engines = [str(engine) for engine in message["engines"]]
+                self.capacity = int(message["capacity"])
+            except (KeyError, TypeError, ValueError):
+                print("Invalid registration from engine worker {}".format(self.address))
+                self._channel.close()
+                return
+            _WORKERS.add(self)
+            print("Engine worker {} connected.".format(self.name))
+
+    def _on_close(self):
+        """
+            Called when the worker disconnects. Its games end, since their
+            streams are closed.
+        """
+
+        if self in _WORKERS:
+            _WORKERS.discard(self)
+            print("Engine worker {} disconnected.".format(self.name))
+
+
+class EngineWorkerServer(tornado.tcpserver.TCPServer):
+    """
+        Listens for remote engine workers.
+    """
+
+    def handle_stream(self, stream, address):
+        stream.set_nodelay(True)
+        RemoteEngineWorker(stream, address)
@@ -0,0 +1,265 @@
+"""
+.. module stratumgs.game.replay
+
+Records every state sent to the views of a game in a replay file, so that the
+game can be replayed after the engine has finished. Each replay is made of two
+files in the replay directory:
+
+* ``<game_id>.replay``, the state frames sent by the engine, exactly as they
+  were read from the view connection, one frame per turn.
+* ``<game_id>.index``, one entry per turn with the offset of the turn's frame,
+  and the offset of the last full state at or before the turn. This allows a
+  replay to start from any turn by reading from that full state, without
+  reading the whole replay.
+
+The index is kept in memory while the game is played, and written when the
+replay is finished, so a running game only holds one open file. A replay whose
+game did not finish, such as when the server stopped, has no index, and cannot
+be replayed. Replays are read from disk a frame at a time as they are sent, and
+existing replays are never overwritten.
+"""
+
+import os
+import struct
+
+import stratumgs.game.broadcast
+import stratumgs.protocol
+
+
+# The offset of the turn's frame, and of the full state it is based on
+INDEX_ENTRY = struct.Struct("!QQ")
+
+_REPLAY_DIRECTORY = None
+
+
+def init(directory):
+    """
+        Initialize replay recording. If the directory is empty, games are not
+        recorded.
+
+        :param directory: The directory to store replays in. It is created if it
+                          does not exist.
+        :type directory: str
+    """
+
+    global _REPLAY_DIRECTORY
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    _REPLAY_DIRECTORY = directory or None
+
+
+def is_enabled():
+    """
+        Check whether games are being recorded.
+
+        :returns: Whether replay recording has been initialized.
+    """
+
+    return _REPLAY_DIRECTORY is not None
+
+
+def _get_paths(game_id):
+    """
+        Get the paths of the files of a replay.
+
+        :param game_id: The ID of the game.
+        :type game_id: int
+        :returns: A tuple of the replay path and the index path.
+    """
+
+    base = os.path.join(_REPLAY_DIRECTORY, str(game_id))
+    return base + ".replay", base + ".index"
+
+
+def get_next_game_id():
+    """
+        Get the ID after the highest game ID with a replay in the replay
+        directory, so that new games do not reuse the IDs of recorded games.
+
+        :returns: The next game ID, or 0 if no games have been recorded.
+    """
+
+    if _REPLAY_DIRECTORY is None:
+        return 0
+    next_game_id = 0
+    for filename in os.listdir(_REPLAY_DIRECTORY):
+        name, extension = os.path.splitext(filename)
+        if extension == ".replay" and name.isdigit():
+            next_game_id = max(next_game_id, int(name) + 1)
+    return next_game_id
+
+
+def open_replay_writer(game_id):
+    """
+        Open a writer to record the replay of a new game.
+
+        :param game_id: The ID of the game.
+        :type game_id: int
+        :returns: The :class:`ReplayWriter`, or ``None`` if games are not being
+                  recorded.
+    """
+
+    if _REPLAY_DIRECTORY is None:
+        return None
+    try:
+        return ReplayWriter(game_id, *_get_paths(game_id))
+    except FileExistsError:
+        print("A replay of game {} already exists, not recording it.".format(game_id))
+        return None
+
+
+def load_replay(game_id):
+    """
+        Open the replay of a finished game. Only the index is read; the states
+        are read from the replay file as they are requested, so the replay must
+        be closed once it has been sent. Only call this for games that are
+        over.
+
+        :param game_id: The ID of the game.
+        :type game_id: int
+        :returns: The :class:`Replay`, or ``None`` if there is no replay of the
+                  game.
+    """
+
+    if _REPLAY_DIRECTORY is None:
+        return None
+    replay_path, index_path = _get_paths(game_id)
+    try:
+        with open(index_path, "rb") as index_file:
+            index = index_file.read()
+        return Replay(open(replay_path, "rb"), index)
+    except FileNotFoundError:
+        return None
+
+
+class ReplayWriter(object):
+    """
+        Appends the states of a game to its replay file, and writes its index
+        when the replay is finished. The files are created exclusively, so an
+        existing replay is never overwritten.
+
+        :param game_id: The ID of the game.
+        :type game_id: int
+        :param replay_path: The path of the replay file.
+        :type replay_path: str
+        :param index_path: The path of the index file.
+        :type index_path: str
+        :raises FileExistsError: If the replay file already exists.
+    """
+
+    def __init__(self, game_id, replay_path, index_path):
+        self.game_id = game_id
+        self._replay_file = open(replay_path, "xb")
+        self._index_path = index_path
+        self._index = bytearray()
+        self._offset = 0
+        self._keyframe_offset = 0
+
+    def append(self, frame_type, payload):
+        """
+            Append a state to the replay.
+
+            :param frame_type: The type of the frame the state was sent in,
+                               either a message or a delta.
+            :type frame_type: int
+            :param payload: The encoded state or delta.
+            :type payload: bytes
+        """
+
+        if frame_type != stratumgs.protocol.DELTA:
+            self._keyframe_offset = self._offset
+        frame = stratumgs.protocol.encode_frame(frame_type, self.game_id, payload)
+        self._replay_file.write(frame)
+        self._index += INDEX_ENTRY.pack(self._offset, self._keyframe_offset)
+        self._offset += len(frame)
+
+    def close(self):
+        """
+            Finish the replay: close the replay file, and write the index.
+        """
+
+        self._replay_file.close()
+        try:
+            with open(self._index_path, "xb") as index_file:
+                index_file.write(self._index)
+        except FileExistsError:
+            print("The index of the replay of game {} already exists, not writing it.".format(
+                self.game_id))
+
+
+class Replay(object):
+    """
+        The recorded states of a finished game, which are read from the
+        replay file as they are requested.
+
+        :param replay_file: The replay file, opened for reading in binary mode.
+                            It is closed by :meth:`close`.
+        :param index: The contents of the index file.
+        :type index: bytes
+    """
+
+    def __init__(self, replay_file, index):
+        self._file = replay_file
+        self._index = [INDEX_ENTRY.unpack_from(index, i)
+                       for i in range(0, len(index), INDEX_ENTRY.size)]
+
+    def close(self):
+        """
+            Close the replay file.
+        """
+
+        self._file.close()
+
+    def get_num_turns(self):
+        """
+            Get the number of turns in the replay.
+
+            :returns: The number of turns.
+        """
+
+        return len(self._index)
+
+    def _read_frame(self, offset):
+        """
+            Read the frame at an offset in the replay.
+
+            :param offset: The offset of the frame.
+            :type offset: int
+            :returns: A tuple of the frame type, the payload, and the offset of
+                      the next frame.
+        """
+
+        self._file.seek(offset)
+        frame_type, _, payload = stratumgs.protocol.read_frame_from_file(self._file)
+        return frame_type, payload, offset + stratumgs.protocol.HEADER.size + len(payload)
+
+    def get_turn(self, turn):
+        """
+            Get the view message for a turn.
+
+            :param turn: The turn.
+            :type turn: int
+            :returns: The message, as it is sent to views.
+            :rtype: bytes
+        """
+
+        frame_type, payload, _ = self._read_frame(self._index[turn][0])
+        return stratumgs.game.broadcast.build_view_message(frame_type, payload)
+
+    def seek(self, turn):
+        """
+            Get the view messages that bring a new view to a turn, which are
+            the last full state at or before the turn, and the deltas since.
+
+            :param turn: The turn.
+            :type turn: int
+            :returns: A list of messages, as they are sent to views.
+            :rtype: list(bytes)
+        """
+
+        turn_offset, offset = self._index[turn]
+        messages = []
+        while offset <= turn_offset:
+            frame_type, payload, offset = self._read_frame(offset)
+            messages.append(stratumgs.game.broadcast.build_view_message(frame_type, payload))
+        return messages
@@ -2,26 +2,53 @@
 .. module stratumgs.game.runner
 
 Classes and helpers in this module create and manage engine runners, which
-manage the game engines which run as background processes.
+manage the game engines which run as background processes. The processes
+themselves are provided by :mod:`stratumgs.game.pool`.
 """
 
 import json
-import multiprocessing
-import os
+import time
 
 import tornado.ioloop
 
-import tornado.iostream
-import stratumgs.client.proxy
-
+import stratumgs.config
 import stratumgs.game
-
-
-def init_engine_runner(game_id, engine, engine_name, players):
+import stratumgs.game.broadcast
+import stratumgs.game.engine.delta
+import stratumgs.game.engine.local
+import stratumgs.game.pool
+import stratumgs.game.records
+import stratumgs.game.remote
+import stratumgs.game.replay
+import stratumgs.metrics
+import stratumgs.protocol
+import stratumgs.shard
+import stratumgs.tracing
+
+
+# The time from starting an engine to its first state, which includes waiting
+# for a pool worker, or starting a process
+ENGINE_START_LATENCY = stratumgs.metrics.Histogram(
+    "stratumgs_engine_start_seconds",
+    "Time from starting a game's engine to receiving its first state.",
+    ("engine", "runner"))
+
+# The time between consecutive states of a game, which covers a turn of the
+# engine, including the players' moves. While no views are watching a game that
+# is not recorded, the engine skips states, so a sample can span several turns.
+TURN_LATENCY = stratumgs.metrics.Histogram(
+    "stratumgs_turn_seconds",
+    "Time between consecutive states sent by a game's engine.",
+    ("engine",))
+
+
+def init_engine_runner(game_id, engine, engine_name, players, state_forwarder=None):
     """
-        Initialize a new engine runner. Since engine runners can be implemented
-        using either pipes or sockets, depending on platform availability, this
-        method simplifies creation of new runners.
+        Initialize a new engine runner. Since engine runners can run the engine
+        in the engine pool, or inside the server process, depending on the
+        engine's ``in_process`` configuration, or on a remote engine worker,
+        when one has a free slot, this method simplifies creation of new
+        runners.
 
         :param game_id: The ID of the game being created.
         :type game_id: int
@@ -31,36 +58,31 @@ def init_engine_runner(game_id, engine, engine_name, players):
         :type engine_name: string
         :param players: The players in the game.
         :type players: list(player endpoints)
+        :param state_forwarder: A function to call with the type and payload of
+                                each frame from the engine, instead of handling
+                                the states in this process, such as in a shard.
+        :type state_forwarder: function
         :returns: The created engine runner.
     """
 
-    if os.name == "posix":
-        return PipeEngineRunner(game_id, engine, engine_name, players)
+    if stratumgs.shard.is_coordinator():
+        runner_class = ShardEngineRunner
+    elif stratumgs.game.remote.get_available_worker(engine_name) is not None:
+        runner_class = RemoteEngineRunner
+    elif stratumgs.game.get_game_configuration(engine_name).get("in_process", False):
+        runner_class = LocalEngineRunner
     else:
-        return SocketEngineRunner(game_id, engine, engine_name, players)
-
-
-def _start_process(engine_constructor, player_endpoints, view_connection):
-    """
-        The target function for the background process. Intializes and starts
-        the specified engine.
-
-        :param engine_constructor: The engine class to initialize.
-        :type engine_constructor: ``stratumgs.game.engine.BaseEngine``
-        :param player_endpoints: The endpoints of the players in the game.
-        :type player_endpoints: list(player endpoints)
-        :param view_connection: The endpoints for the view connection.
-    """
-
-    engine = engine_constructor(players=player_endpoints, view_connection=view_connection)
-    engine.run()
+        runner_class = PoolEngineRunner
+    return runner_class(game_id, engine, engine_name, players, state_forwarder)
 
 
 class BaseEngineRunner(object):
     """
         Most of the logic for running a game engine is contained in this class.
-        It is extended by classes that implement the communication with the
-        view, depending on whether pipes or sockets are in use.
+        It is extended by classes that start the engine, depending on where it
+        runs. The players and the view are always connected to the engine with
+        in memory streams, which are attached to a channel when the engine runs
+        in another process.
 
         :param game_id: The ID of the game being created.
         :type game_id: int
@@ -70,135 +92,439 @@ class BaseEngineRunner(object):
         :type engine_name: string
         :param players: The players in the game.
         :type players: list(player endpoints)
+        :param state_forwarder: A function to call with the type and payload of
+                                each frame from the engine, instead of handling
+                                the states in this process.
+        :type state_forwarder: function
     """
 
-    def __init__(self, game_id, engine_constructor, engine_name, players):
+    def __init__(self, game_id, engine_constructor, engine_name, players,
+                 state_forwarder=None):
         self._last_state = None
-        self._connected_views = []
+        self._deltas_since_last_state = []
+        self._views = stratumgs.game.broadcast.BroadcastHub(
+            stratumgs.config.get("web_server", "max_view_buffer_size"))
+        self._replay = None
+        if state_forwarder is None:
+            self._replay = stratumgs.game.replay.open_replay_writer(game_id)
+        self._state_forwarder = state_forwarder
 
         engine_config = stratumgs.game.get_game_configuration(engine_name)
+        max_view_updates = engine_config.get(
+            "max_view_updates_per_second",
+            stratumgs.config.get("web_server", "max_view_updates_per_second"))
+        self._view_update_interval = 1.0 / max_view_updates if max_view_updates > 0 else 0.0
+        self._next_view_update_time = 0.0
+        self._views_behind = False
+        self._view_update_timeout = None
+
+        self.game_id = game_id
+        self.started = time.time()
         self.engine_name = engine_name
         self.engine_display_name = engine_config["display_name"]
         self.is_running = True
         self.players = players
+        self._last_state_time = None
+        self._view_states_wanted = True
+        self.timeline = stratumgs.tracing.start_game(game_id)
 
         view_connection = self.init_view_connection()
 
         player_endpoints = [player.create_endpoints_for_game(game_id) for player in players]
-        engine_process = multiprocessing.Process(
-            target=_start_process,
-            args=(engine_constructor, player_endpoints, view_connection))
-        engine_process.start()
+        self._start_time = time.monotonic()
+        self.start_engine(engine_constructor, player_endpoints, view_connection)
+        self._update_view_states_wanted()
+
+        stratumgs.protocol.read_frame(self.read_from_view_connection, self._on_receive_state)
+
+    def init_view_connection(self):
+        """
+            Initializes the view connection using an in memory stream.
+
+            :returns: The engine end of the stream.
+        """
 
-        self.read_from_view_connection(b"\n", self._on_receive_state)
+        self._view_stream, engine_end = stratumgs.game.engine.local.make_local_stream_pair()
+        return engine_end
 
-    def _on_receive_state(self, state):
+    def start_engine(self, engine_constructor, player_endpoints, view_connection):
         """
-            Callback that is called when a game state is received over the view
+            Start the engine. Implemented by subclasses.
+
+            :param engine_constructor: The engine class to initialize.
+            :type engine_constructor: ``stratumgs.game.engine.BaseEngine``
+            :param player_endpoints: The endpoints of the players in the game.
+            :type player_endpoints: list(player endpoints)
+            :param view_connection: The endpoints for the view connection.
+        """
+
+        raise NotImplementedError()
+
+    def read_from_view_connection(self, num_bytes, callback):
+        """
+            Read from the view connection.
+
+            :param num_bytes: The number of bytes to read.
+            :type num_bytes: int
+            :param callback: The callback to call with the data read.
+            :type callback: function
+        """
+
+        self._view_stream.read_bytes(num_bytes, callback)
+
+    def close_view_connection(self):
+        """
+            Close the relevant connections.
+        """
+
+        self._view_stream.close()
+
+    def send_view_states_wanted(self, wanted):
+        """
+            Tell the engine whether to send states to the view, by writing a
+            frame of type :data:`stratumgs.protocol.VIEWS` to the view
             connection.
 
-            :param state: The state that was sent from the engine.
-            :type state: A JSON encoded string of the state.
+            :param wanted: Whether the view states are wanted.
+            :type wanted: boolean
         """
 
-        obj = json.loads(state.decode().strip())
-        if obj["type"] == "close":
+        if not self._view_stream.closed():
+            self._view_stream.write(stratumgs.protocol.encode_frame(
+                stratumgs.protocol.VIEWS, self.game_id, json.dumps(wanted).encode()))
+
+    def _update_view_states_wanted(self):
+        """
+            Tell the engine whether to send states to the view, if that has
+            changed. The states are wanted while any views are watching the
+            game, or if it is being recorded for replays. A runner with a state
+            forwarder is told by the runner it forwards to, which has the views.
+        """
+
+        if self._state_forwarder is not None:
+            return
+        wanted = self._replay is not None or self._views.get_num_subscribers() > 0
+        if wanted != self._view_states_wanted:
+            self._view_states_wanted = wanted
+            self.send_view_states_wanted(wanted)
+
+    def _on_receive_state(self, frame_type, game_id, payload):
+        """
+            Callback that is called when a frame is received over the view
+            connection. Full states are kept in ``_last_state``, along with any
+            deltas received since, so that views added later can catch up.
+            Every state is also appended to the game's replay, if games are
+            being recorded. If the runner has a state forwarder, frames are
+            passed to it instead.
+
+            :param frame_type: The type of the frame.
+            :type frame_type: int
+            :param game_id: The game ID in the frame, which is unused.
+            :type game_id: int
+            :param payload: The state or delta that was sent from the engine.
+            :type payload: A JSON encoded string of the state.
+        """
+
+        if frame_type == stratumgs.protocol.TRACE:
+            self._on_receive_trace(payload)
+            stratumgs.protocol.read_frame(self.read_from_view_connection, self._on_receive_state)
+            return
+
+        now = time.monotonic()
+        if self._last_state_time is None:
+            ENGINE_START_LATENCY.observe(now - self._start_time, self.engine_name,
+                                         type(self).__name__)
+        elif frame_type != stratumgs.protocol.CLOSE:
+            TURN_LATENCY.observe(now - self._last_state_time, self.engine_name)
+        self._last_state_time = now
+
+        if self._state_forwarder is not None:
+            if frame_type == stratumgs.protocol.CLOSE and self.timeline is not None:
+                # the events recorded in this process go with the engine's
+                self._state_forwarder(stratumgs.protocol.TRACE, json.dumps(
+                    self.timeline.get_events()).encode())
+            self._state_forwarder(frame_type, payload)
+            if frame_type == stratumgs.protocol.CLOSE:
+                stratumgs.tracing.finish_game(self.game_id)
+                self.close_view_connection()
+                self.is_running = False
+            else:
+                stratumgs.protocol.read_frame(self.read_from_view_connection,
+                                              self._on_receive_state)
+            return
+        if frame_type == stratumgs.protocol.CLOSE:
+            if self._view_update_timeout is not None:
+                tornado.ioloop.IOLoop.current().remove_timeout(self._view_update_timeout)
+                self._update_views()
+            stratumgs.tracing.finish_game(self.game_id)
             self.close_view_connection()
+            if self._replay is not None:
+                self._replay.close()
             self.is_running = False
+            stratumgs.game.on_game_finished(self)
+            return
+        state = stratumgs.game.broadcast.build_view_message(frame_type, payload)
+        if frame_type == stratumgs.protocol.DELTA:
+            self._deltas_since_last_state.append(state)
+        else:
+            self._last_state = state
+            self._deltas_since_last_state = []
+        if self._replay is not None:
+            self._replay.append(frame_type, payload)
+        self._broadcast_to_views(state)
+        stratumgs.protocol.read_frame(self.read_from_view_connection, self._on_receive_state)
+
+    def _broadcast_to_views(self, message):
+        """
+            Broadcast a state or delta to the views, no more often than the
+            game's ``max_view_updates_per_second``. A message that arrives
+            before the next update is due is not sent; instead, an update is
+            scheduled, which sends the latest full state, so however many
+            states arrive in between, the views are sent only one.
+
+            :param message: The view message of the state or delta.
+            :type message: :class:`bytes`
+        """
+
+        if self._view_update_interval <= 0:
+            self._views.broadcast(message)
+            return
+        if self._views.get_num_subscribers() == 0:
+            # views added later are sent the full state when they subscribe
+            return
+        io_loop = tornado.ioloop.IOLoop.current()
+        now = io_loop.time()
+        if not self._views_behind and now >= self._next_view_update_time:
+            self._views.broadcast(message)
+            self._next_view_update_time = now + self._view_update_interval
             return
-        self._last_state = state
-        for view in self._connected_views[:]:
-            if not view.is_open:
-                self._connected_views.remove(view)
-                continue
-            view.write_message(state)
-        self.read_from_view_connection(b"\n", self._on_receive_state)
+        self._views_behind = True
+        if self._view_update_timeout is None:
+            self._view_update_timeout = io_loop.call_at(self._next_view_update_time,
+                                                        self._update_views)
+
+    def _update_views(self):
+        """
+            Send the latest full state to the views, if they were not sent the
+            states that arrived since the last update.
+        """
+
+        self._view_update_timeout = None
+        if not self._views_behind:
+            return
+        self._views_behind = False
+        self._next_view_update_time = (tornado.ioloop.IOLoop.current().time() +
+                                       self._view_update_interval)
+        if self._deltas_since_last_state:
+            self._views.broadcast(stratumgs.game.broadcast.build_view_message(
+                stratumgs.protocol.MESSAGE, json.dumps(self._get_current_state()).encode()))
+        else:
+            self._views.broadcast(self._last_state)
+
+    def _get_current_state(self):
+        """
+            Get the latest state sent by the engine, by applying the deltas
+            received since the last full state.
+
+            :returns: The state, or ``None`` if no state has been received.
+        """
+
+        if not self._last_state:
+            return None
+        state = json.loads(self._last_state.decode())["payload"]
+        for state_delta in self._deltas_since_last_state:
+            state = stratumgs.game.engine.delta.apply_patch(
+                state, json.loads(state_delta.decode())["payload"])
+        return state
+
+    def _on_receive_trace(self, payload):
+        """
+            Handle trace events sent over the view connection, either by the
+            engine when the game is over, or by the shard hosting the game. If
+            the runner has a state forwarder, the events are passed to it.
+
+            :param payload: The JSON encoded list of events.
+            :type payload: :class:`bytes`
+        """
+
+        if self._state_forwarder is not None:
+            self._state_forwarder(stratumgs.protocol.TRACE, payload)
+        elif self.timeline is not None:
+            self.timeline.add_events(json.loads(payload.decode()))
 
     def add_view(self, view):
         """
-            Add a view to the list of connected views.
+            Add a view to the list of connected views. The view is sent the
+            last full state, and the deltas since. If it is the only view, the
+            engine is told to send states to the view again, starting with a
+            full state.
 
             :param view: The view to add.
             :type view: :class:``tornado.websocket.WebSocketHandler``
         """
 
         if self._last_state:
-            view.write_message(self._last_state)
-        self._connected_views.append(view)
+            self._views.send(view, self._last_state)
+            for state_delta in self._deltas_since_last_state:
+                self._views.send(view, state_delta)
+        self._views.subscribe(view)
+        self._update_view_states_wanted()
 
+    def get_record(self):
+        """
+            Create a record of the game, with the last state sent by the engine.
 
-class PipeEngineRunner(BaseEngineRunner):
-    """
-        An implementation of an engine runner that uses pipes.
-    """
+            :returns: The record.
+            :rtype: :class:`stratumgs.game.records.GameRecord`
+        """
 
-    def init_view_connection(self):
+        return stratumgs.game.records.GameRecord(
+            self.game_id, self.engine_name, self.engine_display_name,
+            [player.name for player in self.players], self.started, time.time(),
+            self._get_current_state())
+
+    def remove_view(self, view):
         """
-            Initializes the view connection using pipes.
+            Remove a view from the list of connected views, such as when it is
+            closed. If it was the last view, the engine is told to stop sending
+            states to the view, unless the game is being recorded.
 
-            :returns: A tuple containing a ``None`` read endpoint and the write
-                      endpoint of the pipe.
+            :param view: The view to remove.
+            :type view: :class:``tornado.websocket.WebSocketHandler``
         """
 
-        read_pipe, write_pipe = os.pipe()
-        self._view_read_pipe = tornado.iostream.PipeIOStream(read_pipe)
-        return (None, write_pipe)
+        self._views.unsubscribe(view)
+        self._update_view_states_wanted()
+
+
+class PoolEngineRunner(BaseEngineRunner):
+    """
+        An implementation of an engine runner for engines that run in the
+        engine pool, which are connected over the channel of the worker that
+        runs them.
+    """
 
-    def read_from_view_connection(self, delimiter, callback):
+    def start_engine(self, engine_constructor, player_endpoints, view_connection):
         """
-            Read from the view connection.
+            Start the engine in a worker from the engine pool.
 
-            :param delimiter: The delimeter to read until.
-            :type delimiter: :class:``bytes``
-            :param callback: The callback to call when the delimiter is reached.
-            :type callbac: function
+            :param engine_constructor: The engine class to initialize.
+            :type engine_constructor: ``stratumgs.game.engine.BaseEngine``
+            :param player_endpoints: The endpoints of the players in the game.
+            :type player_endpoints: list(player endpoints)
+            :param view_connection: The endpoints for the view connection.
         """
 
-        self._view_read_pipe.read_until(delimiter, callback)
+        stratumgs.game.pool.run_engine(
+            self.game_id, engine_constructor, player_endpoints, view_connection)
 
-    def close_view_connection(self):
+
+class LocalEngineRunner(BaseEngineRunner):
+    """
+        An implementation of an engine runner for engines that extend
+        :class:`stratumgs.game.engine.AsyncBaseEngine`. The engine runs as a
+        coroutine in the server's IOLoop.
+    """
+
+    def start_engine(self, engine_constructor, player_endpoints, view_connection):
         """
-            Close the relevant connections.
+            Start the engine as a coroutine in the current IOLoop.
+
+            :param engine_constructor: The engine class to initialize.
+            :type engine_constructor: ``stratumgs.game.engine.AsyncBaseEngine``
+            :param player_endpoints: The endpoints of the players in the game.
+            :type player_endpoints: list(player endpoints)
+            :param view_connection: The endpoints for the view connection.
         """
 
-        self._view_read_pipe.close()
+        engine = engine_constructor(players=player_endpoints, view_connection=view_connection)
+        engine.start()
 
 
-class SocketEngineRunner(BaseEngineRunner):
+class ShardEngineRunner(BaseEngineRunner):
     """
-        An implementation of an engine runner that uses sockets.
+        An implementation of an engine runner for the coordinator of the client
+        server shards. The engine runs in one of the shards, which forwards the
+        states of the game to this runner.
     """
 
     def init_view_connection(self):
         """
-            Initializes the view connection using pipes.
+            Initializes the view connection using an in memory stream, which
+            the states forwarded by the shard are written to.
 
-            :returns: A tuple containing a ``None`` read endpoint and the write
-                      endpoint of the pipe.
+            :returns: ``None``, since the engine does not connect to it.
         """
 
-        self.connector_server = stratumgs.client.proxy.SingleClientServer()
-        return self.connector_server.get_port()
+        self._view_stream, self._view_feed = stratumgs.game.engine.local.make_local_stream_pair()
+        return None
 
-    def read_from_view_connection(self, delimiter, callback):
+    def start_engine(self, engine_constructor, player_endpoints, view_connection):
         """
-            Read from the view connection.
+            Start the engine in the shard that most of the players are
+            connected to.
+
+            :param engine_constructor: Unused, the shard looks up the engine
+                                       class by name.
+            :type engine_constructor: ``stratumgs.game.engine.BaseEngine``
+            :param player_endpoints: Unused, the shard creates the endpoints.
+            :type player_endpoints: list(player endpoints)
+            :param view_connection: Unused.
+        """
+
+        stratumgs.shard.get_coordinator().start_game(self.game_id, self.engine_name, self.players)
 
-            :param delimiter: The delimeter to read until.
-            :type delimiter: :class:``bytes``
-            :param callback: The callback to call when the delimiter is reached.
-            :type callbac: function
+    def feed_state(self, frame_type, payload):
         """
+            Feed a frame forwarded by the shard running the engine.
 
-        tornado.ioloop.IOLoop.current().add_future(
-            self.connector_server.get_stream(),
-            lambda s: s.result().read_until(delimiter, callback))
+            :param frame_type: The type of the frame.
+            :type frame_type: int
+            :param payload: The payload of the frame.
+            :type payload: :class:`bytes`
+        """
+
+        if not self._view_feed.closed():
+            self._view_feed.write(
+                stratumgs.protocol.encode_frame(frame_type, self.game_id, payload))
+
+    def send_view_states_wanted(self, wanted):
+        """
+            Tell the engine whether to send states to the view, through the
+            shard running it.
+
+            :param wanted: Whether the view states are wanted.
+            :type wanted: boolean
+        """
+
+        stratumgs.shard.get_coordinator().send_view_states_wanted(self.game_id, wanted)
 
     def close_view_connection(self):
         """
             Close the relevant connections.
         """
 
-        tornado.ioloop.IOLoop.current().add_future(
-            self.connector_server.get_stream(),
-            lambda s: s.result().close())
+        self._view_stream.close()
+        self._view_feed.close()
+
+
+class RemoteEngineRunner(BaseEngineRunner):
+    """
+        An implementation of an engine runner for engines that run on a remote
+        engine worker, which are connected over the worker's channel.
+    """
+
+    def start_engine(self, engine_constructor, player_endpoints, view_connection):
+        """
+            Start the engine on the least loaded remote worker.
+
+            :param engine_constructor: Unused, the worker looks up the engine
+                                       class by name.
+            :type engine_constructor: ``stratumgs.game.engine.BaseEngine``
+            :param player_endpoints: The endpoints of the players in the game.
+            :type player_endpoints: list(player endpoints)
+            :param view_connection: The endpoints for the view connection.
+        """
+
+        worker = stratumgs.game.remote.get_available_worker(self.engine_name)
+        worker.run_engine(self.game_id, self.engine_name, player_endpoints, view_connection)
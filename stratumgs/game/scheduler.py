@@ -0,0 +1,521 @@
+"""
+.. module stratumgs.game.scheduler
+
+Runs tournaments, which automatically pair the connected clients into games.
+Whenever a client has a free game slot, the scheduler starts a new game for it
+with the best available opponent, according to the tournament's pairing
+strategy, so that every client's slots stay busy.
+
+Results are read from the final state of each game: the ``winner`` key names
+the winning player, using the engine's ``player_names`` configuration, and any
+other value is a draw.
+"""
+
+import collections
+import itertools
+
+import tornado.ioloop
+
+import stratumgs.client.server
+import stratumgs.game
+
+
+_TOURNAMENTS = []
+_SCHEDULING_REQUESTED = False
+
+
+def start_tournament(engine_name, pairing, max_games=0):
+    """
+        Start a new tournament, which immediately begins scheduling games.
+
+        :param engine_name: The name of the engine the tournament plays.
+        :type engine_name: string
+        :param pairing: The name of the pairing strategy, one of the keys of
+                        :data:`PAIRINGS`.
+        :type pairing: string
+        :param max_games: The number of games to play, or zero to play until
+                          the tournament is stopped.
+        :type max_games: int
+        :returns: The new tournament.
+        :rtype: :class:`Tournament`
+    """
+
+    if pairing not in PAIRINGS:
+        raise ValueError("Unknown pairing strategy {}".format(pairing))
+    if stratumgs.game.get_game_configuration(engine_name)["num_players"] != 2:
+        raise ValueError("Tournaments can only be played with two player games")
+    tournament = PAIRINGS[pairing](len(_TOURNAMENTS), engine_name, max_games)
+    _TOURNAMENTS.append(tournament)
+    request_scheduling()
+    return tournament
+
+
+def get_tournaments():
+    """
+        Get a list of all tournaments.
+
+        :returns: A list of :class:`Tournament`, in the order they were started.
+    """
+
+    return list(_TOURNAMENTS)
+
+
+def get_tournament(tournament_id):
+    """
+        Get a tournament by ID.
+
+        :param tournament_id: The ID of the tournament.
+        :type tournament_id: int
+        :returns: The tournament.
+        :rtype: :class:`Tournament`
+    """
+
+    return _TOURNAMENTS[tournament_id]
+
+
+def request_scheduling():
+    """
+        Request that new games are scheduled, such as when a client connects or
+        a game slot is freed. Requests made in the same iteration of the IOLoop
+        are coalesced into a single pass over the tournaments.
+    """
+
+    global _SCHEDULING_REQUESTED
+    if _TOURNAMENTS and not _SCHEDULING_REQUESTED:
+        _SCHEDULING_REQUESTED = True
+        tornado.ioloop.IOLoop.current().add_callback(_schedule_games)
+
+
+def _schedule_games():
+    """
+        Schedule games for every running tournament, until no more pairs of
+        clients are available.
+    """
+
+    global _SCHEDULING_REQUESTED
+    _SCHEDULING_REQUESTED = False
+    for tournament in _TOURNAMENTS:
+        if tournament.is_running:
+            tournament.schedule_games()
+
+
+def on_game_finished(record):
+    """
+        Called when a game is over, to update the standings of the tournament
+        it belongs to.
+
+        :param record: The record of the game.
+        :type record: :class:`stratumgs.game.records.GameRecord`
+    """
+
+    for tournament in _TOURNAMENTS:
+        if record.game_id in tournament.games:
+            tournament.on_game_finished(record)
+            break
+    request_scheduling()
+
+
+class Standing(object):
+    """
+        A player's results in a tournament.
+
+        :param name: The name of the player.
+        :type name: string
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.wins = 0
+        self.draws = 0
+        self.losses = 0
+
+    def get_num_games(self):
+        """
+            Get the number of finished games the player has played.
+
+            :returns: The number of games.
+        """
+
+        return self.wins + self.draws + self.losses
+
+    def get_points(self):
+        """
+            Get the player's points, with one point for a win and half a point
+            for a draw.
+
+            :returns: The number of points.
+        """
+
+        return self.wins + self.draws / 2
+
+
+class Tournament(object):
+    """
+        The base class of tournaments. Each pairing strategy extends this class,
+        implements :meth:`get_pairing_cost`, and can order the players with
+        :meth:`get_pairing_order`.
+
+        :param tournament_id: The ID of the tournament.
+        :type tournament_id: int
+        :param engine_name: The name of the engine the tournament plays.
+        :type engine_name: string
+        :param max_games: The number of games to play, or zero to play until
+                          the tournament is stopped.
+        :type max_games: int
+    """
+
+    pairing_name = None
+
+    # The number of following players in pairing order that each player can
+    # be paired with, or None for all of them
+    pairing_window = None
+
+    # Whether passes alternate between the start and the end of the pairing
+    # order, so that with an odd number of players, a different player is left
+    # over each time
+    alternate_passes = True
+
+    def __init__(self, tournament_id, engine_name, max_games):
+        self.tournament_id = tournament_id
+        engine_config = stratumgs.game.get_game_configuration(engine_name)
+        self.engine_name = engine_name
+        self.engine_display_name = engine_config["display_name"]
+        self.player_names = engine_config["player_names"]
+        self.max_games = max_games
+        self.is_running = True
+        self.games = {}
+        self.num_finished_games = 0
+        self.standings = {}
+        self._meetings = collections.Counter()
+        self._first_players = {}
+        self._reverse_pairing = False
+
+    def get_standing(self, name):
+        """
+            Get the standing of a player, adding the player to the tournament if
+            they have not played in it yet.
+
+            :param name: The name of the player.
+            :type name: string
+            :returns: The player's standing.
+            :rtype: :class:`Standing`
+        """
+
+        if name not in self.standings:
+            self.standings[name] = Standing(name)
+            self.on_player_added(name)
+        return self.standings[name]
+
+    def get_ranked_standings(self):
+        """
+            Get the standings of every player, best first.
+
+            :returns: A list of :class:`Standing`.
+        """
+
+        return sorted(self.standings.values(),
+                      key=lambda s: (-s.get_points(), s.get_num_games(), s.name))
+
+    def get_num_meetings(self, first, second):
+        """
+            Get the number of games that have been started between two players.
+
+            :param first: The name of the first player.
+            :type first: string
+            :param second: The name of the second player.
+            :type second: string
+            :returns: The number of games.
+        """
+
+        return self._meetings[frozenset((first, second))]
+
+    def stop(self):
+        """
+            Stop scheduling new games. Games that are being played are allowed
+            to finish.
+        """
+
+        self.is_running = False
+
+    def schedule_games(self):
+        """
+            Start games between available clients, until fewer than two clients
+            are available or the tournament has started all of its games. Each
+            pass over the available clients orders them once, with
+            :meth:`get_pairing_order`, and pairs them greedily: each unpaired
+            client in turn plays the one of the next ``pairing_window`` unpaired
+            clients with the lowest pairing cost, or of all of them if the
+            window is ``None``. Passes alternate between the start and the end
+            of the order, unless ``alternate_passes`` is false, and clients
+            with more free game slots are paired again in the next pass.
+        """
+
+        while self.max_games == 0 or len(self.games) < self.max_games:
+            names = stratumgs.client.server.get_available_client_names_for_game(
+                self.engine_name)
+            if len(names) < 2:
+                return
+            for name in names:
+                self.get_standing(name)
+            order = self.get_pairing_order(names)
+            # alternate the direction of the passes, so that with an odd number
+            # of clients, a different client is left over each time
+            if self.alternate_passes:
+                if self._reverse_pairing:
+                    order = order[::-1]
+                self._reverse_pairing = not self._reverse_pairing
+            for first, second in self._pair_players(order):
+                if self.max_games != 0 and len(self.games) >= self.max_games:
+                    break
+                self._start_game(first, second)
+        self.stop()
+
+    def _pair_players(self, names):
+        """
+            Pair up players greedily, in order. Each unpaired player is paired
+            with the one of the next ``pairing_window`` unpaired players with
+            the lowest pairing cost.
+
+            :param names: The names of the players, in pairing order.
+            :type names: list(string)
+            :returns: A list of pairs of names.
+        """
+
+        pairs = []
+        paired = set()
+        for index, first in enumerate(names):
+            if first in paired:
+                continue
+            candidates = []
+            for second in itertools.islice(names, index + 1, None):
+                if second not in paired:
+                    candidates.append(second)
+                    if len(candidates) == self.pairing_window:
+                        break
+            if not candidates:
+                break
+            second = min(candidates, key=lambda name: self.get_pairing_cost(first, name))
+            paired.add(first)
+            paired.add(second)
+            pairs.append((first, second))
+        return pairs
+
+    def _start_game(self, first, second):
+        """
+            Start a game between two players, alternating which of them moves
+            first each time they meet.
+
+            :param first: The name of the first player.
+            :type first: string
+            :param second: The name of the second player.
+            :type second: string
+        """
+
+        pair = frozenset((first, second))
+        if self._first_players.get(pair) == first:
+            first, second = second, first
+        self._meetings[pair] += 1
+        self._first_players[pair] = first
+        game_id = stratumgs.game.init_game_engine(self.engine_name, [first, second])
+        self.games[game_id] = (first, second)
+
+    def on_game_finished(self, record):
+        """
+            Update the standings with the result of a game.
+
+            :param record: The record of the game.
+            :type record: :class:`stratumgs.game.records.GameRecord`
+        """
+
+        self.num_finished_games += 1
+        names = self.games[record.game_id]
+        winner = None
+        if isinstance(record.final_state, dict):
+            winner = record.final_state.get("winner")
+        if winner in self.player_names[:2]:
+            winner_index = self.player_names.index(winner)
+            self.get_standing(names[winner_index]).wins += 1
+            self.get_standing(names[1 - winner_index]).losses += 1
+            self.on_result(names[winner_index], names[1 - winner_index])
+        else:
+            for name in names:
+                self.get_standing(name).draws += 1
+
+    def on_player_added(self, name):
+        """
+            Called when a player joins the tournament.
+
+            :param name: The name of the player.
+            :type name: string
+        """
+
+        pass
+
+    def on_result(self, winner, loser):
+        """
+            Called when a game is won.
+
+            :param winner: The name of the winner.
+            :type winner: string
+            :param loser: The name of the loser.
+            :type loser: string
+        """
+
+        pass
+
+    def get_pairing_order(self, names):
+        """
+            Order the available players for pairing. Players are paired with
+            the players near them in this order, so strategies that pair
+            similar players sort them here.
+
+            :param names: The names of the available players.
+            :type names: list(string)
+            :returns: The names, in pairing order.
+        """
+
+        return names
+
+    def get_pairing_cost(self, first, second):
+        """
+            Get the cost of pairing two players. Each player is paired with the
+            candidate with the lowest cost.
+
+            :param first: The name of the first player.
+            :type first: string
+            :param second: The name of the second player.
+            :type second: string
+            :returns: The cost, which can be any comparable value.
+        """
+
+        raise NotImplementedError()
+
+
+class RoundRobinTournament(Tournament):
+    """
+        Every player plays every other player in turn. Each player plays the
+        available opponent that they have met the fewest times, preferring the
+        one they meet in the earliest round of a schedule made with the circle
+        method. Each pass plays the earliest round that has pairs left to
+        play, and the players without an opponent in that round, such as the
+        player with a bye, are paired last.
+    """
+
+    pairing_name = "Round Robin"
+
+    # the players with a bye are already rotated by the schedule
+    alternate_passes = False
+
+    def __init__(self, tournament_id, engine_name, max_games):
+        super().__init__(tournament_id, engine_name, max_games)
+        self._roster = {}
+
+    def on_player_added(self, name):
+        self._roster[name] = len(self._roster)
+
+    def get_round(self, first, second):
+        """
+            Get the round in which two players meet in a schedule made with the
+            circle method, in which players are numbered in the order they
+            joined, and the last player, or a bye if the number of players is
+            odd, stays in place while the others rotate. A schedule has one
+            round fewer than its number of places, and players ``i`` and ``j``
+            meet in round ``(i + j) mod (places - 1)``, or ``2i mod (places -
+            1)`` if ``j`` is the place that stays.
+
+            :param first: The name of the first player.
+            :type first: string
+            :param second: The name of the second player.
+            :type second: string
+            :returns: The round.
+            :rtype: int
+        """
+
+        num_rounds = len(self._roster) + len(self._roster) % 2 - 1
+        first_index = self._roster[first]
+        second_index = self._roster[second]
+        if second_index == num_rounds:
+            return 2 * first_index % num_rounds
+        if first_index == num_rounds:
+            return 2 * second_index % num_rounds
+        return (first_index + second_index) % num_rounds
+
+    def get_pairing_order(self, names):
+        names = sorted(names, key=self._roster.__getitem__)
+        unplayed_pairs = [(self.get_round(first, second), first, second)
+                          for first, second in itertools.combinations(names, 2)
+                          if self.get_num_meetings(first, second) == 0]
+        if not unplayed_pairs:
+            return names
+        current_round = min(unplayed_pairs)[0]
+        in_round = {name for round_, first, second in unplayed_pairs
+                    if round_ == current_round for name in (first, second)}
+        return sorted(names, key=lambda name: name not in in_round)
+
+    def get_pairing_cost(self, first, second):
+        return self.get_num_meetings(first, second), self.get_round(first, second)
+
+
+class SwissTournament(Tournament):
+    """
+        Players are ranked by points, and paired with the opponent among the
+        next few with the closest number of points that they have met the
+        fewest times.
+    """
+
+    pairing_name = "Swiss"
+    pairing_window = 4
+
+    def get_pairing_order(self, names):
+        return sorted(names, key=lambda name: (-self.standings[name].get_points(), name))
+
+    def get_pairing_cost(self, first, second):
+        points_difference = abs(self.standings[first].get_points() -
+                                self.standings[second].get_points())
+        return self.get_num_meetings(first, second), points_difference
+
+
+class LadderTournament(Tournament):
+    """
+        Players are ranked on a ladder, and play the closest players to them on
+        it. When a player beats a player above them, they take that player's
+        place, and everyone between moves down one rung.
+    """
+
+    pairing_name = "Ladder"
+    pairing_window = 2
+
+    def __init__(self, tournament_id, engine_name, max_games):
+        super().__init__(tournament_id, engine_name, max_games)
+        self.ladder = []
+        self._rungs = {}
+
+    def on_player_added(self, name):
+        self._rungs[name] = len(self.ladder)
+        self.ladder.append(name)
+
+    def on_result(self, winner, loser):
+        winner_rung = self._rungs[winner]
+        loser_rung = self._rungs[loser]
+        if winner_rung > loser_rung:
+            self.ladder.insert(loser_rung, self.ladder.pop(winner_rung))
+            for rung in range(loser_rung, winner_rung + 1):
+                self._rungs[self.ladder[rung]] = rung
+
+    def get_ranked_standings(self):
+        return [self.standings[name] for name in self.ladder]
+
+    def get_pairing_order(self, names):
+        return sorted(names, key=self._rungs.__getitem__)
+
+    def get_pairing_cost(self, first, second):
+        distance = abs(self._rungs[first] - self._rungs[second])
+        return distance, self.get_num_meetings(first, second)
+
+
+# The available pairing strategies, by name
+PAIRINGS = collections.OrderedDict([
+    ("round-robin", RoundRobinTournament),
+    ("swiss", SwissTournament),
+    ("ladder", LadderTournament)
+])
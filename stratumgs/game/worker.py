@@ -0,0 +1,155 @@
+"""
+.. module stratumgs.game.worker
+
+The remote engine worker daemon, started with ``stratumgs-worker``. It connects
+to a server's engine worker port, registers the engines it can run, and runs
+the games the server assigns to it. Engines that run in process are run as
+coroutines in the daemon, and the rest are run in the daemon's own engine pool.
+See :mod:`stratumgs.game.remote` for the server side.
+
+If the connection to the server is lost, the daemon's games end, and it
+reconnects.
+"""
+
+import argparse
+import socket
+
+import tornado.concurrent
+import tornado.gen
+import tornado.ioloop
+import tornado.iostream
+import tornado.tcpclient
+
+import stratumgs.config
+import stratumgs.game
+import stratumgs.game.channel
+import stratumgs.game.pool
+import stratumgs.tracing
+
+
+class EngineWorkerDaemon(object):
+    """
+        Connects to a server, and runs the games it assigns.
+
+        :param host: The server's host.
+        :type host: str
+        :param port: The server's engine worker port.
+        :type port: int
+        :param name: The name of the worker.
+        :type name: str
+        :param capacity: The number of games the worker runs at once.
+        :type capacity: int
+        :param reconnect_interval: The number of seconds to wait before
+                                   reconnecting to the server.
+        :type reconnect_interval: float
+        :param secret: The secret to register with.
+        :type secret: str
+    """
+
+    def __init__(self, host, port, name, capacity, reconnect_interval, secret=""):
+        self.host = host
+        self.port = port
+        self.name = name
+        self.capacity = capacity
+        self.reconnect_interval = reconnect_interval
+        self.secret = secret
+        self._channel = None
+
+    @tornado.gen.coroutine
+    def run(self):
+        """
+            Connect to the server, and reconnect whenever the connection is
+            lost.
+
+            :returns: A :class:`tornado.concurrent.Future` that never resolves.
+        """
+
+        while True:
+            try:
+                stream = yield tornado.tcpclient.TCPClient().connect(self.host, self.port)
+            except (OSError, tornado.iostream.StreamClosedError) as e:
+                print("Could not connect to {}:{}: {}".format(self.host, self.port, e))
+                yield tornado.gen.sleep(self.reconnect_interval)
+                continue
+            stream.set_nodelay(True)
+
+            closed = tornado.concurrent.Future()
+            self._channel = stratumgs.game.channel.Channel(
+                stream, self._on_control, lambda: closed.set_result(None))
+            self._channel.send_control(0, {
+                "type": "register",
+                "name": self.name,
+                "capacity": self.capacity,
+                "secret": self.secret,
+                "engines": [engine_name for engine_name, _ in
+                            stratumgs.game.get_available_game_engines()]
+            })
+            print("Connected to {}:{}.".format(self.host, self.port))
+            yield closed
+            print("Disconnected from {}:{}.".format(self.host, self.port))
+            yield tornado.gen.sleep(self.reconnect_interval)
+
+    def _on_control(self, game_id, message):
+        """
+            Handle a control message from the server.
+
+            :param game_id: The ID of the game the message is about.
+            :type game_id: int
+            :param message: The message.
+            :type message: dict
+        """
+
+        if message["type"] == "start":
+            self._start_game(game_id, message["engine"], message["players"])
+
+    def _start_game(self, game_id, engine_name, players):
+        """
+            Start a game assigned by the server.
+
+            :param game_id: The ID of the game.
+            :type game_id: int
+            :param engine_name: The name of the game's engine.
+            :type engine_name: string
+            :param players: The client options of each player.
+            :type players: list(dict)
+        """
+
+        engine_constructor = stratumgs.game.get_engine_class(engine_name)
+        player_endpoints = [
+            (self._channel.open_stream(game_id, player_id),
+             player["codec"], player["accepts_deltas"])
+            for player_id, player in enumerate(players)]
+        view_connection = self._channel.open_stream(game_id, stratumgs.game.channel.VIEW_STREAM)
+
+        if stratumgs.game.get_game_configuration(engine_name).get("in_process", False):
+            engine = engine_constructor(players=player_endpoints, view_connection=view_connection)
+            engine.start()
+        else:
+            stratumgs.game.pool.run_engine(
+                game_id, engine_constructor, player_endpoints, view_connection)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run games for a StratumGS server.")
+    parser.add_argument("--host", default=stratumgs.config.get("engine_worker", "server_host"),
+                        help="the server to connect to")
+    parser.add_argument("--port", type=int,
+                        default=stratumgs.config.get("engine_worker", "server_port"),
+                        help="the server's engine worker port")
+    parser.add_argument("--name", default=stratumgs.config.get("engine_worker", "name"),
+                        help="the name of the worker")
+    parser.add_argument("--capacity", type=int,
+                        default=stratumgs.config.get("engine_worker", "capacity"),
+                        help="the number of games to run at once")
+    args = parser.parse_args()
+
+    pool_size = stratumgs.config.get("engine_pool", "size")
+    pool_max_games = stratumgs.config.get("engine_pool", "max_games_per_worker")
+    reconnect_interval = stratumgs.config.get("engine_worker", "reconnect_interval")
+    stratumgs.tracing.init(stratumgs.config.get("tracing", "enabled"),
+                           stratumgs.config.get("tracing", "max_events_per_game"))
+    stratumgs.game.pool.init(pool_size, pool_max_games)
+    daemon = EngineWorkerDaemon(args.host, args.port, args.name or socket.gethostname(),
+                                args.capacity, reconnect_interval,
+                                stratumgs.config.get("engine_worker", "secret"))
+    tornado.ioloop.IOLoop.current().run_sync(daemon.run)
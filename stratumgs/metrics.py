@@ -0,0 +1,304 @@
+"""
+.. module stratumgs.metrics
+
+Performance metrics for the server, rendered in the Prometheus text exposition
+format by the ``/metrics`` handler of :mod:`stratumgs.web`.
+
+Latencies are recorded in :class:`Histogram` metrics, which are defined by the
+modules that observe them. Traffic is counted by the objects it passes through,
+such as the :class:`TrafficStats` of each client proxy, and is read by collector
+functions when the metrics are rendered, so counts for clients and games that
+are gone do not linger. Rates, such as messages per second, are derived from the
+totals by the monitoring system.
+
+With the client server split across shards, only the metrics of the main
+process are rendered.
+"""
+
+import bisect
+import time
+
+import tornado.ioloop
+
+
+# The upper bounds, in seconds, of the default histogram buckets
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                   2.5, 5.0, 10.0)
+
+_METRICS = []
+_COLLECTORS = []
+_ENABLED = True
+
+
+def init(enabled):
+    """
+        Initialize the metrics.
+
+        :param enabled: Whether the metrics are exposed.
+        :type enabled: boolean
+    """
+
+    global _ENABLED
+    _ENABLED = enabled
+
+
+def is_enabled():
+    """
+        Determine whether the metrics are exposed.
+
+        :returns: Whether the metrics are exposed.
+    """
+
+    return _ENABLED
+
+
+def add_collector(collector):
+    """
+        Add a function that is called when the metrics are rendered. It returns
+        a list of metrics, each a tuple of the name, the type, the help text,
+        and a list of samples, as taken by :func:`format_metric`.
+
+        :param collector: The collector.
+        :type collector: function
+    """
+
+    _COLLECTORS.append(collector)
+
+
+def format_metric(name, metric_type, documentation, samples):
+    """
+        Format a metric in the Prometheus text format.
+
+        :param name: The name of the metric.
+        :type name: string
+        :param metric_type: The type of the metric, such as ``counter``.
+        :type metric_type: string
+        :param documentation: The help text of the metric.
+        :type documentation: string
+        :param samples: The samples of the metric, each a tuple of the suffix
+                        added to the name, a list of label names and values,
+                        and the value.
+        :type samples: list(tuple(string, list(tuple), float))
+        :returns: The formatted lines.
+        :rtype: list(string)
+    """
+
+    lines = ["# HELP {} {}".format(name, documentation),
+             "# TYPE {} {}".format(name, metric_type)]
+    for suffix, labels, value in samples:
+        if labels:
+            lines.append("{}{}{{{}}} {}".format(name, suffix, ",".join(
+                '{}="{}"'.format(label, _escape_label_value(label_value))
+                for label, label_value in labels), _format_value(value)))
+        else:
+            lines.append("{}{} {}".format(name, suffix, _format_value(value)))
+    return lines
+
+
+def render():
+    """
+        Render every metric in the Prometheus text format.
+
+        :returns: The rendered metrics.
+        :rtype: string
+    """
+
+    lines = []
+    for metric in _METRICS:
+        lines.extend(metric.format())
+    for collector in _COLLECTORS:
+        for name, metric_type, documentation, samples in collector():
+            lines.extend(format_metric(name, metric_type, documentation, samples))
+    return "\n".join(lines) + "\n"
+
+
+def monitor_ioloop_lag(interval):
+    """
+        Measure how late the IOLoop runs a callback scheduled every interval,
+        recording the lag in :data:`IOLOOP_LAG`.
+
+        :param interval: The number of seconds between measurements.
+        :type interval: float
+    """
+
+    io_loop = tornado.ioloop.IOLoop.current()
+
+    def measure(deadline):
+        IOLOOP_LAG.observe(max(0.0, io_loop.time() - deadline))
+        schedule()
+
+    def schedule():
+        deadline = io_loop.time() + interval
+        io_loop.call_at(deadline, measure, deadline)
+
+    schedule()
+
+
+def _escape_label_value(value):
+    """
+        Escape a label value for the Prometheus text format.
+
+        :param value: The label value.
+        :returns: The escaped value.
+        :rtype: string
+    """
+
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_value(value):
+    """
+        Format a sample value for the Prometheus text format.
+
+        :param value: The value.
+        :type value: float
+        :returns: The formatted value.
+        :rtype: string
+    """
+
+    if value == float("inf"):
+        return "+Inf"
+    return repr(value)
+
+
+class Histogram(object):
+    """
+        Counts observed values, such as latencies, in cumulative buckets, and
+        keeps their count and sum, for each combination of label values.
+
+        :param name: The name of the metric.
+        :type name: string
+        :param documentation: The help text of the metric.
+        :type documentation: string
+        :param label_names: The names of the labels.
+        :type label_names: tuple(string)
+        :param buckets: The upper bounds of the buckets, in increasing order.
+        :type buckets: tuple(float)
+    """
+
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+        _METRICS.append(self)
+
+    def observe(self, value, *label_values):
+        """
+            Observe a value.
+
+            :param value: The value.
+            :type value: float
+            :param label_values: The values of the labels, in order.
+        """
+
+        series = self._series.get(label_values)
+        if series is None:
+            # the bucket counts, followed by the count and the sum
+            series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def time(self, *label_values):
+        """
+            Get a context manager that observes the time spent inside it.
+
+            :param label_values: The values of the labels, in order.
+            :returns: The context manager.
+        """
+
+        return _Timer(self, label_values)
+
+    def format(self):
+        """
+            Format the histogram in the Prometheus text format.
+
+            :returns: The formatted lines.
+            :rtype: list(string)
+        """
+
+        samples = []
+        for label_values, series in sorted(self._series.items()):
+            labels = list(zip(self.label_names, label_values))
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                samples.append(("_bucket", labels + [("le", bound)], cumulative))
+            count = cumulative + series[len(self.buckets)]
+            samples.append(("_bucket", labels + [("le", "+Inf")], count))
+            samples.append(("_count", labels, count))
+            samples.append(("_sum", labels, series[-1]))
+        return format_metric(self.name, "histogram", self.documentation, samples)
+
+
+class _Timer(object):
+    """
+        A context manager that observes the time spent inside it in a
+        histogram.
+    """
+
+    def __init__(self, histogram, label_values):
+        self._histogram = histogram
+        self._label_values = label_values
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.monotonic()
+
+    def __exit__(self, *exc_info):
+        self._histogram.observe(time.monotonic() - self._start, *self._label_values)
+
+
+class TrafficStats(object):
+    """
+        Counts the messages and bytes that pass through a connection, in each
+        direction.
+    """
+
+    def __init__(self):
+        self.messages_in = 0
+        self.bytes_in = 0
+        self.messages_out = 0
+        self.bytes_out = 0
+
+    def record_in(self, num_bytes):
+        """
+            Record a message received.
+
+            :param num_bytes: The size of the message.
+            :type num_bytes: int
+        """
+
+        self.messages_in += 1
+        self.bytes_in += num_bytes
+
+    def record_out(self, num_bytes):
+        """
+            Record a message sent.
+
+            :param num_bytes: The size of the message.
+            :type num_bytes: int
+        """
+
+        self.messages_out += 1
+        self.bytes_out += num_bytes
+
+    def add(self, other):
+        """
+            Add the counts of other traffic stats to these.
+
+            :param other: The other stats.
+            :type other: :class:`TrafficStats`
+        """
+
+        self.messages_in += other.messages_in
+        self.bytes_in += other.bytes_in
+        self.messages_out += other.messages_out
+        self.bytes_out += other.bytes_out
+
+
+# The lag of the IOLoop, measured by monitor_ioloop_lag
+IOLOOP_LAG = Histogram(
+    "stratumgs_ioloop_lag_seconds",
+    "How late the IOLoop runs callbacks scheduled for a given time.")
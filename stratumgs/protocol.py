@@ -0,0 +1,129 @@
+"""
+.. module stratumgs.protocol
+
+Helpers for the length-prefixed framing used on the connections between the
+server and the game engines, and by clients that request it when connecting.
+
+Each frame starts with a fixed size header, holding the message type, the game
+ID, and the length of the payload that follows. Since the header can be read
+without looking at the payload, messages can be routed to the right game
+without decoding or re-encoding them.
+"""
+
+import struct
+
+
+# The header of each frame: message type, game id, and payload length
+HEADER = struct.Struct("!BII")
+
+MESSAGE = 1
+CLOSE = 2
+START = 3
+DELTA = 4
+# The trace events of an engine, sent over the view stream when tracing is
+# enabled, and never to clients
+TRACE = 5
+# Whether the runner wants the engine to send states to the view, sent to the
+# engine over the view stream, and never to clients
+VIEWS = 6
+
+# The message type names used in JSON messages, by frame type
+TYPE_NAMES = {
+    MESSAGE: "message",
+    CLOSE: "close",
+    START: "start",
+    DELTA: "delta",
+    TRACE: "trace",
+    VIEWS: "views"
+}
+
+# The frame types, by message type name
+TYPES = {name: frame_type for frame_type, name in TYPE_NAMES.items()}
+
+# The framing that clients can request in the connect message
+JSON_LINES_FRAMING = "json-lines"
+LENGTH_PREFIXED_FRAMING = "length-prefixed"
+
+# The versions of the JSON lines protocol that the server supports. In version
+# 1, message payloads are embedded as JSON-encoded strings. In version 2, they
+# are embedded as JSON objects, so they are only encoded once.
+PROTOCOL_VERSIONS = (1, 2)
+
+
+def encode_frame(frame_type, game_id, payload=b""):
+    """
+        Encode a frame.
+
+        :param frame_type: The type of the message.
+        :type frame_type: int
+        :param game_id: The ID of the game the message is for.
+        :type game_id: int
+        :param payload: The payload of the message.
+        :type payload: :class:`bytes`
+        :returns: The encoded frame.
+    """
+
+    return HEADER.pack(frame_type, game_id, len(payload)) + payload
+
+
+def read_frame(read_bytes, callback):
+    """
+        Read a frame from an asynchronous stream.
+
+        :param read_bytes: A function that reads a number of bytes from the
+                           stream, and passes them to a callback, such as
+                           :meth:`tornado.iostream.IOStream.read_bytes`.
+        :type read_bytes: function
+        :param callback: The callback to call with the frame type, game ID,
+                         and payload of the frame.
+        :type callback: function
+    """
+
+    def on_header(header):
+        frame_type, game_id, length = HEADER.unpack(header)
+        if length == 0:
+            callback(frame_type, game_id, b"")
+        else:
+            read_bytes(length, lambda payload: callback(frame_type, game_id, payload))
+
+    read_bytes(HEADER.size, on_header)
+
+
+def read_frame_from_file(f):
+    """
+        Read a frame from a blocking file object. If the end of the file is
+        reached, a close frame is returned.
+
+        :param f: The file to read from.
+        :returns: A tuple of the frame type, game ID, and payload.
+    """
+
+    header = _read_exactly(f, HEADER.size)
+    if header is None:
+        return CLOSE, 0, b""
+    frame_type, game_id, length = HEADER.unpack(header)
+    payload = _read_exactly(f, length) if length else b""
+    if payload is None:
+        return CLOSE, 0, b""
+    return frame_type, game_id, payload
+
+
+def _read_exactly(f, num_bytes):
+    """
+        Read an exact number of bytes from a blocking file object, which may
+        return fewer bytes than requested from a single read.
+
+        :param f: The file to read from.
+        :param num_bytes: The number of bytes to read.
+        :type num_bytes: int
+        :returns: The bytes read, or ``None`` if the end of the file is reached
+                  first.
+    """
+
+    data = b""
+    while len(data) < num_bytes:
+        chunk = f.read(num_bytes - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
@@ -0,0 +1,317 @@
+"""
+.. module stratumgs.selfplay
+
+A self play harness that measures the rules code of a game engine on its own,
+without the client server, the engine runners, or any streams. Each player of
+the engine is connected to a :class:`stratumgs.game.engine.local.QueueEndpoint`,
+behind which a :class:`RandomPlayer` answers every read immediately with a
+random move, and games are played back to back in this process. Engines that
+extend :class:`stratumgs.game.engine.AsyncBaseEngine` are given resolved
+futures, so their coroutines run to completion without the IOLoop.
+
+The time spent in ``play_turn``, ``is_game_over``, ``is_game_over_after`` and
+``get_state`` is measured for every call. The time the players spend choosing
+their moves is measured separately, and left out of the time of ``play_turn``,
+while the time spent encoding states, and decoding them for the players, is
+only counted in the total.
+
+Players choose their moves with the policy registered for the engine in
+:data:`POLICIES`. A policy is a function of the player's last state, the last
+message the engine sent it, its player ID, and a :class:`random.Random`, which
+returns the player's move.
+"""
+
+import argparse
+import cProfile
+import collections
+import json
+import pstats
+import random
+import time
+
+import tornado.concurrent
+import tornado.ioloop
+
+import stratumgs.codec
+import stratumgs.game
+import stratumgs.game.engine
+
+from stratumgs.game.engine.local import QueueEndpoint
+
+
+# The engine methods that are timed
+TIMED_METHODS = ("play_turn", "is_game_over", "is_game_over_after", "get_state")
+
+# The number of functions listed when profiling
+_PROFILE_LIMIT = 25
+
+
+def random_board_move(state, message, player_id, rng):
+    """
+        Choose a random empty space on a board given as a list of rows, as in
+        TicTacToe and the other m,n,k-games. After a
+        ``repeat-turn`` message, which a valid move never causes, the first
+        empty space is chosen.
+
+        :param state: The last state sent to the player.
+        :type state: dict
+        :param message: The last message sent to the player.
+        :type message: dict
+        :param player_id: The ID of the player.
+        :type player_id: int
+        :param rng: The random number generator.
+        :type rng: :class:`random.Random`
+        :returns: The move.
+        :rtype: dict
+    """
+
+    empty = [(row, col) for row, cells in enumerate(state["board"])
+             for col, cell in enumerate(cells) if cell is None]
+    repeat = message is not None and message.get("type") == "repeat-turn"
+    row, col = empty[0] if repeat else rng.choice(empty)
+    return {"row": row, "column": col}
+
+
+# The policy of the random players of each engine
+POLICIES = {
+    "gomoku": random_board_move,
+    "tictactoe": random_board_move
+}
+
+
+def run_selfplay(engine_name, num_games, seed=None, watched=True):
+    """
+        Play games of an engine between random players, and measure the time
+        spent in the engine's methods.
+
+        :param engine_name: The name of the engine, which needs a policy in
+                            :data:`POLICIES`.
+        :type engine_name: string
+        :param num_games: The number of games to play.
+        :type num_games: int
+        :param seed: The seed of the random number generator, or ``None`` for
+                     a random seed.
+        :type seed: int
+        :param watched: Whether the games are played as if views were watching
+                        them. If not, the engine is told at the start of each
+                        game that view states are not wanted.
+        :type watched: boolean
+        :returns: The results of the run, including the time spent in each of
+                  :data:`TIMED_METHODS`.
+        :rtype: dict
+    """
+
+    if engine_name not in POLICIES:
+        raise ValueError("No self play policy for engine {}".format(engine_name))
+    engine_class = stratumgs.game.get_engine_class(engine_name)
+    num_players = stratumgs.game.get_game_configuration(engine_name)["num_players"]
+    asynchronous = issubclass(engine_class, stratumgs.game.engine.AsyncBaseEngine)
+    rng = random.Random(seed)
+    players = [RandomPlayer(POLICIES[engine_name], player_id, rng)
+               for player_id in range(num_players)]
+    timings = collections.OrderedDict((name, [0, 0.0]) for name in TIMED_METHODS)
+    outcomes = collections.Counter()
+
+    start = time.perf_counter()
+    for _ in range(num_games):
+        for player in players:
+            player.reset()
+        view_endpoint = QueueEndpoint(asynchronous=asynchronous)
+        if not watched:
+            view_endpoint.put({"type": "views", "payload": False})
+        engine = engine_class(
+            players=[(QueueEndpoint(player.on_state, player.on_message, player.reply,
+                                    asynchronous), stratumgs.codec.DEFAULT_CODEC, False)
+                     for player in players],
+            view_connection=view_endpoint)
+        for name in TIMED_METHODS:
+            setattr(engine, name, _time_method(getattr(engine, name), timings[name]))
+        _play_game(engine)
+        state = players[0].state
+        outcomes[str(state.get("winner")) if isinstance(state, dict) else "None"] += 1
+    seconds = time.perf_counter() - start
+    player_seconds = sum(player.seconds for player in players)
+    timings["play_turn"][1] -= player_seconds
+
+    methods = collections.OrderedDict()
+    for name, (calls, method_seconds) in timings.items():
+        methods[name] = {
+            "calls": calls,
+            "seconds": method_seconds,
+            "mean_us": method_seconds / calls * 1000000 if calls else 0.0,
+            "percent": 100 * method_seconds / seconds if seconds else 0.0
+        }
+    return {
+        "engine": engine_name,
+        "watched": watched,
+        "games": num_games,
+        "seconds": seconds,
+        "games_per_second": num_games / seconds if seconds else 0.0,
+        "turns": timings["play_turn"][0],
+        "player_seconds": player_seconds,
+        "methods": methods,
+        "outcomes": dict(outcomes)
+    }
+
+
+def format_results(results):
+    """
+        Format the results of a self play run for display.
+
+        :param results: The results, as returned by :func:`run_selfplay`.
+        :type results: dict
+        :returns: The formatted results.
+        :rtype: string
+    """
+
+    lines = [
+        "Engine:   {engine}{}".format("" if results["watched"] else " (unwatched)", **results),
+        "Games:    {games} in {seconds:.2f} s ({games_per_second:.1f} games/s)".format(
+            **results),
+        "Turns:    {turns}".format(**results),
+        "Players:  {player_seconds:.3f} s choosing moves".format(**results),
+        "Outcomes: {}".format(", ".join("{} {}".format(outcome, count) for outcome, count
+                                        in sorted(results["outcomes"].items()))),
+        "",
+        "{:<20}{:>12}{:>12}{:>12}{:>8}".format("Method", "Calls", "Total s", "Mean us",
+                                               "Share")
+    ]
+    for name, method in results["methods"].items():
+        lines.append("{:<20}{calls:>12}{seconds:>12.3f}{mean_us:>12.3f}{percent:>7.1f}%".format(
+            name, **method))
+    return "\n".join(lines)
+
+
+def _play_game(engine):
+    """
+        Play a game to the end. The game of an asynchronous engine finishes
+        without the IOLoop, unless the engine waits on something other than its
+        players, in which case the IOLoop is run until it is over.
+
+        :param engine: The engine.
+    """
+
+    result = engine.run()
+    if tornado.concurrent.is_future(result):
+        if not result.done():
+            tornado.ioloop.IOLoop.current().run_sync(lambda: result)
+        result.result()
+
+
+def _time_method(method, timing):
+    """
+        Wrap an engine method so that the calls to it, and the time spent in
+        it, are counted.
+
+        :param method: The bound method.
+        :type method: function
+        :param timing: The number of calls and the number of seconds, which are
+                       updated in place.
+        :type timing: list
+        :returns: The wrapped method.
+        :rtype: function
+    """
+
+    perf_counter = time.perf_counter
+
+    def timed(*args, **kwargs):
+        start = perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            timing[0] += 1
+            timing[1] += perf_counter() - start
+    return timed
+
+
+class RandomPlayer(object):
+    """
+        A synthetic player that keeps the last state and message the engine sent
+        it, and answers with the move chosen by its policy. The time spent
+        choosing moves is counted, so that it can be left out of the engine's.
+
+        :param policy: The policy that chooses the player's moves.
+        :type policy: function
+        :param player_id: The ID of the player.
+        :type player_id: int
+        :param rng: The random number generator.
+        :type rng: :class:`random.Random`
+    """
+
+    def __init__(self, policy, player_id, rng):
+        self.policy = policy
+        self.player_id = player_id
+        self.rng = rng
+        self.state = None
+        self.message = None
+        self.seconds = 0.0
+
+    def reset(self):
+        """
+            Forget the last game.
+        """
+
+        self.state = None
+        self.message = None
+
+    def on_state(self, state):
+        """
+            Called with each state the engine sends the player.
+
+            :param state: The state.
+        """
+
+        self.state = state
+
+    def on_message(self, message):
+        """
+            Called with each message the engine sends the player.
+
+            :param message: The message.
+        """
+
+        self.message = message
+
+    def reply(self):
+        """
+            Choose the player's next move.
+
+            :returns: The move, as a message to the engine.
+            :rtype: dict
+        """
+
+        start = time.perf_counter()
+        move = self.policy(self.state, self.message, self.player_id, self.rng)
+        self.seconds += time.perf_counter() - start
+        return {"type": "message", "payload": move}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure a game engine by playing games between random players.")
+    parser.add_argument("engine", nargs="?", default="tictactoe", choices=sorted(POLICIES),
+                        help="the engine to measure")
+    parser.add_argument("--games", type=int, default=100000,
+                        help="the number of games to play")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="the seed of the random players")
+    parser.add_argument("--unwatched", action="store_true",
+                        help="play the games as if no views were watching them")
+    parser.add_argument("--profile", action="store_true",
+                        help="profile the run, and list the most expensive functions")
+    parser.add_argument("--json", action="store_true",
+                        help="print the results as JSON")
+    args = parser.parse_args()
+
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler is not None:
+        profiler.enable()
+    results = run_selfplay(args.engine, args.games, args.seed, not args.unwatched)
+    if profiler is not None:
+        profiler.disable()
+    if args.json:
+        print(json.dumps(results, indent=4, sort_keys=True))
+    else:
+        print(format_results(results))
+    if profiler is not None:
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(_PROFILE_LIMIT)
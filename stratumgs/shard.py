@@ -0,0 +1,829 @@
+"""
+.. module stratumgs.shard
+
+Runs the client server across several shard processes, so that relaying
+messages between clients and engines is spread across cores. Each shard accepts
+its own share of the client connections, and runs the engines of the games it
+hosts. The main process becomes the coordinator: it runs the web server, keeps
+the registry of every connected client, starts games, and receives the states
+of every game for the views, the game records, and the replays.
+
+A game is hosted by the shard that most of its players are connected to.
+Players connected to other shards are relayed over a link between the two
+shards: on the hosting shard, the remote player is represented by a
+:class:`stratumgs.client.proxy.ClientProxy` whose stream is forwarded over the
+link, and on the player's own shard, the game is reached through a
+:class:`LinkClientProxyHelper`.
+
+Shards must be started before the IOLoop is created, since they are forked
+from the main process.
+"""
+
+import atexit
+import collections
+import functools
+import itertools
+import multiprocessing
+import pickle
+import socket
+import struct
+
+import tornado.ioloop
+import tornado.iostream
+import tornado.netutil
+
+import stratumgs.client.proxy
+import stratumgs.client.registry
+import stratumgs.client.server
+import stratumgs.game
+import stratumgs.game.engine.local
+import stratumgs.game.pool
+import stratumgs.game.runner
+import stratumgs.game.scheduler
+import stratumgs.protocol
+
+
+_COORDINATOR = None
+_SHARD = None
+
+
+def init(num_shards, host, port, reuse_port, pool_size, pool_max_games_per_worker):
+    """
+        Start the client server shards, and make this process their
+        coordinator. Must be called before the IOLoop is created.
+
+        :param num_shards: The number of shard processes.
+        :type num_shards: int
+        :param host: The host the client server binds to.
+        :type host: str
+        :param port: The client server port.
+        :type port: int
+        :param reuse_port: Whether each shard binds its own socket with
+                           ``SO_REUSEPORT``, so that the kernel balances
+                           connections between them, instead of every shard
+                           accepting from a single shared socket.
+        :type reuse_port: bool
+        :param pool_size: The size of each shard's engine worker pool.
+        :type pool_size: int
+        :param pool_max_games_per_worker: The number of games an engine worker
+                                          runs before it is replaced.
+        :type pool_max_games_per_worker: int
+    """
+
+    global _COORDINATOR
+    listen_sockets = None
+    if not reuse_port:
+        listen_sockets = tornado.netutil.bind_sockets(port, address=host)
+    control_sockets = [socket.socketpair() for _ in range(num_shards)]
+    peer_sockets = {pair: socket.socketpair()
+                    for pair in itertools.combinations(range(num_shards), 2)}
+
+    processes = []
+    for shard_id in range(num_shards):
+        process = multiprocessing.Process(target=_shard_main, args=(
+            shard_id, control_sockets, peer_sockets, listen_sockets, host, port,
+            pool_size, pool_max_games_per_worker))
+        process.start()
+        processes.append(process)
+
+    for coordinator_end, shard_end in control_sockets:
+        shard_end.close()
+    for a, b in peer_sockets.values():
+        a.close()
+        b.close()
+    for s in listen_sockets or []:
+        s.close()
+    _COORDINATOR = Coordinator(processes, [c for c, _ in control_sockets])
+    # the shards exit when their control links close, which must happen before
+    # multiprocessing waits for them to exit
+    atexit.register(_COORDINATOR.stop)
+
+
+def _shard_main(shard_id, control_sockets, peer_sockets, listen_sockets, host, port,
+                pool_size, pool_max_games_per_worker):
+    """
+        The target function for a shard process. Keeps the sockets that belong
+        to the shard, closes the rest, and runs the shard's client server.
+
+        :param shard_id: The ID of the shard.
+        :type shard_id: int
+        :param control_sockets: The coordinator and shard ends of the control
+                                link of every shard.
+        :type control_sockets: list(tuple(socket, socket))
+        :param peer_sockets: The two ends of the link between each pair of
+                             shards, by the pair of shard IDs.
+        :type peer_sockets: dict
+        :param listen_sockets: The shared listening sockets, or ``None`` if
+                               each shard binds its own.
+        :type listen_sockets: list(socket)
+        :param host: The host the client server binds to.
+        :type host: str
+        :param port: The client server port.
+        :type port: int
+        :param pool_size: The size of the shard's engine worker pool.
+        :type pool_size: int
+        :param pool_max_games_per_worker: The number of games an engine worker
+                                          runs before it is replaced.
+        :type pool_max_games_per_worker: int
+    """
+
+    global _SHARD
+    tornado.ioloop.IOLoop.clear_instance()
+
+    for i, (coordinator_end, shard_end) in enumerate(control_sockets):
+        coordinator_end.close()
+        if i != shard_id:
+            shard_end.close()
+    peers = {}
+    for (a_id, b_id), (a, b) in peer_sockets.items():
+        if a_id == shard_id:
+            peers[b_id] = a
+            b.close()
+        elif b_id == shard_id:
+            peers[a_id] = b
+            a.close()
+        else:
+            a.close()
+            b.close()
+    if listen_sockets is None:
+        listen_sockets = tornado.netutil.bind_sockets(port, address=host, reuse_port=True)
+
+    stratumgs.game.pool.init(pool_size, pool_max_games_per_worker)
+    _SHARD = Shard(shard_id, control_sockets[shard_id][1], peers)
+    server = stratumgs.client.server.ClientProxyServer()
+    server.add_sockets(listen_sockets)
+    tornado.ioloop.IOLoop.current().start()
+
+
+def is_coordinator():
+    """
+        Check whether this process is the coordinator of the shards.
+
+        :returns: Whether the shards have been started by this process.
+    """
+
+    return _COORDINATOR is not None
+
+
+def is_shard():
+    """
+        Check whether this process is a shard.
+
+        :returns: Whether this process is a shard.
+    """
+
+    return _SHARD is not None
+
+
+def get_coordinator():
+    """
+        Get the coordinator, in the coordinator process.
+
+        :returns: The :class:`Coordinator`.
+    """
+
+    return _COORDINATOR
+
+
+def get_shard():
+    """
+        Get the shard, in a shard process.
+
+        :returns: The :class:`Shard`.
+    """
+
+    return _SHARD
+
+
+def on_client_disconnected(name):
+    """
+        Called by the client server when a client disconnects. In a shard, the
+        coordinator is told, so that it can remove the client from the
+        registry.
+
+        :param name: The name of the client.
+        :type name: string
+    """
+
+    if _SHARD is not None:
+        _SHARD.on_client_disconnected(name)
+
+
+def on_client_game_finished(client):
+    """
+        Called by a client proxy when one of its games is over. In a shard, the
+        coordinator is told, so that it can make the game slot available.
+
+        :param client: The client.
+        :type client: :class:`stratumgs.client.proxy.ClientProxy`
+    """
+
+    if _SHARD is not None:
+        _SHARD.on_client_game_finished(client)
+
+
+class Link(object):
+    """
+        A connection between two processes, which exchange messages of
+        picklable objects, each prefixed with its length.
+
+        :param sock: The socket of the connection.
+        :type sock: :class:`socket.socket`
+        :param on_message: The callback to call with each message received.
+        :type on_message: function
+        :param on_close: The callback to call when the connection is closed.
+        :type on_close: function
+    """
+
+    LENGTH = struct.Struct("!I")
+
+    def __init__(self, sock, on_message, on_close):
+        self._stream = tornado.iostream.IOStream(sock)
+        self._on_message = on_message
+        self._stream.set_close_callback(on_close)
+        self._stream.read_bytes(self.LENGTH.size, self._on_length)
+
+    def send(self, message):
+        """
+            Send a message. The message is buffered, so sending never blocks.
+
+            :param message: The message.
+        """
+
+        data = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+        if not self._stream.closed():
+            self._stream.write(self.LENGTH.pack(len(data)) + data)
+
+    def close(self):
+        """
+            Close the connection.
+        """
+
+        self._stream.close()
+
+    def _on_length(self, data):
+        """
+            Read the message that follows a length prefix.
+
+            :param data: The length prefix.
+            :type data: :class:`bytes`
+        """
+
+        self._stream.read_bytes(self.LENGTH.unpack(data)[0], self._on_data)
+
+    def _on_data(self, data):
+        """
+            Handle a message, and read the next one.
+
+            :param data: The pickled message.
+            :type data: :class:`bytes`
+        """
+
+        self._on_message(pickle.loads(data))
+        if not self._stream.closed():
+            self._stream.read_bytes(self.LENGTH.size, self._on_length)
+
+
+class ShardClient(object):
+    """
+        The coordinator's record of a client connected to one of the shards. It
+        provides the attributes of :class:`stratumgs.client.proxy.ClientProxy`
+        used by the registry, the web server and the scheduler.
+
+        :param client_id: The ID of the connection, which is unique across
+                          shards.
+        :type client_id: int
+        :param shard_id: The ID of the shard the client is connected to.
+        :type shard_id: int
+        :param name: The name of the client.
+        :type name: string
+        :param supported_games: The games the client supports.
+        :type supported_games: list(string)
+        :param max_games: The maximum number of simultaneous games the client
+                          can play.
+        :type max_games: int
+        :param codec: The name of the client's codec.
+        :type codec: string
+        :param accepts_deltas: Whether the client accepts state deltas.
+        :type accepts_deltas: boolean
+    """
+
+    def __init__(self, client_id, shard_id, name, supported_games, max_games, codec,
+                 accepts_deltas):
+        self.client_id = client_id
+        self.shard_id = shard_id
+        self.name = name
+        self.supported_games = supported_games
+        self.max_games = max_games
+        self.games_available = max_games
+        self.codec = codec
+        self.accepts_deltas = accepts_deltas
+        self.num_games_started = 0
+        self.num_games_finished = 0
+
+        configs = dict(stratumgs.game.get_available_game_engines())
+        self.supported_games_display = sorted(
+            configs[game]["display_name"] for game in supported_games if game in configs)
+
+    def is_available(self):
+        """
+            Determine whether the client has game slots available.
+
+            :returns: Whether the client has game slots available.
+        """
+
+        return self.games_available > 0
+
+    def create_endpoints_for_game(self, game_id):
+        """
+            Take one of the client's game slots for a new game. The endpoints
+            are created by the shard hosting the game.
+
+            :param game_id: The id of the game being created.
+            :type game_id: int
+            :returns: ``None``
+        """
+
+        self.num_games_started += 1
+        self._update_games_available()
+
+    def on_games_finished(self, num_games_finished):
+        """
+            Update the number of games the client has finished, as reported by
+            its shard. Reports can arrive out of order, so the count only ever
+            increases.
+
+            :param num_games_finished: The number of finished games.
+            :type num_games_finished: int
+        """
+
+        self.num_games_finished = max(self.num_games_finished, num_games_finished)
+        self._update_games_available()
+
+    def _update_games_available(self):
+        """
+            Recompute the number of available game slots, and update the
+            registry.
+        """
+
+        self.games_available = (self.max_games - self.num_games_started +
+                                self.num_games_finished)
+        stratumgs.client.registry.update_availability(self)
+
+
+class Coordinator(object):
+    """
+        Runs in the main process, and coordinates the shards.
+
+        :param processes: The shard processes.
+        :type processes: list(:class:`multiprocessing.Process`)
+        :param control_sockets: The coordinator ends of the control links, by
+                                shard ID.
+        :type control_sockets: list(:class:`socket.socket`)
+    """
+
+    def __init__(self, processes, control_sockets):
+        self._processes = processes
+        self._client_ids = itertools.count()
+        self._clients = {}
+        self._hosted_games = collections.defaultdict(set)
+        self._links = [Link(sock, functools.partial(self._on_message, shard_id),
+                            functools.partial(self._on_shard_exit, shard_id))
+                       for shard_id, sock in enumerate(control_sockets)]
+
+    def start_game(self, game_id, engine_name, players):
+        """
+            Start a game on the shard that most of its players are connected
+            to.
+
+            :param game_id: The ID of the game.
+            :type game_id: int
+            :param engine_name: The name of the game's engine.
+            :type engine_name: string
+            :param players: The players.
+            :type players: list(:class:`ShardClient`)
+        """
+
+        shard_id = collections.Counter(p.shard_id for p in players).most_common(1)[0][0]
+        self._hosted_games[shard_id].add(game_id)
+        self._links[shard_id].send(("start", game_id, engine_name, [
+            (p.client_id, p.shard_id, p.name, p.codec, p.accepts_deltas) for p in players]))
+
+    def send_view_states_wanted(self, game_id, wanted):
+        """
+            Tell the shard hosting a game whether its engine should send states
+            to the view.
+
+            :param game_id: The ID of the game.
+            :type game_id: int
+            :param wanted: Whether the view states are wanted.
+            :type wanted: boolean
+        """
+
+        for shard_id, game_ids in self._hosted_games.items():
+            if game_id in game_ids:
+                self._links[shard_id].send(("views", game_id, wanted))
+                return
+
+    def stop(self):
+        """
+            Stop the shards, by closing their control links.
+        """
+
+        for link in self._links:
+            link.close()
+
+    def _on_message(self, shard_id, message):
+        """
+            Handle a message from a shard.
+
+            :param shard_id: The ID of the shard.
+            :type shard_id: int
+            :param message: The message.
+            :type message: tuple
+        """
+
+        if message[0] == "state":
+            _, game_id, frame_type, payload = message
+            runner = stratumgs.game.get_game_runner(game_id)
+            if frame_type == stratumgs.protocol.CLOSE:
+                self._hosted_games[shard_id].discard(game_id)
+            if runner is not None:
+                runner.feed_state(frame_type, payload)
+        elif message[0] == "games_finished":
+            _, client_id, num_games_finished = message
+            client = self._clients.get(client_id)
+            if client is not None:
+                client.on_games_finished(num_games_finished)
+                stratumgs.game.scheduler.request_scheduling()
+        elif message[0] == "connect":
+            _, request_id, name, supported_games, max_games, codec, accepts_deltas = message
+            client = ShardClient(
+                next(self._client_ids), shard_id,
+                stratumgs.client.server.ClientProxyServer._negotiate_name(name),
+                supported_games, max_games, codec, accepts_deltas)
+            self._clients[client.client_id] = client
+            stratumgs.client.registry.add_client(client)
+            self._links[shard_id].send(("connected", request_id, client.client_id, client.name))
+            stratumgs.game.scheduler.request_scheduling()
+        elif message[0] == "disconnect":
+            self._remove_client(message[1])
+
+    def _remove_client(self, client_id):
+        """
+            Remove a client that has disconnected.
+
+            :param client_id: The ID of the client.
+            :type client_id: int
+        """
+
+        client = self._clients.pop(client_id, None)
+        if client is not None and stratumgs.client.registry.get_client(client.name) is client:
+            stratumgs.client.registry.remove_client(client.name)
+
+    def _on_shard_exit(self, shard_id):
+        """
+            Called when a shard's control link closes, because the shard has
+            exited. Its clients are removed, and its games are ended.
+
+            :param shard_id: The ID of the shard.
+            :type shard_id: int
+        """
+
+        print("Shard {} exited.".format(shard_id))
+        for client in list(self._clients.values()):
+            if client.shard_id == shard_id:
+                self._remove_client(client.client_id)
+        for game_id in self._hosted_games.pop(shard_id, set()):
+            runner = stratumgs.game.get_game_runner(game_id)
+            if runner is not None:
+                runner.feed_state(stratumgs.protocol.CLOSE, b"")
+
+
+class LinkClientProxyHelper(object):
+    """
+        A helper object to connect a client to a game hosted by another shard.
+        Messages from the client are sent over the link to the hosting shard.
+
+        :param link: The link to the hosting shard.
+        :type link: :class:`Link`
+        :param shard_id: The ID of the hosting shard.
+        :type shard_id: int
+        :param client_id: The ID of the client.
+        :type client_id: int
+    """
+
+    def __init__(self, link, shard_id, client_id):
+        self.link = link
+        self.shard_id = shard_id
+        self.client_id = client_id
+
+    def write_to_engine(self, msg):
+        """
+            Write a frame to the engine.
+
+            :param msg: The frame to write.
+            :type msg: :class:`bytes`
+        """
+
+        self.link.send(("to_engine", self.client_id, msg))
+
+    def get_unread_size(self):
+        """
+            Get the number of bytes written to the engine that it has not read
+            yet. Frames are relayed to the hosting shard over the shared link
+            as soon as they arrive, so this is always 0.
+
+            :returns: The number of bytes.
+        """
+
+        return 0
+
+    def get_buffered_size(self):
+        """
+            Get the number of bytes written by the engine that have not been
+            read from it yet. Frames from the hosting shard are written to the
+            client as soon as they arrive, so this is always 0.
+
+            :returns: The number of bytes.
+        """
+
+        return 0
+
+    def close_engine_connection_endpoints(self):
+        """
+            Nothing needs to be closed, since the link is shared by every game
+            hosted by the other shard.
+        """
+
+        pass
+
+
+class Shard(object):
+    """
+        Runs in a shard process, and handles the messages from the coordinator
+        and the other shards.
+
+        :param shard_id: The ID of the shard.
+        :type shard_id: int
+        :param control_socket: The shard end of the control link.
+        :type control_socket: :class:`socket.socket`
+        :param peer_sockets: The links to the other shards, by shard ID.
+        :type peer_sockets: dict(int, :class:`socket.socket`)
+    """
+
+    def __init__(self, shard_id, control_socket, peer_sockets):
+        self.shard_id = shard_id
+        self._request_ids = itertools.count()
+        self._pending_clients = {}
+        self._clients = {}
+        self._client_ids = {}
+        self._remote_players = {}
+        self._runners = {}
+        self._control = Link(control_socket, self._on_control_message,
+                             tornado.ioloop.IOLoop.current().stop)
+        self._peers = {peer_id: Link(sock, functools.partial(self._on_peer_message, peer_id),
+                                     functools.partial(self._on_peer_exit, peer_id))
+                       for peer_id, sock in peer_sockets.items()}
+
+    def register_client(self, name, supported_games, max_games, codec, accepts_deltas,
+                        callback):
+        """
+            Register a new client with the coordinator, which chooses a name for
+            it that is unique across shards.
+
+            :param name: The name requested by the client.
+            :type name: string
+            :param supported_games: The games the client supports.
+            :type supported_games: list(string)
+            :param max_games: The maximum number of simultaneous games.
+            :type max_games: int
+            :param codec: The name of the client's codec.
+            :type codec: string
+            :param accepts_deltas: Whether the client accepts state deltas.
+            :type accepts_deltas: boolean
+            :param callback: The callback to call with the chosen name. It
+                             returns the client's proxy, or ``None`` if the
+                             client disconnected in the meantime.
+            :type callback: function
+        """
+
+        request_id = next(self._request_ids)
+        self._pending_clients[request_id] = callback
+        self._control.send(("connect", request_id, name, supported_games, max_games, codec,
+                            accepts_deltas))
+
+    def on_client_disconnected(self, name):
+        """
+            Called when a client disconnects, to tell the coordinator.
+
+            :param name: The name of the client.
+            :type name: string
+        """
+
+        client_id = self._client_ids.pop(name, None)
+        if client_id is not None:
+            del self._clients[client_id]
+            self._control.send(("disconnect", client_id))
+
+    def on_client_game_finished(self, client):
+        """
+            Called when one of a client's games is over, to tell the
+            coordinator.
+
+            :param client: The client.
+            :type client: :class:`stratumgs.client.proxy.ClientProxy`
+        """
+
+        client_id = self._client_ids.get(client.name)
+        if client_id is not None and self._clients[client_id] is client:
+            self._control.send(("games_finished", client_id, client.num_games_finished))
+
+    def _on_control_message(self, message):
+        """
+            Handle a message from the coordinator.
+
+            :param message: The message.
+            :type message: tuple
+        """
+
+        if message[0] == "start":
+            _, game_id, engine_name, players = message
+            self._start_game(game_id, engine_name, players)
+        elif message[0] == "connected":
+            _, request_id, client_id, name = message
+            client = self._pending_clients.pop(request_id)(name)
+            if client is None:
+                self._control.send(("disconnect", client_id))
+                return
+            self._clients[client_id] = client
+            self._client_ids[name] = client_id
+        elif message[0] == "views":
+            _, game_id, wanted = message
+            runner = self._runners.get(game_id)
+            if runner is not None:
+                runner.send_view_states_wanted(wanted)
+
+    def _start_game(self, game_id, engine_name, players):
+        """
+            Start hosting a game. The states of the game are sent to the
+            coordinator.
+
+            :param game_id: The ID of the game.
+            :type game_id: int
+            :param engine_name: The name of the game's engine.
+            :type engine_name: string
+            :param players: The ID, shard ID, name, codec name, and whether
+                            deltas are accepted, of each player.
+            :type players: list(tuple)
+        """
+
+        player_proxies = []
+        closed_players = []
+        for client_id, shard_id, name, codec, accepts_deltas in players:
+            if shard_id != self.shard_id:
+                player_proxies.append(
+                    self._get_remote_player(shard_id, client_id, name, codec, accepts_deltas))
+            elif client_id in self._clients:
+                player_proxies.append(self._clients[client_id])
+            else:
+                # the client has disconnected, so it joins the game already
+                # closed, and the engine ends the game
+                proxy, link_end = _make_linked_proxy(name, codec, accepts_deltas)
+                player_proxies.append(proxy)
+                closed_players.append(link_end)
+
+        def forward_state(frame_type, payload):
+            if frame_type == stratumgs.protocol.CLOSE:
+                self._runners.pop(game_id, None)
+            self._control.send(("state", game_id, frame_type, payload))
+
+        self._runners[game_id] = stratumgs.game.runner.init_engine_runner(
+            game_id, stratumgs.game.get_engine_class(engine_name), engine_name,
+            player_proxies, state_forwarder=forward_state)
+        for link_end in closed_players:
+            link_end.close()
+
+    def _get_remote_player(self, shard_id, client_id, name, codec, accepts_deltas):
+        """
+            Get the proxy for a player connected to another shard, creating it
+            if needed. Frames written to the proxy are sent to the player's
+            shard, and frames from the player are written to the proxy. The
+            proxy is dropped once the player has no games left on this shard.
+
+            :param shard_id: The ID of the player's shard.
+            :type shard_id: int
+            :param client_id: The ID of the player.
+            :type client_id: int
+            :param name: The name of the player.
+            :type name: string
+            :param codec: The name of the player's codec.
+            :type codec: string
+            :param accepts_deltas: Whether the player accepts state deltas.
+            :type accepts_deltas: boolean
+            :returns: The proxy.
+            :rtype: :class:`stratumgs.client.proxy.ClientProxy`
+        """
+
+        if client_id in self._remote_players:
+            return self._remote_players[client_id][0]
+        proxy, link_end = _make_linked_proxy(name, codec, accepts_deltas)
+        self._remote_players[client_id] = (proxy, link_end, shard_id)
+        link = self._peers[shard_id]
+
+        def frame_to_client(frame_type, game_id, payload):
+            link.send(("to_client", client_id, frame_type, game_id, payload))
+            if frame_type == stratumgs.protocol.CLOSE and not proxy.helpers:
+                # the player has no games left on this shard, so the proxy is
+                # dropped, and a new one is made for its next game here
+                link_closed()
+                link_end.close()
+                return
+            stratumgs.protocol.read_frame(link_end.read_bytes, frame_to_client)
+
+        def link_closed():
+            if self._remote_players.get(client_id, (None, None))[1] is link_end:
+                del self._remote_players[client_id]
+
+        link_end.set_close_callback(link_closed)
+        stratumgs.protocol.read_frame(link_end.read_bytes, frame_to_client)
+        return proxy
+
+    def _on_peer_message(self, shard_id, message):
+        """
+            Handle a message from another shard.
+
+            :param shard_id: The ID of the other shard.
+            :type shard_id: int
+            :param message: The message.
+            :type message: tuple
+        """
+
+        if message[0] == "to_engine":
+            _, client_id, frame = message
+            remote_player = self._remote_players.get(client_id)
+            if remote_player is None or remote_player[1].closed():
+                return
+            if stratumgs.protocol.HEADER.unpack_from(frame)[0] == stratumgs.protocol.CLOSE:
+                # the player has disconnected, which ends all of its games
+                remote_player[1].close()
+            else:
+                remote_player[1].write(frame)
+            return
+
+        _, client_id, frame_type, game_id, payload = message
+        client = self._clients.get(client_id)
+        if frame_type == stratumgs.protocol.START:
+            if client is None:
+                # the client disconnected before the game started
+                close_frame = stratumgs.protocol.encode_frame(stratumgs.protocol.CLOSE, game_id)
+                self._peers[shard_id].send(("to_engine", client_id, close_frame))
+            else:
+                client.add_game(game_id, LinkClientProxyHelper(
+                    self._peers[shard_id], shard_id, client_id))
+        elif client is not None and isinstance(client.helpers.get(game_id),
+                                               LinkClientProxyHelper):
+            client.write_from_engine(frame_type, game_id, payload)
+
+    def _on_peer_exit(self, shard_id):
+        """
+            Called when the link to another shard closes, because it has
+            exited. The games it hosted are closed for the clients of this
+            shard, and the players it relayed to this shard are disconnected.
+
+            :param shard_id: The ID of the other shard.
+            :type shard_id: int
+        """
+
+        for client in list(self._clients.values()):
+            for game_id, helper in list(client.helpers.items()):
+                if isinstance(helper, LinkClientProxyHelper) and helper.shard_id == shard_id:
+                    client.write_from_engine(stratumgs.protocol.CLOSE, game_id)
+        for proxy, link_end, player_shard_id in list(self._remote_players.values()):
+            if player_shard_id == shard_id:
+                link_end.close()
+
+
+def _make_linked_proxy(name, codec, accepts_deltas):
+    """
+        Make a client proxy for a player that is not connected to this shard.
+        The proxy's stream is one end of a local stream pair, and the player's
+        frames are relayed through the other end. Closing the other end
+        disconnects the player from its games.
+
+        :param name: The name of the player.
+        :type name: string
+        :param codec: The name of the player's codec.
+        :type codec: string
+        :param accepts_deltas: Whether the player accepts state deltas.
+        :type accepts_deltas: boolean
+        :returns: The proxy, and the other end of its stream.
+    """
+
+    proxy_end, link_end = stratumgs.game.engine.local.make_local_stream_pair()
+    stream_proxy = stratumgs.client.server.StreamProxy(proxy_end)
+    proxy_end.set_close_callback(lambda: stream_proxy.close())
+    proxy = stratumgs.client.proxy.ClientProxy(
+        name, [], 0, stream_proxy, stratumgs.protocol.LENGTH_PREFIXED_FRAMING,
+        max(stratumgs.protocol.PROTOCOL_VERSIONS), codec, accepts_deltas)
+    return proxy, link_end
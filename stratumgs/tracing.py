@@ -0,0 +1,295 @@
+"""
+.. module stratumgs.tracing
+
+Opt in tracing of the messages of each game. When tracing is enabled, each hop
+of a message is timestamped: the engine writing a state or a message, the
+client proxy relaying it, the write to the client completing, the client's
+reply arriving, and the engine reading the reply. The events of a game form its
+timeline, which can be exported in the Chrome trace event format, and opened in
+``chrome://tracing`` or Perfetto.
+
+Engines record their own events, and send them to the server over the view
+stream, in a frame of type :data:`stratumgs.protocol.TRACE`, when the game is
+over. Timestamps are taken from the wall clock, so the events of engines on
+remote workers are only as aligned as the clocks of the two machines.
+"""
+
+import collections
+import json
+import time
+
+
+# The processes that events are recorded in
+SERVER_PROCESS = "server"
+ENGINE_PROCESS = "engine"
+
+_ENABLED = False
+_MAX_EVENTS_PER_GAME = 100000
+
+# The timelines of the games being traced in this process, by game ID
+_TIMELINES = {}
+
+
+def init(enabled, max_events_per_game):
+    """
+        Initialize tracing. Must be called before engine workers are started,
+        since they inherit whether tracing is enabled.
+
+        :param enabled: Whether games are traced.
+        :type enabled: boolean
+        :param max_events_per_game: The maximum number of events kept for each
+                                    game. Later events are dropped.
+        :type max_events_per_game: int
+    """
+
+    global _ENABLED, _MAX_EVENTS_PER_GAME
+    _ENABLED = enabled
+    _MAX_EVENTS_PER_GAME = max_events_per_game
+
+
+def is_enabled():
+    """
+        Determine whether games are traced.
+
+        :returns: Whether games are traced.
+    """
+
+    return _ENABLED
+
+
+def now():
+    """
+        Get the current time, as used in trace events.
+
+        :returns: The number of microseconds since the epoch.
+        :rtype: float
+    """
+
+    return time.time() * 1000000
+
+
+def make_event(name, process, thread, timestamp, duration=None, args=None):
+    """
+        Make a trace event. Events without a duration mark a single point in
+        time.
+
+        :param name: The name of the event.
+        :type name: string
+        :param process: The process the event happened in, such as
+                        :data:`SERVER_PROCESS`.
+        :type process: string
+        :param thread: The row of the timeline the event is shown in, such as
+                       the name of a client.
+        :type thread: string
+        :param timestamp: The time of the event, from :func:`now`.
+        :type timestamp: float
+        :param duration: The duration of the event, in microseconds.
+        :type duration: float
+        :param args: Extra information about the event.
+        :type args: dict
+        :returns: The event.
+        :rtype: dict
+    """
+
+    event = {"name": name, "process": process, "thread": thread, "ts": timestamp}
+    if duration is not None:
+        event["dur"] = duration
+    if args:
+        event["args"] = args
+    return event
+
+
+def start_game(game_id):
+    """
+        Start tracing a game in this process, if tracing is enabled.
+
+        :param game_id: The ID of the game.
+        :type game_id: int
+        :returns: The game's timeline, or ``None`` if tracing is disabled.
+        :rtype: :class:`GameTimeline`
+    """
+
+    if not _ENABLED:
+        return None
+    timeline = _TIMELINES[game_id] = GameTimeline(game_id, _MAX_EVENTS_PER_GAME)
+    return timeline
+
+
+def finish_game(game_id):
+    """
+        Stop recording the events of a game in this process. The timeline is
+        kept by whoever started it.
+
+        :param game_id: The ID of the game.
+        :type game_id: int
+    """
+
+    _TIMELINES.pop(game_id, None)
+
+
+def is_traced(game_id):
+    """
+        Determine whether a game is being traced in this process.
+
+        :param game_id: The ID of the game.
+        :type game_id: int
+        :returns: Whether the game is being traced.
+    """
+
+    return game_id in _TIMELINES
+
+
+def record(game_id, name, thread, args=None):
+    """
+        Record a server event for a game, if the game is being traced in this
+        process.
+
+        :param game_id: The ID of the game.
+        :type game_id: int
+        :param name: The name of the event.
+        :type name: string
+        :param thread: The row of the timeline the event is shown in.
+        :type thread: string
+        :param args: Extra information about the event.
+        :type args: dict
+    """
+
+    timeline = _TIMELINES.get(game_id)
+    if timeline is not None:
+        timeline.add(make_event(name, SERVER_PROCESS, thread, now(), args=args))
+
+
+class GameTimeline(object):
+    """
+        The trace events of a game.
+
+        :param game_id: The ID of the game.
+        :type game_id: int
+        :param max_events: The maximum number of events kept.
+        :type max_events: int
+    """
+
+    def __init__(self, game_id, max_events):
+        self.game_id = game_id
+        self.max_events = max_events
+        self.num_dropped = 0
+        self._events = []
+
+    def add(self, event):
+        """
+            Add an event, unless the timeline is full.
+
+            :param event: The event, from :func:`make_event`.
+            :type event: dict
+        """
+
+        if len(self._events) < self.max_events:
+            self._events.append(event)
+        else:
+            self.num_dropped += 1
+
+    def add_events(self, events):
+        """
+            Add events, such as those sent by the engine.
+
+            :param events: The events.
+            :type events: list(dict)
+        """
+
+        for event in events:
+            self.add(event)
+
+    def get_events(self):
+        """
+            Get the events, in the order they were added.
+
+            :returns: The events.
+            :rtype: list(dict)
+        """
+
+        return list(self._events)
+
+    def to_chrome_trace(self):
+        """
+            Export the timeline in the Chrome trace event format. Each process
+            and thread is given a numeric ID, and named with metadata events.
+
+            :returns: The trace, as a JSON object.
+            :rtype: dict
+        """
+
+        pids = collections.OrderedDict()
+        tids = collections.OrderedDict()
+        trace_events = []
+        for event in sorted(self._events, key=lambda e: e["ts"]):
+            pid = pids.setdefault(event["process"], len(pids) + 1)
+            tid = tids.setdefault((event["process"], event["thread"]), len(tids) + 1)
+            trace_event = {
+                "name": event["name"],
+                "cat": event["process"],
+                "ph": "X" if "dur" in event else "i",
+                "ts": event["ts"],
+                "pid": pid,
+                "tid": tid,
+                "args": event.get("args", {})
+            }
+            if "dur" in event:
+                trace_event["dur"] = event["dur"]
+            else:
+                trace_event["s"] = "t"
+            trace_events.append(trace_event)
+        for process, pid in pids.items():
+            trace_events.append({"name": "process_name", "ph": "M", "pid": pid, "tid": 0,
+                                 "args": {"name": process}})
+        for (process, thread), tid in tids.items():
+            trace_events.append({"name": "thread_name", "ph": "M", "pid": pids[process],
+                                 "tid": tid, "args": {"name": thread}})
+        return {
+            "traceEvents": trace_events,
+            "displayTimeUnit": "ms",
+            "otherData": {"game_id": self.game_id, "dropped_events": self.num_dropped}
+        }
+
+
+class EngineTrace(object):
+    """
+        Records the events of an engine, which are sent to the server when the
+        game is over.
+    """
+
+    def __init__(self):
+        self._events = []
+
+    def record(self, name, thread, start=None, args=None):
+        """
+            Record an event. If a start time is given, the event lasts from
+            then until now.
+
+            :param name: The name of the event.
+            :type name: string
+            :param thread: The row of the timeline the event is shown in.
+            :type thread: string
+            :param start: The start of the event, from :func:`now`.
+            :type start: float
+            :param args: Extra information about the event.
+            :type args: dict
+        """
+
+        if len(self._events) >= _MAX_EVENTS_PER_GAME:
+            return
+        timestamp = now()
+        if start is None:
+            self._events.append(make_event(name, ENGINE_PROCESS, thread, timestamp, args=args))
+        else:
+            self._events.append(make_event(name, ENGINE_PROCESS, thread, start,
+                                           timestamp - start, args))
+
+    def encode(self):
+        """
+            Encode the events, to be sent to the server.
+
+            :returns: The encoded events.
+            :rtype: :class:`bytes`
+        """
+
+        return json.dumps(self._events).encode()
@@ -5,15 +5,23 @@ The web server for stratumgs.
 """
 
 import datetime
+import json
 import os
 
+import tornado.gen
 import tornado.web
 import tornado.websocket
 import tornado.httpserver
+import tornado.iostream
 import tornado.ioloop
 
+import stratumgs.config
 import stratumgs.game
+import stratumgs.game.replay
+import stratumgs.game.scheduler
 import stratumgs.client.server
+import stratumgs.metrics
+import stratumgs.tracing
 
 
 def init(host, port, debug):
@@ -38,8 +46,16 @@ def init(host, port, debug):
         tornado.web.url(r"/games/([^/]+)/view/([\d]+)", ViewHandler, name="view"),
         tornado.web.url(r"/games/([^/]+)/view/([\d]+)/socket", ViewSocketHandler,
                         name="view_socket"),
+        tornado.web.url(r"/games/([^/]+)/replay/([\d]+)", ViewHandler, name="replay"),
+        tornado.web.url(r"/games/([^/]+)/replay/([\d]+)/socket", ReplaySocketHandler,
+                        name="replay_socket"),
+        tornado.web.url(r"/games/([^/]+)/trace/([\d]+)", TraceHandler, name="trace"),
         tornado.web.url(r"/matches", MatchesHandler, name="matches"),
         tornado.web.url(r"/players", PlayersHandler, name="players"),
+        tornado.web.url(r"/tournaments", TournamentsHandler, name="tournaments"),
+        tornado.web.url(r"/tournaments/([\d]+)/stop", StopTournamentHandler,
+                        name="stop_tournament"),
+        tornado.web.url(r"/metrics", MetricsHandler, name="metrics"),
         tornado.web.url(r"/assets/(.*)", tornado.web.StaticFileHandler,
                         {"path": static_files_path}, name="static")
     ], template_path=template_path, debug=debug)
@@ -97,7 +113,7 @@ class StartHandler(LoggingHandler):
     def post(self, game):
         player_ids = self.get_arguments("players")
         game_id = stratumgs.game.init_game_engine(game, player_ids=player_ids)
-        self.redirect("/games/tictactoe/view/{}".format(game_id))
+        self.redirect("/games/{}/view/{}".format(game, game_id))
 
 
 class ViewHandler(LoggingHandler):
@@ -115,34 +131,158 @@ class ViewSocketHandler(tornado.websocket.WebSocketHandler):
         Handles websocket connections for viewing games.
     """
 
+    def initialize(self):
+        self.runner = None
+
     def open(self, game, game_id):
-        self.is_open = True
-        stratumgs.game.get_game_runner(int(game_id)).add_view(self)
+        self.runner = stratumgs.game.get_game_runner(int(game_id))
+        if self.runner is not None:
+            self.runner.add_view(self)
+            return
+        record = stratumgs.game.get_game_record(int(game_id))
+        if record is None:
+            self.close()
+            return
+        self.write_message(json.dumps({"type": "message", "payload": record.final_state}))
 
     def on_close(self):
-        self.is_open = False
+        if self.runner is not None:
+            self.runner.remove_view(self)
 
     def on_message(self, message):
         pass
 
 
+class ReplaySocketHandler(tornado.websocket.WebSocketHandler):
+    """
+        Handles websocket connections for replaying finished games from their
+        replay files. The ``turn`` query argument selects the turn to start
+        from, and the ``interval`` query argument sets the number of seconds
+        between turns.
+    """
+
+    def open(self, game, game_id):
+        game_id = int(game_id)
+        runner = stratumgs.game.get_game_runner(game_id)
+        replay = None
+        if runner is None or not runner.is_running:
+            replay = stratumgs.game.replay.load_replay(game_id)
+        if replay is None:
+            self.close()
+            return
+        try:
+            turn = min(max(int(self.get_query_argument("turn", 0)), 0),
+                       replay.get_num_turns() - 1)
+            interval = float(self.get_query_argument(
+                "interval", stratumgs.config.get("replays", "turn_interval")))
+        except ValueError:
+            turn = None
+        if turn is None or replay.get_num_turns() == 0:
+            replay.close()
+            self.close()
+            return
+        tornado.ioloop.IOLoop.current().spawn_callback(self.stream_replay, replay, turn, interval)
+
+    @tornado.gen.coroutine
+    def stream_replay(self, replay, turn, interval):
+        """
+            Send a replay to the view, starting from a turn. Each message is
+            written once the previous one has been sent, so that a slow view
+            does not make the server buffer the whole replay. The replay is
+            closed once it has been sent, or the view has disconnected.
+
+            :param replay: The replay to send.
+            :type replay: :class:`stratumgs.game.replay.Replay`
+            :param turn: The turn to start from.
+            :type turn: int
+            :param interval: The number of seconds between turns.
+            :type interval: float
+        """
+
+        try:
+            for message in replay.seek(turn):
+                self.write_message(message)
+            for next_turn in range(turn + 1, replay.get_num_turns()):
+                if interval > 0:
+                    yield tornado.gen.sleep(interval)
+                yield self.write_message(replay.get_turn(next_turn))
+        except (tornado.websocket.WebSocketClosedError, tornado.iostream.StreamClosedError):
+            pass
+        finally:
+            replay.close()
+
+    def on_message(self, message):
+        pass
+
+
+class TraceHandler(LoggingHandler):
+    """
+        Serves the timeline of a traced game in memory, in the Chrome trace
+        event format.
+    """
+
+    def get(self, game, game_id):
+        runner = stratumgs.game.get_game_runner(int(game_id))
+        if runner is None or runner.timeline is None:
+            raise tornado.web.HTTPError(404)
+        self.set_header("Content-Type", "application/json")
+        self.set_header("Content-Disposition",
+                        'attachment; filename="{}-{}.trace.json"'.format(game, game_id))
+        self.write(json.dumps(runner.timeline.to_chrome_trace()))
+
+
 class MatchesHandler(LoggingHandler):
     """
-        Displays current matches.
+        Displays current matches, and the most recently finished matches, which
+        can be filtered by the ``engine`` and ``player`` query arguments.
     """
 
     def get(self):
-        all_matches = stratumgs.game.get_current_games()
-        active_matches = []
-        inactive_matches = []
-        for match in all_matches:
-            if match[1].is_running:
-                active_matches.append(match)
-            else:
-                inactive_matches.append(match)
+        active_matches = [match for match in stratumgs.game.get_current_games()
+                          if match[1].is_running]
+        inactive_matches = stratumgs.game.get_finished_games(
+            engine_name=self.get_query_argument("engine", None),
+            player_name=self.get_query_argument("player", None))
         self.render("matches.html",
                     active_matches=active_matches,
-                    inactive_matches=inactive_matches)
+                    inactive_matches=inactive_matches,
+                    replays_enabled=stratumgs.game.replay.is_enabled(),
+                    tracing_enabled=stratumgs.tracing.is_enabled())
+
+
+class TournamentsHandler(LoggingHandler):
+    """
+        Lists the tournaments and their standings, and starts new tournaments.
+    """
+
+    def get(self):
+        self.render("tournaments.html",
+                    tournaments=stratumgs.game.scheduler.get_tournaments(),
+                    games=stratumgs.game.get_available_game_engines(),
+                    pairings=stratumgs.game.scheduler.PAIRINGS)
+
+    def post(self):
+        try:
+            stratumgs.game.scheduler.start_tournament(
+                self.get_argument("game"), self.get_argument("pairing"),
+                int(self.get_argument("max_games", 0) or 0))
+        except (KeyError, ValueError) as e:
+            raise tornado.web.HTTPError(400, str(e))
+        self.redirect(self.reverse_url("tournaments"))
+
+
+class StopTournamentHandler(LoggingHandler):
+    """
+        Stops a tournament from starting new games.
+    """
+
+    def post(self, tournament_id):
+        try:
+            tournament = stratumgs.game.scheduler.get_tournament(int(tournament_id))
+        except IndexError:
+            raise tornado.web.HTTPError(404)
+        tournament.stop()
+        self.redirect(self.reverse_url("tournaments"))
 
 
 class PlayersHandler(LoggingHandler):
@@ -153,3 +293,16 @@ class PlayersHandler(LoggingHandler):
     def get(self):
         players = stratumgs.client.server.get_connected_clients()
         self.render("players.html", players=players)
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    """
+        Serves the performance metrics in the Prometheus text format. Requests
+        are not logged, since the metrics are scraped periodically.
+    """
+
+    def get(self):
+        if not stratumgs.metrics.is_enabled():
+            raise tornado.web.HTTPError(404)
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.write(stratumgs.metrics.render())
@@ -0,0 +1,206 @@
+import collections
+import unittest
+
+import stratumgs.codec
+import stratumgs.game.engine.engine
+import stratumgs.protocol
+
+from stratumgs.game.engine.delta import apply_patch, copy_state, diff
+
+
+class DiffTest(unittest.TestCase):
+
+    def assertRoundTrip(self, old, new):
+        patched = apply_patch(copy_state(old), diff(old, new))
+        self.assertEqual(patched, new)
+
+    def test_equal_states_have_no_operations(self):
+        state = {"board": [[None, "X"], ["O", None]], "turn": 3}
+        self.assertEqual(diff(state, copy_state(state)), [])
+
+    def test_nested_changes(self):
+        old = {"board": [[None, "X"], [None, None]], "scores": {"a": 1, "b": 2},
+               "last": {"row": 0, "column": 1}}
+        new = {"board": [["O", "X"], [None, None]], "scores": {"a": 1, "b": 3, "c": 0},
+               "last": {"row": 0}}
+        self.assertEqual(sorted(diff(old, new), key=lambda op: op["path"]), [
+            {"op": "replace", "path": "/board/0/0", "value": "O"},
+            {"op": "remove", "path": "/last/column"},
+            {"op": "replace", "path": "/scores/b", "value": 3},
+            {"op": "add", "path": "/scores/c", "value": 0}
+        ])
+        self.assertRoundTrip(old, new)
+
+    def test_lists_that_grow_or_shrink_are_replaced(self):
+        old = {"moves": [[0, 0], [1, 1]], "board": [[None]]}
+        grown = {"moves": [[0, 0], [1, 1], [2, 2]], "board": [[None]]}
+        shrunk = {"moves": [[0, 0]], "board": [[None]]}
+        self.assertEqual(diff(old, grown),
+                         [{"op": "replace", "path": "/moves", "value": [[0, 0], [1, 1], [2, 2]]}])
+        self.assertEqual(diff(old, shrunk),
+                         [{"op": "replace", "path": "/moves", "value": [[0, 0]]}])
+        self.assertRoundTrip(old, grown)
+        self.assertRoundTrip(grown, shrunk)
+        self.assertRoundTrip(shrunk, {"moves": [], "board": [[None]]})
+
+    def test_changes_of_type_are_replaced(self):
+        self.assertEqual(diff({"winner": 1}, {"winner": True}),
+                         [{"op": "replace", "path": "/winner", "value": True}])
+        self.assertRoundTrip({"winner": None}, {"winner": "X"})
+        self.assertRoundTrip({"board": [1, 2]}, {"board": {"0": 1}})
+
+    def test_whole_state_is_replaced(self):
+        self.assertEqual(diff([1, 2], {"a": 1}),
+                         [{"op": "replace", "path": "", "value": {"a": 1}}])
+        self.assertRoundTrip([1, 2], {"a": 1})
+        self.assertRoundTrip(1, 2)
+
+    def test_keys_are_escaped(self):
+        old = {"a/b": 1, "c~d": {"e": 1}}
+        new = {"a/b": 2, "c~d": {"e": 2}, "f/~": 3}
+        self.assertIn({"op": "replace", "path": "/a~1b", "value": 2}, diff(old, new))
+        self.assertRoundTrip(old, new)
+
+    def test_round_trip_over_a_game(self):
+        states = [{"board": [[None] * 3 for _ in range(3)], "moves": [], "winner": None}]
+        for i, (row, column) in enumerate([(1, 1), (0, 0), (2, 2), (0, 2), (0, 1)]):
+            state = copy_state(states[-1])
+            state["board"][row][column] = "XO"[i % 2]
+            state["moves"].append({"row": row, "column": column})
+            states.append(state)
+        states.append(dict(copy_state(states[-1]), winner="X"))
+        patched = copy_state(states[0])
+        for old, new in zip(states, states[1:]):
+            patched = apply_patch(patched, diff(old, new))
+            self.assertEqual(patched, new)
+
+    def test_copy_state_is_deep(self):
+        state = {"board": [[None, None]], "moves": ({"row": 0},)}
+        copy = copy_state(state)
+        self.assertEqual(copy, {"board": [[None, None]], "moves": [{"row": 0}]})
+        copy["board"][0][0] = "X"
+        copy["moves"][0]["row"] = 1
+        self.assertEqual(state, {"board": [[None, None]], "moves": ({"row": 0},)})
+
+
+class RecordingEngineClient(object):
+    """
+        An engine client that records the frames it is written, decoded, and
+        returns the messages queued for the engine when polled.
+
+        :param accepts_deltas: Whether the client accepts state deltas.
+        :type accepts_deltas: boolean
+    """
+
+    def __init__(self, accepts_deltas):
+        self.codec = stratumgs.codec.get_codec(stratumgs.codec.DEFAULT_CODEC)
+        self.accepts_deltas = accepts_deltas
+        self.frames = []
+        self.messages = collections.deque()
+
+    def write_frame(self, frame):
+        frame_type, _, _ = stratumgs.protocol.HEADER.unpack_from(frame)
+        self.frames.append((stratumgs.protocol.TYPE_NAMES[frame_type],
+                            self.codec.decode(frame[stratumgs.protocol.HEADER.size:])))
+
+    def poll(self):
+        return self.messages.popleft() if self.messages else None
+
+    def get_frame_types(self):
+        return "".join("D" if frame_type == "delta" else "M" for frame_type, _ in self.frames)
+
+    def get_states(self):
+        states = []
+        for frame_type, payload in self.frames:
+            if frame_type == "delta":
+                states.append(apply_patch(copy_state(states[-1]), payload))
+            else:
+                states.append(payload)
+        return states
+
+
+class CountingEngine(stratumgs.game.engine.engine.BaseEngine):
+    """
+        An engine whose state is a turn number and a list of moves that grows
+        every turn, with a keyframe after every three deltas.
+    """
+
+    state_keyframe_interval = 3
+
+    def __init__(self):
+        super().__init__()
+        self.turn = 0
+        self.moves = []
+        self.view = RecordingEngineClient(True)
+        self.players = [RecordingEngineClient(True), RecordingEngineClient(False)]
+        self._view_client = self.view
+        self._player_clients = self.players
+        self.num_players = len(self.players)
+
+    def get_state(self):
+        return {"turn": self.turn, "moves": self.moves, "board": {"last": self.turn % 2}}
+
+    def play(self, force_view=False):
+        self.turn += 1
+        self.moves.append(self.turn)
+        self._send_state(force_view)
+
+    def set_view_states_wanted(self, wanted):
+        self.view.messages.append({"type": "views", "payload": wanted})
+
+
+class KeyframeSpacingTest(unittest.TestCase):
+
+    def test_keyframe_after_interval(self):
+        engine = CountingEngine()
+        engine._send_state(force_view=True)
+        for _ in range(8):
+            engine.play()
+        self.assertEqual(engine.view.get_frame_types(), "MDDDMDDDM")
+        self.assertEqual(engine.players[0].get_frame_types(), "MDDDMDDDM")
+        self.assertEqual(engine.players[1].get_frame_types(), "MMMMMMMMM")
+        expected = [{"turn": turn, "moves": list(range(1, turn + 1)), "board": {"last": turn % 2}}
+                    for turn in range(9)]
+        self.assertEqual(engine.view.get_states(), expected)
+        self.assertEqual(engine.players[0].get_states(), expected)
+        self.assertEqual(engine.players[1].get_states(), expected)
+
+    def test_no_deltas_without_interval(self):
+        engine = CountingEngine()
+        engine.state_keyframe_interval = 0
+        engine._send_state(force_view=True)
+        for _ in range(3):
+            engine.play()
+        self.assertEqual(engine.view.get_frame_types(), "MMMM")
+        self.assertEqual(engine.players[0].get_frame_types(), "MMMM")
+
+    def test_view_wanted_again_is_sent_keyframe(self):
+        engine = CountingEngine()
+        engine._send_state(force_view=True)
+        engine.play()
+        engine.set_view_states_wanted(False)
+        engine.play()
+        engine.play()
+        engine.set_view_states_wanted(True)
+        engine.play()
+        engine.play()
+        self.assertEqual(engine.view.get_frame_types(), "MDMD")
+        self.assertEqual([state["turn"] for state in engine.view.get_states()], [0, 1, 4, 5])
+        self.assertEqual(engine.players[0].get_frame_types(), "MDDDMD")
+        self.assertEqual(len(engine.players[0].get_states()), 6)
+
+    def test_forced_view_after_skipped_states_is_sent_keyframe(self):
+        engine = CountingEngine()
+        engine._send_state(force_view=True)
+        engine.set_view_states_wanted(False)
+        engine.play()
+        engine.play()
+        engine.play(force_view=True)
+        self.assertEqual(engine.view.get_frame_types(), "MM")
+        self.assertEqual(engine.view.get_states()[-1]["moves"], [1, 2, 3])
+        self.assertEqual(engine.players[0].get_frame_types(), "MDDD")
+        self.assertEqual(engine.players[0].get_states()[-1]["moves"], [1, 2, 3])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+import unittest
+
+import stratumgs.codec
+import stratumgs.game.games.gomoku
+import stratumgs.game.games.mnk
+import stratumgs.game.games.tictactoe
+
+from stratumgs.game.engine.local import QueueEndpoint
+
+
+class FourByFiveEngine(stratumgs.game.games.mnk.MNKEngine):
+    """
+        A 4,5,3-game, small enough to reach every edge of the board in a few
+        moves.
+    """
+
+    rows = 4
+    columns = 5
+    k = 3
+
+
+class MNKEngineTest(unittest.TestCase):
+
+    def play(self, engine_class, moves):
+        """
+            Play moves, alternating between X and O, through the engine's
+            turns, checking after each whether the game is over both with
+            ``is_game_over_after`` and by scanning the whole board.
+
+            :returns: Whether the game was over after each move, and the
+                      engine.
+        """
+
+        endpoints = [QueueEndpoint(asynchronous=True) for _ in range(2)]
+        engine = engine_class(
+            players=[(endpoint, stratumgs.codec.DEFAULT_CODEC, False) for endpoint in endpoints],
+            view_connection=QueueEndpoint(asynchronous=True))
+        game_over = []
+        for i, (row, column) in enumerate(moves):
+            endpoints[i % 2].put({"type": "message", "payload": {"row": row, "column": column}})
+            move = engine.play_turn().result()
+            game_over.append(engine.is_game_over_after(move))
+            self.assertEqual(engine.is_game_over(), game_over[-1])
+        return game_over, engine
+
+    def test_runs_do_not_wrap_across_rows(self):
+        # X fills the end of row 0 and the start of row 1, which would be
+        # adjacent bits without the padding
+        game_over, engine = self.play(FourByFiveEngine, [(0, 3), (3, 0), (0, 4), (3, 2), (1, 0)])
+        self.assertEqual(game_over, [False] * 5)
+        self.assertIsNone(engine.get_state()["winner"])
+
+    def test_diagonals_do_not_wrap_across_rows(self):
+        # without the padding, X's spaces would be a run along the
+        # anti-diagonal step, from the end of row 0 onto row 1
+        game_over, engine = self.play(FourByFiveEngine, [(0, 0), (3, 0), (0, 4), (3, 2), (1, 3)])
+        self.assertEqual(game_over, [False] * 5)
+
+    def test_diagonal_ending_in_corner(self):
+        game_over, engine = self.play(FourByFiveEngine, [(1, 2), (0, 0), (2, 3), (0, 1), (3, 4)])
+        self.assertEqual(game_over, [False] * 4 + [True])
+        self.assertEqual(engine.get_state()["winner"], "X")
+
+    def test_diagonal_completed_in_middle(self):
+        game_over, engine = self.play(FourByFiveEngine, [(1, 2), (0, 0), (3, 4), (0, 1), (2, 3)])
+        self.assertEqual(game_over, [False] * 4 + [True])
+        self.assertEqual(engine.get_state()["winner"], "X")
+
+    def test_anti_diagonal_through_corners(self):
+        game_over, engine = self.play(FourByFiveEngine,
+                                      [(3, 3), (0, 4), (3, 4), (1, 3), (0, 0), (2, 2)])
+        self.assertEqual(game_over, [False] * 5 + [True])
+        self.assertEqual(engine.get_state()["winner"], "O")
+
+        game_over, engine = self.play(FourByFiveEngine, [(3, 0), (0, 0), (2, 1), (0, 1), (1, 2)])
+        self.assertEqual(game_over, [False] * 4 + [True])
+        self.assertEqual(engine.get_state()["winner"], "X")
+
+    def test_column_at_edge(self):
+        game_over, engine = self.play(FourByFiveEngine, [(3, 4), (0, 0), (1, 4), (0, 1), (2, 4)])
+        self.assertEqual(game_over, [False] * 4 + [True])
+        self.assertEqual(engine.get_state()["winner"], "X")
+
+    def test_draw_on_full_board(self):
+        # X O X
+        # X O O
+        # O X X
+        game_over, engine = self.play(stratumgs.game.games.tictactoe.Engine, [
+            (0, 0), (0, 1), (0, 2), (1, 1), (1, 0), (2, 0), (2, 1), (1, 2), (2, 2)])
+        self.assertEqual(game_over, [False] * 8 + [True])
+        self.assertIsNone(engine.get_state()["winner"])
+
+    def test_gomoku_needs_five_in_a_row(self):
+        x_moves = [(7, 3), (7, 4), (7, 5), (7, 6), (7, 7)]
+        o_moves = [(0, 0), (0, 1), (0, 2), (0, 3)]
+        moves = [move for pair in zip(x_moves, o_moves) for move in pair] + [x_moves[-1]]
+        game_over, engine = self.play(stratumgs.game.games.gomoku.Engine, moves)
+        self.assertEqual(game_over, [False] * 8 + [True])
+        self.assertEqual(engine.get_state()["winner"], "X")
+
+    def test_gomoku_does_not_accept_four_in_a_row(self):
+        # X gets four in a row in each direction, the last at the edge of the
+        # board, and continues onto the next row
+        x_moves = [(0, 11), (0, 12), (0, 13), (0, 14), (1, 0),
+                   (5, 5), (6, 6), (7, 7), (8, 8),
+                   (10, 3), (11, 2), (12, 1), (13, 0),
+                   (3, 9), (4, 9), (5, 9), (6, 9)]
+        o_moves = [(14, 2 * i % 15) if i < 8 else (13, 2 * i % 15 + 1) for i in range(16)]
+        moves = [move for pair in zip(x_moves, o_moves) for move in pair] + [x_moves[-1]]
+        game_over, engine = self.play(stratumgs.game.games.gomoku.Engine, moves)
+        self.assertEqual(game_over, [False] * len(moves))
+        self.assertIsNone(engine.get_state()["winner"])
+
+
+if __name__ == "__main__":
+    unittest.main()
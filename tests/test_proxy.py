@@ -0,0 +1,77 @@
+import unittest
+
+import tornado.gen
+import tornado.testing
+
+import stratumgs.client.proxy
+import stratumgs.client.server
+import stratumgs.protocol
+
+
+class NeverReadingStream(object):
+    """
+        A client's stream for a client that never reads, so nothing written to
+        it is ever sent, and its write callbacks are never called.
+    """
+
+    def __init__(self):
+        self._write_buffer_size = 0
+        self.is_closed = False
+
+    def write(self, data, callback=None):
+        self._write_buffer_size += len(data)
+
+    def read_until(self, delimeter, callback):
+        pass
+
+    def read_bytes(self, num_bytes, callback):
+        pass
+
+    def closed(self):
+        return self.is_closed
+
+    def close(self):
+        self.is_closed = True
+
+
+class SlowClientTest(tornado.testing.AsyncTestCase):
+
+    def start_game(self, slow_client_policy):
+        self.stream = NeverReadingStream()
+        stream_proxy = stratumgs.client.server.StreamProxy(
+            self.stream, max_buffer_size=10000, pause_buffer_size=2000,
+            slow_client_policy=slow_client_policy)
+        self.proxy = stratumgs.client.proxy.ClientProxy(
+            "slow", ["tictactoe"], 1, stream_proxy,
+            framing=stratumgs.protocol.LENGTH_PREFIXED_FRAMING)
+        engine_end, _, _ = self.proxy.create_endpoints_for_game(0)
+        return engine_end
+
+    @tornado.gen.coroutine
+    def write_states(self, engine_end, num_states):
+        for _ in range(num_states):
+            if self.stream.closed():
+                break
+            engine_end.write(stratumgs.protocol.encode_frame(
+                stratumgs.protocol.MESSAGE, 0, b"x" * 1000))
+            yield tornado.gen.moment
+
+    @tornado.testing.gen_test
+    def test_client_that_never_reads_is_disconnected(self):
+        engine_end = self.start_game(stratumgs.client.server.DISCONNECT_POLICY)
+        yield self.write_states(engine_end, 100)
+        self.assertTrue(self.stream.closed())
+        self.assertLess(engine_end.get_unread_size(), 12000)
+
+    @tornado.testing.gen_test
+    def test_engine_data_counts_toward_the_limit_while_paused(self):
+        engine_end = self.start_game(stratumgs.client.server.IGNORE_POLICY)
+        yield self.write_states(engine_end, 20)
+        self.assertFalse(self.stream.closed())
+        self.assertLess(self.stream._write_buffer_size, 10000)
+        self.assertGreater(engine_end.get_unread_size(), 0)
+        self.assertGreater(self.proxy.stream.get_buffered_size(), 20000)
+
+
+if __name__ == "__main__":
+    unittest.main()
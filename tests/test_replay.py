@@ -0,0 +1,131 @@
+import json
+import os
+import tempfile
+import unittest
+
+import stratumgs.game.replay
+import stratumgs.protocol
+
+from stratumgs.game.engine.delta import apply_patch, copy_state, diff
+
+
+class ReplayTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        stratumgs.game.replay.init(self.directory)
+        self.addCleanup(stratumgs.game.replay.init, "")
+
+    def record(self, game_id, num_turns, keyframe_interval):
+        """
+            Record a game whose board fills one space per turn, with a full
+            state after every ``keyframe_interval`` deltas.
+
+            :returns: The states of the game, by turn.
+        """
+
+        states = []
+        writer = stratumgs.game.replay.open_replay_writer(game_id)
+        for turn in range(num_turns):
+            state = {"type": "state", "board": [[None] * 3 for _ in range(3)], "turn": turn}
+            if states:
+                state = copy_state(states[-1])
+                state["board"][turn // 3 % 3][turn % 3] = "XO"[turn % 2]
+                state["turn"] = turn
+            if states and turn % (keyframe_interval + 1) != 0:
+                writer.append(stratumgs.protocol.DELTA,
+                              json.dumps(diff(states[-1], state)).encode())
+            else:
+                writer.append(stratumgs.protocol.MESSAGE, json.dumps(state).encode())
+            states.append(state)
+        writer.close()
+        return states
+
+    def apply(self, state, message):
+        """
+            Apply a view message to a state, as a view does.
+        """
+
+        message = json.loads(message.decode())
+        if message["type"] == "delta":
+            return apply_patch(state, message["payload"])
+        self.assertEqual(message["type"], "message")
+        return message["payload"]
+
+    def test_seek_to_every_turn(self):
+        states = self.record(0, 10, 3)
+        replay = stratumgs.game.replay.load_replay(0)
+        self.addCleanup(replay.close)
+        self.assertEqual(replay.get_num_turns(), 10)
+        for turn, expected in enumerate(states):
+            messages = replay.seek(turn)
+            # the last full state, and the deltas since
+            self.assertEqual(len(messages), turn % 4 + 1)
+            self.assertEqual(json.loads(messages[0].decode())["type"], "message")
+            state = None
+            for message in messages:
+                state = self.apply(state, message)
+            self.assertEqual(state, expected)
+
+    def test_play_from_seek(self):
+        states = self.record(0, 10, 3)
+        replay = stratumgs.game.replay.load_replay(0)
+        self.addCleanup(replay.close)
+        state = None
+        for message in replay.seek(5):
+            state = self.apply(state, message)
+        for turn in range(6, 10):
+            state = self.apply(state, replay.get_turn(turn))
+            self.assertEqual(state, states[turn])
+
+    def test_game_without_deltas(self):
+        states = self.record(0, 4, 0)
+        replay = stratumgs.game.replay.load_replay(0)
+        self.addCleanup(replay.close)
+        for turn, expected in enumerate(states):
+            messages = replay.seek(turn)
+            self.assertEqual(len(messages), 1)
+            self.assertEqual(json.loads(messages[0].decode()),
+                             {"type": "message", "payload": expected})
+
+    def test_unfinished_replay_cannot_be_loaded(self):
+        writer = stratumgs.game.replay.open_replay_writer(0)
+        writer.append(stratumgs.protocol.MESSAGE, b"{}")
+        self.assertIsNone(stratumgs.game.replay.load_replay(0))
+        writer.close()
+        replay = stratumgs.game.replay.load_replay(0)
+        self.addCleanup(replay.close)
+        self.assertEqual(replay.get_num_turns(), 1)
+        self.assertIsNone(stratumgs.game.replay.load_replay(1))
+
+    def test_replays_are_not_overwritten(self):
+        states = self.record(0, 3, 3)
+        self.assertIsNone(stratumgs.game.replay.open_replay_writer(0))
+        replay = stratumgs.game.replay.load_replay(0)
+        self.addCleanup(replay.close)
+        self.assertEqual(replay.get_num_turns(), 3)
+        self.assertEqual(json.loads(replay.get_turn(0).decode())["payload"], states[0])
+
+    def test_get_next_game_id(self):
+        self.assertEqual(stratumgs.game.replay.get_next_game_id(), 0)
+        self.record(3, 2, 3)
+        self.assertEqual(stratumgs.game.replay.get_next_game_id(), 4)
+        self.record(1, 2, 3)
+        # an unfinished replay still takes its game ID
+        stratumgs.game.replay.open_replay_writer(7)._replay_file.close()
+        for filename in ("10.index", "notes.replay", "12.txt"):
+            open(os.path.join(self.directory, filename), "w").close()
+        self.assertEqual(stratumgs.game.replay.get_next_game_id(), 8)
+
+    def test_disabled(self):
+        stratumgs.game.replay.init("")
+        self.assertFalse(stratumgs.game.replay.is_enabled())
+        self.assertIsNone(stratumgs.game.replay.open_replay_writer(0))
+        self.assertIsNone(stratumgs.game.replay.load_replay(0))
+        self.assertEqual(stratumgs.game.replay.get_next_game_id(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+import json
+import tempfile
+import unittest
+
+import tornado.gen
+import tornado.testing
+
+import stratumgs.codec
+import stratumgs.game
+import stratumgs.game.engine.local
+import stratumgs.game.replay
+import stratumgs.game.runner
+import stratumgs.protocol
+
+
+class RecordingEngineRunner(stratumgs.game.runner.BaseEngineRunner):
+    """
+        An engine runner without an engine, which records whether it has told
+        the engine that view states are wanted.
+    """
+
+    def start_engine(self, engine_constructor, player_endpoints, view_connection):
+        self.view_states_wanted = []
+
+    def send_view_states_wanted(self, wanted):
+        self.view_states_wanted.append(wanted)
+
+
+class FirstEmptySpacePlayer(object):
+    """
+        A player of board games connected to the engine with an in memory
+        stream, as a client proxy is, which always plays the first empty space.
+        It does not accept deltas, so it is sent every state in full.
+
+        :param name: The name of the player.
+        :type name: string
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.moves = []
+        self._board = None
+        self._stream = None
+
+    def create_endpoints_for_game(self, game_id):
+        self._stream, engine_end = stratumgs.game.engine.local.make_local_stream_pair()
+        stratumgs.protocol.read_frame(self._stream.read_bytes, self._on_frame)
+        return engine_end, stratumgs.codec.DEFAULT_CODEC, False
+
+    def _on_frame(self, frame_type, game_id, payload):
+        if frame_type != stratumgs.protocol.MESSAGE:
+            return
+        message = json.loads(payload.decode())
+        if message["type"] == "state":
+            self._board = message["board"]
+        elif message["type"] in ("turn", "repeat-turn"):
+            move = next({"row": row, "column": col} for row, cells in enumerate(self._board)
+                        for col, cell in enumerate(cells) if cell is None)
+            self.moves.append(move)
+            self._stream.write(stratumgs.protocol.encode_frame(
+                stratumgs.protocol.MESSAGE, game_id, json.dumps(move).encode()))
+        stratumgs.protocol.read_frame(self._stream.read_bytes, self._on_frame)
+
+
+class ViewStatesWantedTest(tornado.testing.AsyncTestCase):
+
+    def tearDown(self):
+        stratumgs.game.replay.init("")
+        super().tearDown()
+
+    def start_runner(self, game_id):
+        return RecordingEngineRunner(game_id, None, "tictactoe", [])
+
+    def test_unwatched_game_skips_view_states(self):
+        stratumgs.game.replay.init("")
+        runner = self.start_runner(0)
+        self.assertEqual(runner.view_states_wanted, [False])
+
+        view = object()
+        runner.add_view(view)
+        self.assertEqual(runner.view_states_wanted, [False, True])
+        runner.remove_view(view)
+        self.assertEqual(runner.view_states_wanted, [False, True, False])
+
+    def test_recorded_game_sends_view_states(self):
+        with tempfile.TemporaryDirectory() as directory:
+            stratumgs.game.replay.init(directory)
+            runner = self.start_runner(1)
+            self.assertEqual(runner.view_states_wanted, [])
+
+            view = object()
+            runner.add_view(view)
+            runner.remove_view(view)
+            self.assertEqual(runner.view_states_wanted, [])
+            runner._replay.close()
+
+
+    @tornado.testing.gen_test
+    def test_unwatched_delta_game_records_final_state(self):
+        stratumgs.game.replay.init("")
+        players = [FirstEmptySpacePlayer("first"), FirstEmptySpacePlayer("second")]
+        runner = stratumgs.game.runner.LocalEngineRunner(
+            0, stratumgs.game.get_engine_class("gomoku"), "gomoku", players)
+        while runner.is_running:
+            yield tornado.gen.sleep(0.01)
+
+        final_state = runner.get_record().final_state
+        self.assertIsNotNone(final_state["winner"])
+        for player, letter in zip(players, ("X", "O")):
+            for move in player.moves:
+                self.assertEqual(final_state["board"][move["row"]][move["column"]], letter)
+        num_pieces = sum(cell is not None for cells in final_state["board"] for cell in cells)
+        self.assertEqual(num_pieces, len(players[0].moves) + len(players[1].moves))
+
+
+if __name__ == "__main__":
+    unittest.main()
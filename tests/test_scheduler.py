@@ -0,0 +1,189 @@
+import collections
+import itertools
+import unittest
+import unittest.mock
+
+import stratumgs.client.server
+import stratumgs.game
+import stratumgs.game.scheduler
+
+
+GameRecord = collections.namedtuple("GameRecord", ["game_id", "final_state"])
+
+
+class SchedulerTest(unittest.TestCase):
+    """
+        Runs tournaments against simulated clients, each with a number of game
+        slots, without starting any engines.
+    """
+
+    def setUp(self):
+        self.slots = {}
+        self.game_ids = itertools.count()
+        self.running_games = {}
+        patches = [
+            unittest.mock.patch.object(stratumgs.client.server,
+                                       "get_available_client_names_for_game",
+                                       self.get_available_client_names_for_game),
+            unittest.mock.patch.object(stratumgs.game, "init_game_engine", self.init_game_engine)
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def get_available_client_names_for_game(self, game):
+        return sorted(name for name, slots in self.slots.items() if slots > 0)
+
+    def init_game_engine(self, engine_name, names):
+        game_id = next(self.game_ids)
+        for name in names:
+            self.slots[name] -= 1
+        self.running_games[game_id] = names
+        return game_id
+
+    def connect(self, names, num_slots=1):
+        for name in names:
+            self.slots[name] = num_slots
+
+    def schedule(self, tournament):
+        """
+            Schedule games, and return the pairs of players that were started.
+        """
+
+        started = set(self.running_games)
+        tournament.schedule_games()
+        return [tuple(names) for game_id, names in sorted(self.running_games.items())
+                if game_id not in started]
+
+    def finish(self, tournament, winners=None):
+        """
+            Finish every running game, freeing its players' slots. The winner of
+            each game is looked up by its pair of players, and is ``None`` for a
+            draw.
+        """
+
+        winners = winners or {}
+        for game_id, names in sorted(self.running_games.items()):
+            for name in names:
+                self.slots[name] += 1
+            winner = winners.get(tuple(names))
+            tournament.on_game_finished(GameRecord(game_id, {"winner": winner}))
+        self.running_games.clear()
+
+    def test_round_robin_pairs_in_rounds(self):
+        tournament = stratumgs.game.scheduler.RoundRobinTournament(0, "tictactoe", 0)
+        self.connect(["a", "b", "c", "d"])
+        rounds = []
+        for _ in range(3):
+            rounds.append(self.schedule(tournament))
+            self.finish(tournament)
+        self.assertEqual(rounds, [[("a", "d"), ("b", "c")],
+                                  [("a", "b"), ("c", "d")],
+                                  [("a", "c"), ("b", "d")]])
+        self.assertEqual([tournament.get_round("a", name) for name in "bcd"], [1, 2, 0])
+
+    def test_round_robin_rotates_bye(self):
+        tournament = stratumgs.game.scheduler.RoundRobinTournament(0, "tictactoe", 0)
+        self.connect(["a", "b", "c", "d", "e"])
+        left_over = []
+        for _ in range(5):
+            playing = {name for pair in self.schedule(tournament) for name in pair}
+            left_over.extend(set(self.slots) - playing)
+            self.finish(tournament)
+        self.assertEqual(sorted(left_over), ["a", "b", "c", "d", "e"])
+
+    def test_round_robin_does_not_repeat_pairings(self):
+        for num_players in range(2, 11):
+            names = [chr(ord("a") + i) for i in range(num_players)]
+            tournament = stratumgs.game.scheduler.RoundRobinTournament(0, "tictactoe", 0)
+            self.slots = {}
+            self.connect(names)
+            pairings = collections.Counter()
+            num_pairs = num_players * (num_players - 1) // 2
+            while sum(pairings.values()) < num_pairs:
+                for pair in self.schedule(tournament):
+                    pairings[frozenset(pair)] += 1
+                self.finish(tournament)
+            self.assertEqual(sorted(pairings.values()), [1] * num_pairs, names)
+
+    def test_round_robin_alternates_first_player(self):
+        tournament = stratumgs.game.scheduler.RoundRobinTournament(0, "tictactoe", 0)
+        self.connect(["a", "b"])
+        games = []
+        for _ in range(3):
+            games.extend(self.schedule(tournament))
+            self.finish(tournament)
+        self.assertEqual(games, [("a", "b"), ("b", "a"), ("a", "b")])
+
+    def test_swiss_pairs_by_points(self):
+        tournament = stratumgs.game.scheduler.SwissTournament(0, "tictactoe", 0)
+        self.connect(["a", "b", "c", "d"])
+        self.assertEqual(self.schedule(tournament), [("a", "b"), ("c", "d")])
+        self.finish(tournament, {("a", "b"): "O", ("c", "d"): "O"})
+        # the winners, b and d, are paired first, and then the losers
+        self.assertEqual(tournament.get_pairing_order(["a", "b", "c", "d"]),
+                         ["b", "d", "a", "c"])
+        self.assertEqual(sorted(map(sorted, self.schedule(tournament))),
+                         [["a", "c"], ["b", "d"]])
+
+    def test_ladder_pairs_neighbors(self):
+        tournament = stratumgs.game.scheduler.LadderTournament(0, "tictactoe", 0)
+        self.connect(["a", "b", "c", "d"])
+        self.assertEqual(self.schedule(tournament), [("a", "b"), ("c", "d")])
+        # d climbs over c, and then over b
+        self.finish(tournament, {("c", "d"): "O"})
+        self.assertEqual(tournament.ladder, ["a", "b", "d", "c"])
+        self.assertEqual(sorted(map(sorted, self.schedule(tournament))),
+                         [["a", "b"], ["c", "d"]])
+        self.finish(tournament)
+        tournament.on_result("d", "b")
+        self.assertEqual(tournament.ladder, ["a", "d", "b", "c"])
+        self.assertEqual([standing.name for standing in tournament.get_ranked_standings()],
+                         ["a", "d", "b", "c"])
+        self.assertEqual(tournament.get_pairing_order(["c", "b", "a", "d"]),
+                         ["a", "d", "b", "c"])
+
+    def test_max_games(self):
+        tournament = stratumgs.game.scheduler.RoundRobinTournament(0, "tictactoe", 4)
+        self.connect(["a", "b", "c", "d", "e", "f"], num_slots=3)
+        self.assertEqual(len(self.schedule(tournament)), 4)
+        self.assertFalse(tournament.is_running)
+        self.finish(tournament)
+        self.assertEqual(self.schedule(tournament), [])
+        self.assertEqual(tournament.num_finished_games, 4)
+
+    def test_stops_scheduling_when_fewer_than_two_clients(self):
+        tournament = stratumgs.game.scheduler.RoundRobinTournament(0, "tictactoe", 0)
+        self.connect(["a", "b", "c"], num_slots=2)
+        self.assertEqual(len(self.schedule(tournament)), 3)
+        self.assertTrue(tournament.is_running)
+        self.assertEqual(self.get_available_client_names_for_game("tictactoe"), [])
+
+    def test_draws(self):
+        tournament = stratumgs.game.scheduler.LadderTournament(0, "tictactoe", 0)
+        self.connect(["a", "b"])
+        self.schedule(tournament)
+        self.finish(tournament)
+        self.schedule(tournament)
+        # a final state that is not a dict is also a draw
+        tournament.on_game_finished(GameRecord(1, None))
+        for name in ("a", "b"):
+            standing = tournament.standings[name]
+            self.assertEqual((standing.wins, standing.draws, standing.losses), (0, 2, 0))
+            self.assertEqual(standing.get_points(), 1)
+        self.assertEqual(tournament.ladder, ["a", "b"])
+        self.assertEqual(tournament.num_finished_games, 2)
+
+    def test_wins(self):
+        tournament = stratumgs.game.scheduler.RoundRobinTournament(0, "tictactoe", 0)
+        self.connect(["a", "b"])
+        self.schedule(tournament)
+        self.finish(tournament, {("a", "b"): "O"})
+        self.assertEqual(tournament.standings["b"].wins, 1)
+        self.assertEqual(tournament.standings["a"].losses, 1)
+        self.assertEqual([standing.name for standing in tournament.get_ranked_standings()],
+                         ["b", "a"])
+
+
+if __name__ == "__main__":
+    unittest.main()